@@ -3,13 +3,17 @@ import uuid
 
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response
 import os
 import random
+import threading
+import time
 from bing_search import ThesisTopicGenerator  # Import the thesis generator
 from cosmos import CosmosDBClient  # Import the CosmosDBClient
+from metrics import REGISTRY, HTTP_REQUEST_SECONDS, TRACE_HEADER, start_trace, timed, record_llm_usage
+from search_index import PaperSearchIndex, date_number
 from datetime import datetime, timezone, timedelta
-from openai import OpenAI
+from http_client import get_openai_client
 
 COSMOS_URL = ''
 COSMOS_KEY = ""
@@ -19,12 +23,36 @@ PARTITION_KEY = ''  # Ensure this matches the partition key path in your Cosmos
 
 USER_ID = ""
 
-AZURE_SEARCH_SERVICE = ""
+AZURE_SEARCH_SERVICE = os.getenv('AZURE_SEARCH_SERVICE', '')
 SEARCH_CLIENT = SearchClient(
     endpoint=AZURE_SEARCH_SERVICE,
     index_name="",
     credential=AzureKeyCredential("")
 )
+# Chat completions; the base URL defaults to the OpenAI API
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+# Local full-text index over the pipeline output, loaded on the first request and refreshed in
+# the background as new query results are written (SEARCH_REFRESH_SECONDS=0 loads it only once)
+PIPELINE_OUTPUT_DIR = os.getenv('PIPELINE_OUTPUT_DIR', 'pipeline_output')
+SEARCH_REFRESH_SECONDS = float(os.getenv('SEARCH_REFRESH_SECONDS', '5'))
+MAX_SEARCH_RESULTS = 100
+PAPER_SEARCH_INDEX = PaperSearchIndex()
+_search_index_started = False
+_search_index_lock = threading.Lock()
+
+
+def start_search_index():
+    """Load the pipeline output into PAPER_SEARCH_INDEX and start its refresh thread, once per process."""
+    global _search_index_started
+    with _search_index_lock:
+        if _search_index_started:
+            return
+        PAPER_SEARCH_INDEX.refresh(PIPELINE_OUTPUT_DIR)
+        if SEARCH_REFRESH_SECONDS > 0:
+            PAPER_SEARCH_INDEX.start_refresh(PIPELINE_OUTPUT_DIR, interval=SEARCH_REFRESH_SECONDS)
+        _search_index_started = True
+
 # Chat prompt template
 GROUNDED_PROMPT = """
 You are a friendly assistant that recommends papers.
@@ -54,9 +82,31 @@ cosmos_client_query_metadata = CosmosDBClient(
     container_name="query_metadata",
     partition_key=PARTITION_KEY
 )
-app = Flask(__name__)
+app = Flask(__name__, template_folder='template')
+
+
+@app.before_request
+def start_request_trace():
+    # Reuse the caller's request id so traces can be followed across services
+    g.trace_id = start_trace(request.headers.get(TRACE_HEADER))
+    g.request_start = time.perf_counter()
+    if not _search_index_started:
+        start_search_index()
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                                 route=route, method=request.method, status=response.status_code)
+    response.headers['X-Trace-Id'] = g.trace_id
+    return response
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 
 @app.route('/')
 def home():
@@ -74,28 +124,31 @@ def chat():
         if show_sources and chat_history:
             context_text = '\n'.join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in chat_history])
 
-        search_results = SEARCH_CLIENT.search(
-            search_text=user_query+context_text,
-            top=5,
-            select="title,authors,tldr,referenceCount,citationCount,pdf_url,summary,Tag_1,Tag_2,Tag_3,Tag_4,Tag_5,field"
-        )
-        sources = [
-            dict(paper) for paper in search_results
-        ]
+        # Results are paged lazily, so the timer also covers reading them
+        with timed("azure_search", "search"):
+            search_results = SEARCH_CLIENT.search(
+                search_text=user_query+context_text,
+                top=5,
+                select="title,authors,tldr,referenceCount,citationCount,pdf_url,summary,Tag_1,Tag_2,Tag_3,Tag_4,Tag_5,field"
+            )
+            sources = [
+                dict(paper) for paper in search_results
+            ]
         print(sources)
         prompt = GROUNDED_PROMPT.format(query=user_query, sources=sources)
-        client = OpenAI(
-            api_key="")
-        response = client.chat.completions.create(
-            model="",
-            messages=[{
-            "role": "user",
-            "content": prompt
-        }],
-            max_tokens=500,  # Adjust as needed
-            temperature=0.5,
-            n=1
-        )
+        client = get_openai_client(OPENAI_API_KEY, OPENAI_BASE_URL)
+        with timed("openai", "chat"):
+            response = client.chat.completions.create(
+                model="",
+                messages=[{
+                "role": "user",
+                "content": prompt
+            }],
+                max_tokens=500,  # Adjust as needed
+                temperature=0.5,
+                n=1
+            )
+        record_llm_usage(response, "chat")
         # response = openai.generate(prompt)
         return jsonify({'response': response.choices[0].message.content })
     else:
@@ -110,6 +163,16 @@ def power_search():
         session_id = data.get('id')
         date_from = data.get('date_from')
         date_to = data.get('date_to')
+        try:
+            top = int(data.get('top', 20))
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'top must be a whole number.'}), 400
+        if top < 1:
+            return jsonify({'status': 'error', 'message': 'top must be at least 1.'}), 400
+        top = min(top, MAX_SEARCH_RESULTS)
+        for name, value in (('date_from', date_from), ('date_to', date_to)):
+            if value and not date_number(value):
+                return jsonify({'status': 'error', 'message': f'{name} must be a date (YYYY-MM-DD or YYYY-MM).'}), 400
 
         # Enforce mutual exclusivity between query and id
         if query_text and session_id:
@@ -119,13 +182,24 @@ def power_search():
 
         # Proceed based on whether query or id is provided
         if session_id:
-            # Use the existing session ID to perform search
-            # Here, you would retrieve the session data from Cosmos DB and perform the search
-            return jsonify({'status': 'success', 'message': f'Searching using session ID: {session_id}'})
-        else:
-            # Use the query text to perform a new search
-            # Save the new search query to Cosmos DB if necessary
-            return jsonify({'status': 'success', 'message': f'Searching using query: {query_text}'})
+            # Search for the topics selected in the session
+            query_metadata = cosmos_client_query_metadata.query_documents(
+                query="SELECT * FROM c WHERE c.id = @id",
+                parameters=[{"name": "@id", "value": session_id}]
+            )
+            if not query_metadata:
+                return jsonify({'status': 'error', 'message': 'Session not found.'}), 404
+            query_list = query_metadata[0].get("selected_topics", [])
+            query_text = " ".join(t.split("|")[-1] for layer in query_list for t in layer)
+
+        start = time.perf_counter()
+        results = PAPER_SEARCH_INDEX.search(query_text, k=top, date_from=date_from, date_to=date_to)
+        return jsonify({
+            'status': 'success',
+            'message': f'Found {len(results)} papers for: {query_text}',
+            'results': results,
+            'took_ms': round(1000 * (time.perf_counter() - start), 2)
+        })
     else:
         return render_template('power_search.html')
 
@@ -148,7 +222,8 @@ def query_submit():
     # Proceed based on whether query or id is provided
     if session_id:
         query_metadata = cosmos_client_query_metadata.query_documents(
-            query=f"SELECT * FROM c WHERE c.id = '{session_id}'"
+            query="SELECT * FROM c WHERE c.id = @id",
+            parameters=[{"name": "@id", "value": session_id}]
         )
         if not query_metadata:
             return jsonify({'status': 'error', 'message': 'Session not found.'}), 404
@@ -216,7 +291,8 @@ def check_id():
     # Query Cosmos DB to check if the ID exists
     try:
         document = cosmos_client_query_metadata.query_documents(
-            query=f"SELECT * FROM c WHERE c.id = '{session_id}' AND c.user_id = '{user_id}'"
+            query="SELECT * FROM c WHERE c.id = @id AND c.user_id = @user_id",
+            parameters=[{"name": "@id", "value": session_id}, {"name": "@user_id", "value": user_id}]
         )
         if document:
             # ID exists
@@ -230,8 +306,9 @@ def check_id():
 @app.route('/metadata_store', methods=['GET'])
 def view_history():
     user_id = USER_ID  # Replace with dynamic user ID logic if available
-    query = f"SELECT * FROM c WHERE c.user_id = '{user_id}'"
-    user_sessions = cosmos_client_query_metadata.query_documents(query)  # Fetch all documents for the user
+    query = "SELECT * FROM c WHERE c.user_id = @user_id"
+    user_sessions = cosmos_client_query_metadata.query_documents(
+        query, parameters=[{"name": "@user_id", "value": user_id}])  # Fetch all documents for the user
 
     # Sort sessions by timestamp if needed
     user_sessions = sorted(user_sessions, key=lambda x: x['metadata']['created_at'], reverse=True)
@@ -349,7 +426,8 @@ def update_topics():
     # Query the document to update based on session ID and user ID
     try:
         document = cosmos_client_query_metadata.query_documents(
-            query=f"SELECT * FROM c WHERE c.id = '{session_id}'"
+            query="SELECT * FROM c WHERE c.id = @id",
+            parameters=[{"name": "@id", "value": session_id}]
         )
         if not document:
             return jsonify({'status': 'error', 'message': 'Session not found.'}), 404
@@ -386,7 +464,8 @@ def delete_session(session_id):
 
         # Query the document by its ID
         document = cosmos_client_query_metadata.query_documents(
-            query=f"SELECT * FROM c WHERE c.id = '{session_id}'",
+            query="SELECT * FROM c WHERE c.id = @id",
+            parameters=[{"name": "@id", "value": session_id}]
         )
 
         # Check if document exists
@@ -1,9 +1,61 @@
 import arxiv
 import os
 import csv
-import zlib
+import re
+import hashlib
 import pandas as pd
 import calendar
+from datetime import datetime
+
+from http_client import get_http_client
+from metrics import timed
+from paper_batch import PaperBatch
+
+SEMANTIC_SCHOLAR_API_URL = os.getenv('SEMANTIC_SCHOLAR_API_URL', 'https://api.semanticscholar.org')
+# Overrides the arXiv export API endpoint, e.g. to point at a local stand-in
+ARXIV_API_URL = os.getenv('ARXIV_API_URL')
+
+# Column order of the bronze/silver paper tables (see the arxiv-search notebook schema)
+PAPER_FIELDS = [
+    "hash_id", "title", "authors", "published", "summary", "pdf_url", "entry_id", "recommended",
+    "referenceCount", "citationCount", "references", "citations", "s2FieldsOfStudy", "tldr",
+]
+
+# Words ignored when matching batched results back to their sub-queries
+QUERY_STOPWORDS = {
+    "a", "an", "and", "andnot", "as", "at", "by", "for", "from", "in", "into", "of", "on", "or",
+    "the", "to", "using", "via", "with",
+}
+
+
+def _normalize_term(token):
+    # Cheap plural folding so "networks" in a topic matches "network" in a title
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def paper_key(entry_id):
+    """
+    Return the version-less arXiv id used to identify a paper across queries and runs.
+
+    'http://arxiv.org/abs/2401.01234v2' and '2401.01234v1' both map to '2401.01234';
+    old-style ids keep their archive prefix ('hep-th/9901001').
+    """
+    arxiv_id = entry_id.split("/abs/")[-1]
+    return re.sub(r"v\d+$", "", arxiv_id)
+
+
+def paper_hash_id(entry_id):
+    """Return a signed 64-bit hash of the paper key, matching the LongType hash_id column."""
+    digest = hashlib.blake2b(paper_key(entry_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def query_terms(query):
+    """Return the significant, normalized terms of an arXiv query string."""
+    query = re.sub(r"\b\w+:", " ", query.lower())  # drop field prefixes such as ti: or all:
+    return {_normalize_term(t) for t in re.findall(r"[a-z0-9]+", query) if t not in QUERY_STOPWORDS}
 
 
 class ArxivResearchHelper:
@@ -18,40 +70,70 @@ class ArxivResearchHelper:
             delay_seconds=delay_seconds,
             num_retries=num_retries
         )
+        if ARXIV_API_URL:
+            self.client.query_url_format = ARXIV_API_URL + "?{}"
 
-    def search_papers(self, query, max_results=50, date_from=None, date_to=None):
+    def format_paper_id(self, entry_id):
+        """
+        Format the paper ID to match Semantic Scholar's expected format.
+
+        Parameters:
+        - entry_id (str): The arXiv entry ID.
+
+        Returns:
+        - str: Formatted paper ID.
+        """
+        arxiv_id = re.sub(r"v\d+$", "", entry_id.split("/")[-1])
+        return f"ARXIV:{arxiv_id}"
+
+    def _build_date_query(self, date_from=None, date_to=None):
+        """
+        Build the submittedDate range clause for a search.
+
+        Dates may be given as 'YYYYMM' (month granularity) or 'YYYY-MM-DD' as sent
+        by the power search form. An end month is always extended to its last day.
+        """
+        date_query = "submittedDate:["
+        # Start date
+        if date_from:
+            if "-" in date_from:
+                date_query += datetime.strptime(date_from, "%Y-%m-%d").strftime("%Y%m%d") + " TO "
+            else:
+                date_query += f"{date_from}01 TO "
+        else:
+            date_query += "* TO "
+        # End date
+        if date_to:
+            if "-" in date_to:
+                parsed = datetime.strptime(date_to, "%Y-%m-%d")
+                year, month = parsed.year, parsed.month
+            else:
+                year = int(date_to[:4])
+                month = int(date_to[4:])
+            last_day = calendar.monthrange(year, month)[1]
+            date_query += f"{year:04d}{month:02d}{last_day}]"
+        else:
+            date_query += "*]"
+        return date_query
+
+    def search_papers(self, query, max_results=50, date_from=None, date_to=None, as_batch=False):
         """
         Search for papers on arXiv with an optional date range.
 
         Parameters:
         - query (str): The search query.
         - max_results (int): Maximum number of results to return.
-        - date_from (str): Start date in 'YYYYMM' format.
-        - date_to (str): End date in 'YYYYMM' format.
+        - date_from (str): Start date in 'YYYYMM' or 'YYYY-MM-DD' format.
+        - date_to (str): End date in 'YYYYMM' or 'YYYY-MM-DD' format.
+        - as_batch (bool): Collect the results in a columnar PaperBatch instead of a list.
 
         Returns:
-        - List of dictionaries containing paper details.
+        - List of dictionaries containing paper details, or a PaperBatch of them.
         """
         # Build the date range query if date_from or date_to is specified
         if date_from or date_to:
-            date_query = "submittedDate:["
-            # Start date
-            if date_from:
-                date_from_str = f"{date_from}01"
-                date_query += f"{date_from_str} TO "
-            else:
-                date_query += "* TO "
-            # End date
-            if date_to:
-                year = int(date_to[:4])
-                month = int(date_to[4:])
-                last_day = calendar.monthrange(year, month)[1]
-                date_to_str = f"{date_to}{last_day}"
-                date_query += f"{date_to_str}]"
-            else:
-                date_query += "*]"
             # Combine the main query with the date range query
-            query = f"({query}) AND {date_query}"
+            query = f"({query}) AND {self._build_date_query(date_from, date_to)}"
 
         # Create the search object
         search = arxiv.Search(
@@ -60,43 +142,214 @@ class ArxivResearchHelper:
             sort_by=arxiv.SortCriterion.SubmittedDate  # Sort by submission date
         )
 
-        results = []
+        results = PaperBatch() if as_batch else []
         try:
             # Fetch results and store in a list
-            for result in self.client.results(search):
-                paper = {
-                    "hash_id": zlib.crc32(bytes(result.entry_id, 'utf-8')),
-                    "title": result.title,
-                    "authors": ", ".join([author.name for author in result.authors]),
-                    "published": result.published,
-                    "summary": result.summary,
-                    "pdf_url": result.pdf_url,
-                    "entry_id": result.entry_id,
-                }
-                results.append(paper)
-
-                if len(results) >= max_results:
-                    break  # Stop if we reach the max results limit
+            with timed("arxiv", "search"):
+                for result in self.client.results(search):
+                    paper = {
+                        "hash_id": paper_hash_id(result.entry_id),
+                        "title": result.title,
+                        "authors": ", ".join([author.name for author in result.authors]),
+                        "published": result.published,
+                        "summary": result.summary,
+                        "pdf_url": result.pdf_url,
+                        "entry_id": result.entry_id,
+                        "recommended": 0  # Flag as original search result
+                    }
+                    results.append(paper)
+
+                    if len(results) >= max_results:
+                        break  # Stop if we reach the max results limit
         except Exception as e:
             print(f"Error while fetching results: {e}")
 
         return results
 
+    def _batch_queries(self, queries, batch_size, max_query_length):
+        """Group queries into OR-ed batches bounded by count and query string length."""
+        batches = []
+        current = []
+        current_length = 0
+        for query in queries:
+            clause_length = len(query) + len("() OR ")
+            if current and (len(current) >= batch_size or current_length + clause_length > max_query_length):
+                batches.append(current)
+                current = []
+                current_length = 0
+            current.append(query)
+            current_length += clause_length
+        if current:
+            batches.append(current)
+        return batches
+
+    def search_papers_batch(self, queries, max_results=50, date_from=None, date_to=None,
+                            batch_size=8, max_query_length=1000, match_threshold=0.6,
+                            search_rounds=2, max_fallbacks=2):
+        """
+        Search for several related queries with fewer arXiv requests.
+
+        Queries are combined into OR-ed searches and every returned entry is assigned
+        back to each sub-query with enough of its terms in the title and summary. When a
+        broad sub-query crowds the others out, the under-filled ones are OR-ed again and
+        searched deeper; only sub-queries still short after that are searched on their
+        own, at most max_fallbacks per batch.
+
+        Parameters:
+        - queries (list of str): The search queries.
+        - max_results (int): Maximum number of results per query.
+        - date_from (str): Start date in 'YYYYMM' or 'YYYY-MM-DD' format.
+        - date_to (str): End date in 'YYYYMM' or 'YYYY-MM-DD' format.
+        - batch_size (int): Maximum number of queries combined into one search.
+        - max_query_length (int): Maximum length of a combined query string.
+        - match_threshold (float): Fraction of a query's terms an entry must contain.
+        - search_rounds (int): Number of combined searches per batch; each round fetches
+          four times as many entries per sub-query as the one before.
+        - max_fallbacks (int): Maximum number of separate searches per batch for sub-queries
+          the combined searches left short.
+
+        Returns:
+        - Dictionary mapping each query to its list of paper dictionaries.
+        """
+        results = {query: [] for query in queries}
+        for batch in self._batch_queries(list(results), batch_size, max_query_length):
+            if len(batch) == 1:
+                results[batch[0]] = self.search_papers(batch[0], max_results, date_from, date_to)
+                continue
+
+            terms = {query: query_terms(query) for query in batch}
+            seen = {query: set() for query in batch}
+            pending = batch
+            per_query = max_results
+            for _ in range(max(1, search_rounds)):
+                combined_query = " OR ".join(f"({query})" for query in pending)
+                fetch = per_query * len(pending)
+                papers = self.search_papers(combined_query, fetch, date_from, date_to)
+
+                for paper in papers:
+                    paper_terms = query_terms(f"{paper['title']} {paper['summary']}")
+                    for query in pending:
+                        if not terms[query] or len(results[query]) >= max_results or paper["entry_id"] in seen[query]:
+                            continue
+                        matched = len(terms[query] & paper_terms) / len(terms[query])
+                        if matched >= match_threshold:
+                            # Each sub-query gets its own record so later stages can annotate it
+                            results[query].append(dict(paper))
+                            seen[query].add(paper["entry_id"])
+
+                pending = [query for query in pending if len(results[query]) < max_results]
+                if len(pending) < 2 or len(papers) < fetch:
+                    break  # nothing left to combine, or arXiv has no more entries for them
+                per_query *= 4
+
+            # Last resort: a sub-query whose matches the combined searches never reached
+            for query in pending[:max_fallbacks]:
+                results[query] = self.search_papers(query, max_results, date_from, date_to)
+
+        return results
+
+    def get_citation_data(self, papers):
+        """
+        Enrich papers with citation data from Semantic Scholar.
+
+        Parameters:
+        - papers (list of dict or PaperBatch): Paper dictionaries, or a batch enriched in place.
+
+        Returns:
+        - List of all the paper dictionaries, enriched where Semantic Scholar returned data
+          (papers whose chunk failed are kept without citation data); for a PaperBatch, the
+          whole batch.
+        """
+        def chunk_list(lst, chunk_size):
+            for i in range(0, len(lst), chunk_size):
+                yield lst[i:i + chunk_size]
+
+        all_papers_with_citations = []
+
+        # Process papers in batches
+        for paper_chunk in chunk_list(papers, 100):
+            # Keep ids aligned with their papers so the zip below pairs the right records
+            arxiv_papers = [paper for paper in paper_chunk if "arxiv.org" in paper["entry_id"]]
+            if not arxiv_papers:
+                all_papers_with_citations.extend(paper_chunk)
+                continue
+            paper_ids = [self.format_paper_id(paper["entry_id"]) for paper in arxiv_papers]
+
+            # Make a batch request to Semantic Scholar API for each chunk
+            try:
+                with timed("semantic_scholar", "paper_batch") as call:
+                    response = get_http_client().post(
+                        f'{SEMANTIC_SCHOLAR_API_URL}/graph/v1/paper/batch',
+                        service="semantic_scholar",
+                        params={'fields': 'referenceCount,citationCount,tldr,s2FieldsOfStudy,citations,references'},
+                        json={"ids": paper_ids},
+                        timeout=30
+                    )
+                    if response.status_code != 200:
+                        call.fail(f"HTTP {response.status_code}")
+            except Exception as e:
+                print(f"Error fetching citation data: {e}")
+                # Keep the chunk's papers in the output, just without citation data
+                all_papers_with_citations.extend(paper_chunk)
+                continue
+
+            if response.status_code == 200:
+                citation_data = response.json()
+                for paper, data in zip(arxiv_papers, citation_data):
+                    if not data:
+                        continue
+                    paper['referenceCount'] = data.get("referenceCount", 0)
+                    paper['citationCount'] = data.get("citationCount", 0)
+                    paper["references"] = "".join(
+                        (ref.get('title') or '') + '|' for ref in data.get("references") or [])
+                    paper["citations"] = "".join(
+                        (cit.get('title') or '') + '|' for cit in data.get("citations") or [])
+                    paper['s2FieldsOfStudy'] = "".join(
+                        field['category'] + '|' for field in data.get("s2FieldsOfStudy") or [])
+                    tldr = data.get("tldr")
+                    paper['tldr'] = tldr['text'] if tldr else ""
+            else:
+                print("Error fetching citation data:", response.text)
+            all_papers_with_citations.extend(paper_chunk)
+
+        if isinstance(papers, PaperBatch):
+            return papers
+        return all_papers_with_citations
+
+    def search_papers_aug(self, query, max_results=50, date_from=None, date_to=None, as_batch=False):
+        """
+        Search for papers and enrich them with Semantic Scholar citation data.
+
+        Parameters:
+        - query (str): The search query.
+        - max_results (int): Maximum number of search results to return.
+        - date_from (str): Start date in 'YYYYMM' or 'YYYY-MM-DD' format.
+        - date_to (str): End date in 'YYYYMM' or 'YYYY-MM-DD' format.
+        - as_batch (bool): Return a columnar PaperBatch instead of a list.
+
+        Returns:
+        - List of dictionaries containing paper details with citation data, or a PaperBatch.
+        """
+        papers = self.search_papers(query, max_results, date_from, date_to, as_batch=as_batch)
+        return self.get_citation_data(papers)
+
     def download_pdf(self, entry_id):
         """Download the PDF of a paper given its entry_id."""
         try:
-            paper = next(self.client.results(arxiv.Search(id_list=[entry_id])))
-            pdf_url = paper.pdf_url
-            title = paper.title.replace(" ", "_").replace("/", "_")  # Ensure valid filename
-            pdf_filename = os.path.join(self.download_dir, f"{title}.pdf")
-
-            if os.path.exists(pdf_filename):
-                print(f"PDF already exists: {pdf_filename}")
-                return pdf_filename
-
-            # Download the PDF
-            print(f"Downloading PDF: {pdf_url}")
-            paper.download_pdf(dirpath=self.download_dir, filename=f"{title}.pdf")
+            # Timed inside the try, so errors handled below still count as failed calls
+            with timed("arxiv", "download_pdf"):
+                paper = next(self.client.results(arxiv.Search(id_list=[entry_id])))
+                pdf_url = paper.pdf_url
+                title = paper.title.replace(" ", "_").replace("/", "_")  # Ensure valid filename
+                pdf_filename = os.path.join(self.download_dir, f"{title}.pdf")
+
+                if os.path.exists(pdf_filename):
+                    print(f"PDF already exists: {pdf_filename}")
+                    return pdf_filename
+
+                # Download the PDF
+                print(f"Downloading PDF: {pdf_url}")
+                paper.download_pdf(dirpath=self.download_dir, filename=f"{title}.pdf")
             return pdf_filename
         except Exception as e:
             print(f"Error while downloading PDF: {e}")
@@ -104,11 +357,9 @@ class ArxivResearchHelper:
 
     def save_papers_to_csv(self, papers, filename="papers.csv"):
         """Save the search results into a CSV file."""
-        header = ["hash_id", "title", "authors", "published", "summary", "pdf_url", "entry_id"]
-
         try:
             with open(filename, mode='w', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=header)
+                writer = csv.DictWriter(file, fieldnames=PAPER_FIELDS, restval="", extrasaction='ignore')
 
                 # Write the header row
                 writer.writeheader()
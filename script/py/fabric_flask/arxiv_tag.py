@@ -0,0 +1,135 @@
+import os
+from collections import Counter
+
+from http_client import get_openai_client
+from metrics import timed, record_llm_usage
+
+
+class ArxivPaperTagger:
+    def __init__(self, api_key=None, num_tags=5, model="gpt-3.5-turbo", num_fields=10):
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY', '')
+        self.num_tags = num_tags
+        self.model = model
+        self.num_fields = num_fields
+        self.tag_columns = [f"Tag_{i}" for i in range(1, num_tags + 1)]
+
+    def generate_hierarchical_tags(self, summary_text, existing_tags=None):
+        """
+        Continue the hierarchical tags (general to specific) of a single summary.
+
+        Parameters:
+        - summary_text (str): The paper summary.
+        - existing_tags (list of str): Tags already assigned, in order.
+
+        Returns:
+        - dict: Mapping of missing 'Tag_<n>' columns to their new tag text.
+        """
+        existing_tags = existing_tags or []
+        num_new_tags = self.num_tags - len(existing_tags)
+        if num_new_tags <= 0:
+            # All tags are already present for this paper
+            return {}
+
+        existing_tags_text = ""
+        start_tag_number = 1
+        if existing_tags:
+            existing_tags_text = "Existing Tags:\n" + '\n'.join([f"{i}. {tag}" for i, tag in enumerate(existing_tags, 1)])
+            start_tag_number = len(existing_tags) + 1
+
+        messages = [
+            {
+                "role": "system",
+                "content": "You are an AI assistant that continues hierarchical tags from general to specific based on the given summary and existing tags."
+            },
+            {
+                "role": "user",
+                "content": f"""Continue the hierarchical list of tags for the following summary, starting from tag number {start_tag_number}, and generate {num_new_tags} additional tags to reach a total of {self.num_tags} tags.
+
+{existing_tags_text}
+
+Summary:
+{summary_text}
+
+New Tags:
+""" + '\n'.join([f"{i}." for i in range(start_tag_number, self.num_tags + 1)])
+            },
+        ]
+
+        client = get_openai_client(self.api_key)
+        with timed("openai", "tag_paper"):
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=num_new_tags * 20,
+                temperature=0,
+                n=1,
+                stop=None
+            )
+        record_llm_usage(response, "tag_paper")
+        tags_text = response.choices[0].message.content
+
+        # Parse the numbered lines into tag columns
+        tags = {}
+        for line in tags_text.strip().split('\n'):
+            line = line.strip()
+            if line and '.' in line:
+                parts = line.split('.', 1)
+                if parts[0].isdigit():
+                    tag_column = f"Tag_{int(parts[0])}"
+                    if tag_column in self.tag_columns[len(existing_tags):]:
+                        tags[tag_column] = parts[1].strip()
+        return tags
+
+    def tag_papers(self, papers, summary_column="summary"):
+        """
+        Add hierarchical tags to a list of paper dictionaries in place.
+
+        Parameters:
+        - papers (list of dict or PaperBatch): Paper dictionaries or records.
+        - summary_column (str): Key holding the text to tag.
+
+        Returns:
+        - List of the same paper dictionaries with 'Tag_<n>' keys filled in.
+        """
+        if not self.api_key:
+            print("no api.")
+            return papers
+
+        for paper in papers:
+            existing_tags = []
+            for tag_column in self.tag_columns:
+                if not paper.get(tag_column):
+                    break
+                existing_tags.append(paper[tag_column])
+            try:
+                paper.update(self.generate_hierarchical_tags(paper.get(summary_column) or "", existing_tags))
+            except Exception as e:
+                print(f"Error tagging {paper.get('entry_id')}: {e}")
+        return papers
+
+    def assign_fields(self, papers):
+        """
+        Assign each paper a 'field' taken from the most frequent tags of the batch.
+
+        This is the direct-match step of the arxiv_tag notebook without the embedding
+        clustering, so it runs without sentence-transformers.
+
+        Parameters:
+        - papers (list of dict or PaperBatch): Tagged paper dictionaries or records.
+
+        Returns:
+        - List of the same paper dictionaries with 'field' set.
+        """
+        tag_counts = Counter(paper[col] for paper in papers for col in self.tag_columns if paper.get(col))
+        predefined_tags = [tag for tag, _ in tag_counts.most_common(self.num_fields)]
+
+        for paper in papers:
+            tags = [paper.get(col) for col in self.tag_columns]
+            field = None
+            # Earlier tags are more general, so the first direct match wins
+            for tag in tags:
+                if tag in predefined_tags:
+                    field = tag
+                    break
+            paper['field'] = field
+        return papers
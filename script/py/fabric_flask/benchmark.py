@@ -0,0 +1,289 @@
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from stub_services import (ServiceProfile, WebStub, BingStub, ArxivStub, SemanticScholarStub, OpenAIStub,
+                           AzureSearchStub, LocalCosmosClient)
+
+# Latency profiles roughly matching what the real services show from an Azure region
+DEFAULT_PROFILES = {
+    "web": {"latency_ms": 40.0, "jitter_ms": 20.0},
+    "bing": {"latency_ms": 120.0, "jitter_ms": 40.0},
+    "arxiv": {"latency_ms": 300.0, "jitter_ms": 100.0},
+    "semantic_scholar": {"latency_ms": 150.0, "jitter_ms": 50.0},
+    "openai": {"latency_ms": 800.0, "jitter_ms": 300.0},
+    "azure_search": {"latency_ms": 60.0, "jitter_ms": 20.0},
+    "cosmos": {"latency_ms": 8.0, "jitter_ms": 3.0},
+}
+
+SCENARIOS = [
+    "route_metadata", "route_chat", "route_query_submit", "route_metadata_store",
+    "thesis_topic_generator", "arxiv_search_papers", "arxiv_search_papers_aug", "cosmos_query_documents",
+]
+
+
+def start_stub_services(profiles=None, seed=0):
+    """
+    Start every stand-in service and point the application at them.
+
+    Must run before app, bing_search, arxiv_search or cosmos are imported, since their
+    endpoints are read from the environment at import or construction time.
+
+    Parameters:
+    - profiles (dict): Per-service ServiceProfile arguments, merged over DEFAULT_PROFILES.
+    - seed (int): Seed for the latency and failure generators.
+
+    Returns:
+    - dict: Running StubService objects by name.
+    """
+    merged = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+    for name, profile in (profiles or {}).items():
+        merged.setdefault(name, {}).update(profile)
+    profile = {name: ServiceProfile(seed=seed + i, **values) for i, (name, values) in enumerate(sorted(merged.items()))}
+
+    web = WebStub(profile["web"]).start()
+    services = {
+        "web": web,
+        "bing": BingStub(profile["bing"], web_url=web.url).start(),
+        "arxiv": ArxivStub(profile["arxiv"]).start(),
+        "semantic_scholar": SemanticScholarStub(profile["semantic_scholar"]).start(),
+        "openai": OpenAIStub(profile["openai"]).start(),
+        "azure_search": AzureSearchStub(profile["azure_search"]).start(),
+    }
+
+    os.environ["BING_ENDPOINT"] = services["bing"].url + "/v7.0/search"
+    os.environ["ARXIV_API_URL"] = services["arxiv"].url + "/api/query"
+    os.environ["SEMANTIC_SCHOLAR_API_URL"] = services["semantic_scholar"].url
+    os.environ["OPENAI_BASE_URL"] = services["openai"].url + "/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["AZURE_SEARCH_SERVICE"] = services["azure_search"].url
+
+    # Cosmos DB is replaced in process (see stub_services.LocalCosmosContainer)
+    import cosmos
+    LocalCosmosClient.profile = profile["cosmos"]
+    cosmos.CosmosClient = LocalCosmosClient
+    return services
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, operation, requests=50, concurrency=8, trace_memory=True):
+    """
+    Call an operation `requests` times from `concurrency` threads and summarise the run.
+
+    Parameters:
+    - name (str): Scenario name.
+    - operation (callable): Called with the request number; raising counts as an error.
+    - requests (int): Number of calls.
+    - concurrency (int): Number of concurrent callers.
+    - trace_memory (bool): Measure peak Python heap with tracemalloc, in a second untimed pass
+      so its overhead does not show in the latencies.
+
+    Returns:
+    - dict: Throughput, latency percentiles (ms), error count and peak memory (MB). A run with
+      errors has status "errors": its latencies include failed calls and are not comparable.
+    """
+    errors = []
+    lock = threading.Lock()
+
+    def call(i):
+        start = time.perf_counter()
+        try:
+            operation(i)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+        return time.perf_counter() - start
+
+    gc.collect()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(call, range(requests)))
+    elapsed = time.perf_counter() - start
+    timed_errors = list(errors)
+
+    peak_memory = 0
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(call, range(requests)))
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    result = {
+        "status": "errors" if timed_errors else "ok",
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(timed_errors),
+        "throughput_rps": round(requests / elapsed, 3) if elapsed else 0.0,
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 0.95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 2),
+        "peak_memory_mb": round(peak_memory / (1024 * 1024), 2),
+    }
+    if timed_errors:
+        result["first_error"] = timed_errors[0]
+    print(f"{name}: {result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+          f"p99 {result['p99_ms']} ms, peak {result['peak_memory_mb']} MB, {result['errors']} errors"
+          + (f"  ERRORS ({result['first_error']})" if timed_errors else ""))
+    return result
+
+
+def failed_scenarios(results):
+    """Return the names of the scenarios that had errors."""
+    return [name for name, result in results.items() if result.get("errors")]
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return response
+
+
+def build_scenarios(download_dir):
+    """Return scenario name -> operation, importing the application against the stand-ins."""
+    import app
+    from arxiv_search import ArxivResearchHelper
+    from bing_search import ThesisTopicGenerator
+    from cosmos import CosmosDBClient
+
+    flask_app = app.app
+    # Sessions for /metadata_store to list
+    for i in range(20):
+        app.cosmos_client_query_metadata.create_document({
+            "id": f"benchmark-session-{i}",
+            "user_id": app.USER_ID,
+            "all_topics": [],
+            "selected_topics": [[f"topic {i} | subtopic {j}" for j in range(3)]],
+            "topic_count": 1,
+            "metadata": {"created_at": datetime.now(timezone.utc).isoformat(), "version": 1},
+        })
+    helper = ArxivResearchHelper(download_dir=download_dir, delay_seconds=0.0)
+    cosmos_client = CosmosDBClient(url="local", key="", database_name="benchmark",
+                                   container_name="queries", partition_key="partitionKey")
+    for i in range(100):
+        cosmos_client.create_document({"id": f"query-{i}", "user_id": f"user-{i % 10}", "status": 0})
+
+    return {
+        "route_metadata": lambda i: _check(flask_app.test_client().post('/metadata', data={
+            'search_query': f"graph neural networks {i}", 'search_engine': 'bing', 'recursive_depth': '1'})),
+        "route_chat": lambda i: _check(flask_app.test_client().post('/chat', json={
+            'query': f"papers about robot navigation {i}", 'showSources': False, 'chatHistory': []})),
+        "route_query_submit": lambda i: _check(flask_app.test_client().post('/query_submit', json={
+            'query': f"reinforcement learning {i}", 'date_from': '2024-01-01', 'date_to': '2024-06-30',
+            'priority': 1})),
+        "route_metadata_store": lambda i: _check(flask_app.test_client().get('/metadata_store')),
+        "thesis_topic_generator": lambda i: ThesisTopicGenerator(
+            query=f"robot navigation {i}", max_depth=1, num_new_tags=5).run(),
+        "arxiv_search_papers": lambda i: helper.search_papers(f"transformers {i}", max_results=20),
+        "arxiv_search_papers_aug": lambda i: helper.search_papers_aug(f"transformers {i}", max_results=20),
+        "cosmos_query_documents": lambda i: cosmos_client.query_documents(
+            f"SELECT * FROM c WHERE c.user_id = 'user-{i % 10}'"),
+    }
+
+
+def compare_results(results, baseline, max_regression=0.2):
+    """
+    Print each scenario against a saved baseline and return the regressed scenario names.
+
+    A scenario regresses when its p95 latency grows, or its throughput drops, by more
+    than max_regression (a fraction). A scenario with errors is returned as failed without
+    comparing its numbers.
+    """
+    regressions = []
+    for name, result in results.items():
+        if result.get("errors"):
+            print(f"{name}: {result['errors']} of {result['requests']} requests failed "
+                  f"({result.get('first_error')})  FAILED")
+            regressions.append(name)
+            continue
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name}: no baseline")
+            continue
+        p95_change = (result["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        rps_change = ((result["throughput_rps"] - base["throughput_rps"]) / base["throughput_rps"]
+                      if base["throughput_rps"] else 0.0)
+        regressed = p95_change > max_regression or rps_change < -max_regression
+        print(f"{name}: p95 {base['p95_ms']} -> {result['p95_ms']} ms ({p95_change:+.1%}), "
+              f"throughput {base['throughput_rps']} -> {result['throughput_rps']} req/s ({rps_change:+.1%})"
+              + ("  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Flask routes and service clients.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated scenario names")
+    parser.add_argument("--requests", type=int, default=50, help="Calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--profiles", help="JSON file of per-service latency/failure profiles")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="Multiply every stand-in latency, e.g. 0.1 for quick runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc peak memory measurement")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--save-baseline", help="Save the results as a baseline JSON file")
+    parser.add_argument("--compare", help="Compare against a baseline JSON file")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    profiles = {}
+    if args.profiles:
+        with open(args.profiles, encoding='utf-8') as f:
+            profiles = json.load(f)
+    if args.latency_scale != 1.0:
+        for name, default in DEFAULT_PROFILES.items():
+            profile = profiles.setdefault(name, {})
+            for field in ("latency_ms", "jitter_ms"):
+                profile[field] = profile.get(field, default[field]) * args.latency_scale
+
+    services = start_stub_services(profiles, seed=args.seed)
+    scenarios = build_scenarios(tempfile.mkdtemp(prefix="rr-benchmark-"))
+    results = {}
+    for name in args.scenarios.split(","):
+        results[name] = run_scenario(name, scenarios[name], requests=args.requests,
+                                     concurrency=args.concurrency, trace_memory=not args.no_memory)
+    for service in services.values():
+        service.stop()
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {"requests": args.requests, "concurrency": args.concurrency,
+                   "latency_scale": args.latency_scale, "profiles": profiles, "seed": args.seed},
+        "results": results,
+    }
+    failed = failed_scenarios(results)
+    for path in (args.output, args.save_baseline):
+        if path:
+            if path == args.save_baseline and failed:
+                print(f"Not saving baseline {path}: scenarios with errors: {', '.join(failed)}")
+                continue
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved results to {path}")
+    if args.save_baseline and failed and not args.compare:
+        raise SystemExit(1)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            if compare_results(results, json.load(f), args.max_regression):
+                raise SystemExit(1)
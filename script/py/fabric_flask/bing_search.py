@@ -1,25 +1,49 @@
+import contextvars
 import json
-import requests
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from urllib.robotparser import RobotFileParser
 from bs4 import BeautifulSoup
 from datetime import datetime
 import os
 
-from openai import OpenAI
+from http_client import get_http_client, get_openai_client
+from metrics import timed, record_llm_usage
+from page_dedup import canonicalize_url, get_page_index, DUPLICATE_PAGES
+
+# Numbering or bullet in front of a topic line, e.g. "1. ", "2) ", "- ", "• "
+TOPIC_PREFIX_RE = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s*")
+# Source count added by _reduce_topics, in case the LLM echoes it back
+TOPIC_COUNT_RE = re.compile(r"\s*\(mentioned by \d+ sources?\)\s*$", re.IGNORECASE)
+
+
+def _topic_key(topic):
+    return " ".join(re.findall(r"\w+", topic.lower()))
+
+
+def _clean_topic(line):
+    # Strip numbering, bullets, emphasis and an echoed source count from one topic line
+    return TOPIC_PREFIX_RE.sub("", TOPIC_COUNT_RE.sub("", line)).replace("*", "").strip(" .:-")
+
 
 class ThesisTopicGenerator:
-    def __init__(self, query="", max_depth=1, num_new_tags=5):
+    def __init__(self, query="", max_depth=1, num_new_tags=5, page_index=None):
         self.query = query
         self.max_depth = max_depth
         self.num_new_tags = num_new_tags
         self.current_year = datetime.now().year
         self.bing_subscription_key = os.getenv('BING_SUBSCRIPTION_KEY', '')
         self.openai_api_key = os.getenv('OPENAI_API_KEY', '')
-        self.endpoint = ""
+        self.endpoint = os.getenv('BING_ENDPOINT', '')
         self.mkt = ''
         self.user_agent = ''
         self.robots_parsers = {}
+        self.http = get_http_client()
+        # Topics of pages seen by any generator extracting as many topics, so mirrors and
+        # syndicated copies skip the LLM
+        self.page_index = get_page_index(("extract_topics", num_new_tags)) if page_index is None else page_index
         self.visited_urls = set()
         self.all_results = []
         self.full_query = f"thesis topic {self.current_year} {self.query}"
@@ -31,7 +55,16 @@ class ThesisTopicGenerator:
             rp = RobotFileParser()
             rp.set_url(robots_url)
             try:
-                rp.read()
+                with timed("robots", "read"):
+                    response = self.http.get(robots_url, service=parsed_url.netloc)
+                    # Same rules as RobotFileParser.read, over the pooled connection
+                    if response.status_code in (401, 403):
+                        rp.disallow_all = True
+                    elif 400 <= response.status_code < 500:
+                        rp.allow_all = True
+                    else:
+                        response.raise_for_status()
+                        rp.parse(response.text.splitlines())
                 self.robots_parsers[robots_url] = rp
             except Exception as e:
                 print(f"Could not read robots.txt at {robots_url}: {e}")
@@ -63,18 +96,27 @@ class ThesisTopicGenerator:
         params = {'q': query, 'mkt': self.mkt}
         headers = {'Ocp-Apim-Subscription-Key': self.bing_subscription_key}
         try:
-            response = requests.get(self.endpoint, headers=headers, params=params)
-            response.raise_for_status()
+            with timed("bing", "search"):
+                response = self.http.get(self.endpoint, service="bing", headers=headers, params=params)
+                response.raise_for_status()
             return response.json()
         except Exception as ex:
             print(f"An error occurred while fetching search results: {ex}")
             return None
 
     def extract_text_from_url(self, url):
+        page_response = self._fetch_page(url)
+        with timed("web", "extract_text"):
+            return self._extract_text(url, page_response)
+
+    def _fetch_page(self, url):
         headers = {'User-Agent': self.user_agent}
-        page_response = requests.get(url, headers=headers, timeout=10)
-        page_response.raise_for_status()
+        with timed("web", "fetch_page"):
+            page_response = self.http.get(url, headers=headers, timeout=10)
+            page_response.raise_for_status()
+        return page_response
 
+    def _extract_text(self, url, page_response):
         content_type = page_response.headers.get('Content-Type', '').lower()
 
         if 'application/pdf' in content_type or url.lower().endswith('.pdf'):
@@ -122,15 +164,17 @@ class ThesisTopicGenerator:
             }
         ]
 
-        client = OpenAI(api_key=self.openai_api_key)
-        response = client.chat.completions.create(
-            model="",
-            messages=messages,
-            max_tokens=self.num_new_tags * 20,
-            temperature=0.5,
-            n=1,
-            stop=None
-        )
+        client = get_openai_client(self.openai_api_key)
+        with timed("openai", "extract_topics"):
+            response = client.chat.completions.create(
+                model="",
+                messages=messages,
+                max_tokens=self.num_new_tags * 20,
+                temperature=0.5,
+                n=1,
+                stop=None
+            )
+        record_llm_usage(response, "extract_topics")
 
         tags_text = response.choices[0].message.content
         return tags_text
@@ -149,9 +193,23 @@ class ThesisTopicGenerator:
 
         for result in search_results_list:
             url = result['url']
-            if url in self.visited_urls:
+            canonical_url = canonicalize_url(url)
+            if canonical_url in self.visited_urls:
                 continue
-            self.visited_urls.add(url)
+            self.visited_urls.add(canonical_url)
+
+            cached = self.page_index.get_url(url)
+            if cached is not None:
+                _, twin_url, tags_text = cached
+                print(f"Reusing cached topics for {url}")
+                DUPLICATE_PAGES.inc(kind="url")
+                result['page_text'] = None
+                result['extracted_topics'] = tags_text
+                if canonicalize_url(twin_url) != canonical_url:
+                    result['duplicate_of'] = twin_url
+                current_results.append(result)
+                continue
+
             print(f"Processing URL: {url}")
             if self.can_fetch_url(url):
                 try:
@@ -159,7 +217,17 @@ class ThesisTopicGenerator:
                     result['page_text'] = text
                     print(f"Successfully extracted text from {url}")
 
-                    tags_text = self.get_topics_from_text(text)
+                    fingerprint = self.page_index.fingerprint(text)
+                    twin = self.page_index.find(fingerprint)
+                    if twin is not None:
+                        twin_fingerprint, twin_url, tags_text = twin
+                        print(f"{url} is a near-duplicate of {twin_url}, reusing its topics")
+                        DUPLICATE_PAGES.inc(kind="content")
+                        self.page_index.add_alias(url, twin_fingerprint)
+                        result['duplicate_of'] = twin_url
+                    else:
+                        tags_text = self.get_topics_from_text(text)
+                        self.page_index.add(url, fingerprint, tags_text)
                     result['extracted_topics'] = tags_text
                     # print(f"Extracted topics from {url}: {tags_text}")
 
@@ -182,57 +250,163 @@ class ThesisTopicGenerator:
                 if related_query:
                     self.recursive_search(related_query, depth + 1)
 
-    def generate_top_topics(self):
-
-        all_extracted_topics = [result['extracted_topics'] for result in self.all_results if result['extracted_topics']]
-        combined_topics_text = '\n'.join(all_extracted_topics)
+    def _complete(self, messages, max_tokens, operation):
+        client = get_openai_client(self.openai_api_key)
+        with timed("openai", operation):
+            response = client.chat.completions.create(
+                model="",
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0.5,
+                n=1,
+                stop=None
+            )
+        record_llm_usage(response, operation)
+        return response.choices[0].message.content.strip()
+
+    def _top_topics_messages(self, topics_text, num_topics):
         s = ""
-        for i in range(1,self.num_new_tags+1):
+        for i in range(1, num_topics + 1):
             s += f"{i}. Topic {i}\n"
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": (
                     "You are an assistant that aggregates and prioritizes research topics from multiple sources to "
-                    "identify the top"+ str(self.num_new_tags)+" most relevant ones. You should provide a clear, concise list that strictly "
+                    "identify the top " + str(num_topics) + " most relevant ones. You should provide a clear, concise list that strictly "
                     "follows the format provided below."
                 )
             },
             {
                 "role": "user",
-                "content": f"""Given the following extracted topics from various sources, please provide a list of the top 10 most relevant research arxiv thesis search keywords for {self.current_year}. 
+                "content": f"""Given the following extracted topics from various sources, please provide a list of the top {num_topics} most relevant research arxiv thesis search keywords for {self.current_year}. 
 Be Short and concise.
-Each topic should be listed in a numbered format from 1 to {self.num_new_tags}, with each number on a new line, followed by a period. 
+Each topic should be listed in a numbered format from 1 to {num_topics}, with each number on a new line, followed by a period. 
 
 Format your response as follows:
 {s}
 
 Here are the extracted topics for your reference:
-{combined_topics_text}
+{topics_text}
 """
             }
         ]
 
-        client = OpenAI(api_key=self.openai_api_key)
-        response = client.chat.completions.create(
-            model="",
-            messages=messages,
-            max_tokens=500,  # Adjust as needed
-            temperature=0.5,
-            n=1,
-            stop=None
-        )
-        top_10_topics = response.choices[0].message.content.strip()
-        return top_10_topics
+    def count_topics(self, topic_texts):
+        """
+        Split extracted topic lists into single topics and count them across sources.
+
+        Numbering, bullets and emphasis are stripped, and topics that differ only in case,
+        spacing or punctuation are merged under their first spelling.
+
+        Parameters:
+        - topic_texts (list): LLM outputs, one per source.
+
+        Returns:
+        - list: (topic, number of sources mentioning it) pairs, most frequent first.
+        """
+        counts = Counter()
+        names = {}
+        for text in topic_texts:
+            lines = [line for line in text.splitlines() if line.strip()]
+            if len(lines) == 1:
+                lines = re.split(r"[;,]", lines[0])
+            keys = set()
+            for line in lines:
+                topic = _clean_topic(line)
+                key = _topic_key(topic)
+                if not key or key in keys:
+                    continue
+                keys.add(key)
+                names.setdefault(key, topic)
+                counts[key] += 1
+        return [(names[key], count) for key, count in counts.most_common()]
+
+    def _reduce_topics(self, counted_topics, num_topics, operation):
+        topics_text = "\n".join(f"{topic} (mentioned by {count} sources)" for topic, count in counted_topics)
+        return self._complete(self._top_topics_messages(topics_text, num_topics),
+                              max_tokens=max(500, num_topics * 25), operation=operation)
+
+    def _chunk_topics(self, counted_topics, max_prompt_tokens):
+        chunks = []
+        chunk, chunk_tokens = [], 0
+        for topic, count in counted_topics:
+            # Rough token estimate (about 4 characters per token) of the line in the prompt
+            tokens = (len(topic) + 30) // 4
+            if chunk and chunk_tokens + tokens > max_prompt_tokens:
+                chunks.append(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append((topic, count))
+            chunk_tokens += tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def generate_top_topics(self, aggregation="auto", max_prompt_tokens=3000, reduce_workers=4):
+        """
+        Ask the LLM for the top num_new_tags topics across all extracted topics.
+
+        Parameters:
+        - aggregation (str): "single" sends every page's topics in one prompt, as extracted.
+          "map_reduce" counts and de-duplicates topics locally, reduces chunks of at most
+          max_prompt_tokens in parallel calls, re-chunking the kept topics until they fit in
+          one prompt, and merges them in a final call that stays within max_prompt_tokens. "auto" sends the counted topics in one
+          prompt when they fit, otherwise map-reduces.
+        - max_prompt_tokens (int): Approximate token budget of the topic list in each prompt.
+        - reduce_workers (int): Number of chunk reductions running at once.
+
+        Returns:
+        - str: Numbered list of the top topics.
+        """
+        all_extracted_topics = [result['extracted_topics'] for result in self.all_results if result['extracted_topics']]
+        if aggregation == "single":
+            combined_topics_text = '\n'.join(all_extracted_topics)
+            return self._complete(self._top_topics_messages(combined_topics_text, self.num_new_tags),
+                                  max_tokens=500, operation="top_topics")
+
+        counted_topics = self.count_topics(all_extracted_topics)
+        chunks = self._chunk_topics(counted_topics, max_prompt_tokens)
+        if aggregation == "auto" and len(chunks) <= 1:
+            return self._reduce_topics(counted_topics, self.num_new_tags, "top_topics")
+
+        # Map: each chunk keeps twice the final number of topics so the merge still has a choice
+        chunk_size = self.num_new_tags * 2
+        source_counts = {_topic_key(topic): count for topic, count in counted_topics}
+        topics = counted_topics
+        with ThreadPoolExecutor(max_workers=reduce_workers) as executor:
+            while len(chunks) > 1:
+                # Each call runs in a copy of this context, so its logs keep the request's trace id
+                reduced = list(executor.map(
+                    lambda c, context: context.run(self._reduce_topics, c, chunk_size, "top_topics_chunk"),
+                    chunks, [contextvars.copy_context() for _ in chunks]))
+                # Carry the local source counts over to the topics each chunk kept
+                topics = [(topic, source_counts.get(_topic_key(topic), 1)) for topic, _ in self.count_topics(reduced)]
+                topics.sort(key=lambda item: -item[1])
+                next_chunks = self._chunk_topics(topics, max_prompt_tokens)
+                if len(next_chunks) >= len(chunks):
+                    if chunk_size == self.num_new_tags:
+                        break  # chunks too small to shrink any further
+                    chunk_size = self.num_new_tags  # keep fewer topics per chunk and reduce again
+                chunks = next_chunks
+
+        # Reduce: one call over the topics kept from every chunk. If they still do not fit the
+        # budget, the most mentioned topics that do are sent.
+        topics = self._chunk_topics(topics, max_prompt_tokens)[0]
+        return self._reduce_topics(topics, self.num_new_tags, "top_topics")
 
     def run(self):
         self.recursive_search(self.full_query, depth=1)
         top_topics = self.generate_top_topics()
         # process top_topics to return a list of topics
-        # there is a number followed by a period, followed by the topic
-        top_topics = top_topics.split("\n")
-        top_topics = [topic.split(".")[1].strip() for topic in top_topics if topic]
-        return top_topics
+        # there is a number followed by a period, followed by the topic (and possibly the
+        # "(mentioned by N sources)" count of the prompt, echoed back)
+        topics = {}
+        for line in top_topics.split("\n"):
+            if TOPIC_PREFIX_RE.match(line):
+                topic = _clean_topic(line)
+                if topic:
+                    topics.setdefault(_topic_key(topic), topic)
+        return list(topics.values())
 
 # Example usage:
 if __name__ == "__main__":
@@ -1,8 +1,24 @@
 import os
 from email.policy import default
 
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+
+from metrics import timed, COSMOS_REQUEST_UNITS
+
+
+class _RequestCharge:
+    """response_hook adding up the request units of every response (query page) of one call."""
+
+    def __init__(self):
+        self.units = 0.0
+        self.headers = {}
+
+    def __call__(self, headers, result):
+        self.headers = headers or {}
+        self.units += float(self.headers.get("x-ms-request-charge") or 0)
+
 
 class CosmosDBClient:
     def __init__(self, url: str, key: str, database_name: str, container_name: str, partition_key: str):
@@ -52,6 +68,20 @@ class CosmosDBClient:
             offer_throughput=400  # Set the desired throughput
         )
 
+    def _record_request_charge(self, operation: str, charge: _RequestCharge) -> None:
+        """
+        Add the request units of one call to the RU counter.
+
+        The charge is captured per call with the SDK's response_hook, since the connection's
+        last_response_headers are shared by every thread using this client.
+
+        Parameters:
+            operation (str): Name of the container operation.
+            charge (_RequestCharge): The response_hook passed to the call.
+        """
+        if charge.units:
+            COSMOS_REQUEST_UNITS.inc(charge.units, container=self.container_name, operation=operation)
+
     def create_document(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
         Insert a document into the container. ID will be autogenerated if not provided.
@@ -64,7 +94,10 @@ class CosmosDBClient:
         """
         try:
             data.setdefault(self.partition_key, "default_partition")  # Ensure partition key exists
-            document = self.container.create_item(body=data)
+            charge = _RequestCharge()
+            with timed("cosmos", "create_item"):
+                document = self.container.create_item(body=data, response_hook=charge)
+            self._record_request_charge("create_item", charge)
             print("Document created successfully.")
             return document
         except exceptions.CosmosHttpResponseError as e:
@@ -83,7 +116,10 @@ class CosmosDBClient:
         """
         try:
             data.setdefault(self.partition_key, "default_partition")
-            document = self.container.upsert_item(body=data)
+            charge = _RequestCharge()
+            with timed("cosmos", "upsert_item"):
+                document = self.container.upsert_item(body=data, response_hook=charge)
+            self._record_request_charge("upsert_item", charge)
             print("Document upserted successfully.")
             return document
         except exceptions.CosmosHttpResponseError as e:
@@ -102,7 +138,11 @@ class CosmosDBClient:
             Optional[Dict[str, Any]]: The retrieved document, or None if not found.
         """
         try:
-            document = self.container.read_item(item=document_id, partition_key=partition_key)
+            charge = _RequestCharge()
+            with timed("cosmos", "read_item"):
+                document = self.container.read_item(item=document_id, partition_key=partition_key,
+                                                   response_hook=charge)
+            self._record_request_charge("read_item", charge)
             return document
         except exceptions.CosmosResourceNotFoundError:
             print("Document not found.")
@@ -111,18 +151,25 @@ class CosmosDBClient:
             print(f"Error reading document: {e}")
             return None
 
-    def query_documents(self, query: str) -> List[Dict[str, Any]]:
+    def query_documents(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
         """
         Query documents in the container.
 
         Parameters:
             query (str): SQL query string to execute.
+            parameters (Optional[List[Dict[str, Any]]]): Values for the query's @name placeholders,
+                as [{"name": "@id", "value": ...}]. Pass user input this way, never in the query text.
 
         Returns:
             List[Dict[str, Any]]: A list of documents that match the query.
         """
         try:
-            items = list(self.container.query_items(query=query, enable_cross_partition_query=True))
+            # The hook runs for every page the iterator fetches
+            charge = _RequestCharge()
+            with timed("cosmos", "query_items"):
+                items = list(self.container.query_items(query=query, parameters=parameters,
+                                                        enable_cross_partition_query=True, response_hook=charge))
+            self._record_request_charge("query_items", charge)
             return items
         except exceptions.CosmosHttpResponseError as e:
             print(f"Error querying documents: {e}")
@@ -140,7 +187,10 @@ class CosmosDBClient:
             bool: True if the document was deleted, False otherwise.
         """
         try:
-            self.container.delete_item(item=document_id, partition_key=partition_key)
+            charge = _RequestCharge()
+            with timed("cosmos", "delete_item"):
+                self.container.delete_item(item=document_id, partition_key=partition_key, response_hook=charge)
+            self._record_request_charge("delete_item", charge)
             print("Document deleted successfully.")
             return True
         except exceptions.CosmosResourceNotFoundError:
@@ -158,8 +208,109 @@ class CosmosDBClient:
             List[Dict[str, Any]]: A list of all documents in the container.
         """
         try:
-            items = list(self.container.read_all_items())
+            charge = _RequestCharge()
+            with timed("cosmos", "read_all_items"):
+                items = list(self.container.read_all_items(response_hook=charge))
+            self._record_request_charge("read_all_items", charge)
             return items
         except exceptions.CosmosHttpResponseError as e:
             print(f"Error listing all documents: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    def replace_document(self, data: Dict[str, Any], etag: str) -> Optional[Dict[str, Any]]:
+        """
+        Replace a document only if it has not changed since it was read (optimistic concurrency).
+
+        Parameters:
+            data (Dict[str, Any]): Full document body including its 'id'.
+            etag (str): The '_etag' of the document version the change is based on.
+
+        Returns:
+            Optional[Dict[str, Any]]: The replaced document, or None if it was modified
+            concurrently or an error occurs.
+        """
+        try:
+            charge = _RequestCharge()
+            with timed("cosmos", "replace_item"):
+                document = self.container.replace_item(
+                    item=data["id"], body=data, etag=etag, match_condition=MatchConditions.IfNotModified,
+                    response_hook=charge
+                )
+            self._record_request_charge("replace_item", charge)
+            return document
+        except exceptions.CosmosAccessConditionFailedError:
+            return None
+        except exceptions.CosmosHttpResponseError as e:
+            print(f"Error replacing document: {e}")
+            return None
+
+    def batch_replace_documents(self, documents: List[Tuple[Dict[str, Any], str]]) -> int:
+        """
+        Replace many documents with transactional batches, each only if it has not changed
+        since it was read.
+
+        A batch is rolled back as a whole when one of its documents was modified concurrently;
+        its documents are then replaced one by one, so only the stale ones are skipped.
+
+        Parameters:
+            documents (List[Tuple[Dict[str, Any], str]]): (full document body, '_etag' it is based on) pairs.
+
+        Returns:
+            int: Number of documents written.
+        """
+        by_partition = {}
+        for data, etag in documents:
+            data.setdefault(self.partition_key, "default_partition")
+            by_partition.setdefault(data[self.partition_key], []).append((data, etag))
+
+        written = 0
+        for partition_value, items in by_partition.items():
+            # Cosmos DB limits a transactional batch to 100 operations
+            for i in range(0, len(items), 100):
+                chunk = items[i:i + 100]
+                try:
+                    charge = _RequestCharge()
+                    with timed("cosmos", "execute_item_batch"):
+                        self.container.execute_item_batch(
+                            batch_operations=[("replace", (data["id"], data), {"if_match_etag": etag})
+                                              for data, etag in chunk],
+                            partition_key=partition_value,
+                            response_hook=charge
+                        )
+                    self._record_request_charge("execute_item_batch", charge)
+                    written += len(chunk)
+                except exceptions.CosmosBatchOperationError:
+                    written += sum(self.replace_document(data, etag) is not None for data, etag in chunk)
+                except exceptions.CosmosHttpResponseError as e:
+                    print(f"Error replacing batch: {e}")
+        return written
+
+    def read_change_feed(self, continuation: Optional[str] = None, start_from_beginning: bool = False,
+                         max_item_count: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Read the documents changed since a continuation token.
+
+        Parameters:
+            continuation (Optional[str]): Token returned by the previous call.
+            start_from_beginning (bool): Read from the start of the feed when no token is given.
+            max_item_count (int): Page size of the feed request.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Optional[str]]: The changed documents and the token to
+            pass to the next call.
+        """
+        try:
+            charge = _RequestCharge()
+            with timed("cosmos", "change_feed"):
+                items = list(self.container.query_items_change_feed(
+                    is_start_from_beginning=start_from_beginning,
+                    continuation=continuation,
+                    max_item_count=max_item_count,
+                    response_hook=charge
+                ))
+            self._record_request_charge("change_feed", charge)
+            token = charge.headers.get("etag")
+            return items, token or continuation
+        except exceptions.CosmosHttpResponseError as e:
+            print(f"Error reading change feed: {e}")
+            return [], continuation
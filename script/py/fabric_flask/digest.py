@@ -0,0 +1,264 @@
+import argparse
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from arxiv_search import paper_key
+from paper_index import PaperIndex
+
+# auto_email hands priorities over as names; query documents store the numbers
+PRIORITY_VALUES = {"LOW": 0, "MEDIUM": 1, "HIGH": 2}
+
+
+def _priority(value: Any) -> int:
+    if isinstance(value, str) and value.upper() in PRIORITY_VALUES:
+        return PRIORITY_VALUES[value.upper()]
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class DigestBuilder:
+    def __init__(self, paper_index: PaperIndex, path: str = "digest_state.sqlite", max_workers: int = 8,
+                 max_papers_per_query: int = 50, render: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        """
+        Build per-user email digests containing only the papers each user has not received yet.
+
+        Every query keeps a watermark: the paper index sequence number of the last paper sent
+        for it (see PaperIndex.link_query), so a build only reads papers linked after it. Every
+        user keeps the keys of the papers sent to them, so a paper found by two of a user's
+        queries is sent once. Watermarks of a digest only move in commit(), after it was sent;
+        a query whose new papers had all been sent already moves its watermark in build().
+
+        Parameters:
+            paper_index (PaperIndex): The index the pipeline links query results into.
+            path (str): SQLite database of the watermarks.
+            max_workers (int): Number of users built in parallel; each worker thread reads both
+                databases through its own connection.
+            max_papers_per_query (int): Maximum new papers per query in one digest; the rest
+                are sent next time.
+            render (Optional[Callable]): Called with each non-empty digest (e.g. to format the
+                email body); its result is stored under 'content'.
+        """
+        self.paper_index = paper_index
+        self.path = path
+        self.max_workers = max_workers
+        self.max_papers_per_query = max_papers_per_query
+        self.render = render
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._readers = []
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS query_watermarks (
+                query_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                last_seq INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            )"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS user_watermarks (
+                user_id TEXT PRIMARY KEY,
+                last_sent_at TEXT NOT NULL,
+                digests_sent INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS sent_papers (
+                user_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (user_id, key)
+            ) WITHOUT ROWID"""
+        )
+        self.connection.commit()
+
+    def _reader(self) -> sqlite3.Connection:
+        # Each thread reads through its own connection; writes stay on self.connection under _lock
+        reader = getattr(self._local, "connection", None)
+        if reader is None:
+            reader = self._local.connection = sqlite3.connect(self.path, check_same_thread=False)
+            with self._lock:
+                self._readers.append(reader)
+        return reader
+
+    def _watermarks(self, query_ids: List[str]) -> Dict[str, int]:
+        placeholders = ",".join("?" * len(query_ids))
+        rows = self._reader().execute(
+            f"SELECT query_id, last_seq FROM query_watermarks WHERE query_id IN ({placeholders})", query_ids
+        ).fetchall()
+        return dict(rows)
+
+    def _already_sent(self, user_id: str, keys: List[str]) -> set:
+        sent = set()
+        reader = self._reader()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            sent.update(key for (key,) in reader.execute(
+                f"SELECT key FROM sent_papers WHERE user_id = ? AND key IN ({placeholders})", [user_id] + chunk
+            ))
+        return sent
+
+    def build_user(self, user_id: str, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build the digest of one user.
+
+        Parameters:
+            user_id (str): The user.
+            queries (List[Dict[str, Any]]): The user's query documents (or auto_email query_list entries).
+
+        Returns:
+            Dict[str, Any]: The digest, with each query's new papers and the watermarks to commit.
+        """
+        queries = sorted(queries, key=lambda query: -_priority(query.get("priority")))
+        watermarks = self._watermarks([query["id"] for query in queries])
+        sent = set()  # keys sent before or claimed by a higher priority query of this digest
+        checked = set()
+        digest = {
+            "user_id": user_id,
+            "email": next((query.get("email") for query in queries if query.get("email")), ""),
+            "queries": [],
+            "paper_count": 0,
+            "watermarks": {},
+        }
+        for query in queries:
+            last_seq = watermarks.get(query["id"], 0)
+            papers = []
+            # Read further windows while papers already sent leave this one short of new papers
+            while len(papers) < self.max_papers_per_query:
+                rows = self.paper_index.papers_since(query["id"], last_seq, self.max_papers_per_query)
+                keys = [paper_key(record["entry_id"]) for _, record in rows]
+                unchecked = [key for key in dict.fromkeys(keys) if key not in checked]
+                checked.update(unchecked)
+                sent.update(self._already_sent(user_id, unchecked))
+                for (seq, record), key in zip(rows, keys):
+                    # The watermark also moves past papers skipped as already sent
+                    last_seq = seq
+                    if key not in sent:
+                        sent.add(key)  # higher priority queries claim shared papers first
+                        papers.append(record)
+                        if len(papers) == self.max_papers_per_query:
+                            break
+                if len(rows) < self.max_papers_per_query:
+                    break
+            if last_seq > watermarks.get(query["id"], 0):
+                digest["watermarks"][query["id"]] = last_seq
+            if papers:
+                digest["queries"].append({
+                    "id": query["id"],
+                    "query_text": query.get("query_text"),
+                    "priority": query.get("priority"),
+                    "papers": papers,
+                })
+                digest["paper_count"] += len(papers)
+        if digest["paper_count"] and self.render is not None:
+            digest["content"] = self.render(digest)
+        return digest
+
+    def build(self, query_documents: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Build the digests of every user with query documents, in parallel across users.
+
+        Users with nothing new get no digest, but watermarks that only moved past papers
+        already sent are saved right away, so the next build does not read them again.
+
+        Parameters:
+            query_documents (List[Dict[str, Any]]): Query documents with 'id' and 'user_id'.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Digests by user id; users with nothing new are left out.
+        """
+        by_user = {}
+        for document in query_documents:
+            by_user.setdefault(document.get("user_id") or "", []).append(document)
+
+        digests = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {user_id: executor.submit(self.build_user, user_id, queries)
+                       for user_id, queries in by_user.items()}
+            for user_id, future in futures.items():
+                try:
+                    digest = future.result()
+                except Exception as e:
+                    print(f"Error building digest for user {user_id}: {e}")
+                    continue
+                if digest["paper_count"]:
+                    digests[user_id] = digest
+                elif digest["watermarks"]:
+                    with self._lock:
+                        self._save_watermarks(user_id, digest["watermarks"])
+                        self.connection.commit()
+        return digests
+
+    def _save_watermarks(self, user_id: str, watermarks: Dict[str, int]) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        self.connection.executemany(
+            """INSERT INTO query_watermarks (query_id, user_id, last_seq, updated_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(query_id) DO UPDATE SET
+                   last_seq = MAX(last_seq, excluded.last_seq),
+                   updated_at = excluded.updated_at""",
+            [(query_id, user_id, seq, now) for query_id, seq in watermarks.items()]
+        )
+
+    def commit(self, digest: Dict[str, Any]) -> None:
+        """
+        Record a digest as sent: advance its query watermarks and remember its papers for the user.
+
+        Parameters:
+            digest (Dict[str, Any]): A digest returned by build() or build_user().
+        """
+        user_id = digest["user_id"]
+        now = datetime.now(timezone.utc).isoformat()
+        keys = [(user_id, paper_key(paper["entry_id"]))
+                for query in digest["queries"] for paper in query["papers"]]
+        with self._lock:
+            self._save_watermarks(user_id, digest["watermarks"])
+            self.connection.executemany("INSERT OR IGNORE INTO sent_papers (user_id, key) VALUES (?, ?)", keys)
+            self.connection.execute(
+                """INSERT INTO user_watermarks (user_id, last_sent_at, digests_sent) VALUES (?, ?, 1)
+                   ON CONFLICT(user_id) DO UPDATE SET
+                       last_sent_at = excluded.last_sent_at,
+                       digests_sent = digests_sent + 1""",
+                (user_id, now)
+            )
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            for reader in self._readers:
+                reader.close()
+            self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build per-user digests of papers not sent yet.")
+    parser.add_argument("queries", help="JSON file with a list of query documents, or auto_email's {'query_list': [...]}")
+    parser.add_argument("--paper-index", default="pipeline_output/paper_index.sqlite")
+    parser.add_argument("--state", default="digest_state.sqlite", help="Watermark database")
+    parser.add_argument("--output", default="digests.json")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--max-papers-per-query", type=int, default=50)
+    parser.add_argument("--commit", action="store_true",
+                        help="Mark the digests as sent right away (when the caller sends them unconditionally)")
+    args = parser.parse_args()
+
+    with open(args.queries, encoding='utf-8') as f:
+        documents = json.load(f)
+    if isinstance(documents, dict):
+        documents = documents.get("query_list", [])
+
+    builder = DigestBuilder(PaperIndex(args.paper_index), path=args.state, max_workers=args.workers,
+                            max_papers_per_query=args.max_papers_per_query)
+    digests = builder.build(documents)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(list(digests.values()), f, indent=2, default=str)
+    print(f"Built {len(digests)} digests with {sum(d['paper_count'] for d in digests.values())} papers")
+    if args.commit:
+        for digest in digests.values():
+            builder.commit(digest)
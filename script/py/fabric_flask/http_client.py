@@ -0,0 +1,209 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import REGISTRY, trace_headers
+
+try:
+    import brotli  # noqa: F401  (urllib3 decodes br responses when it is installed)
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Requests per second allowed before any throttling is seen; other services start unlimited
+DEFAULT_RATE_LIMITS = {
+    "bing": 3.0,
+    "semantic_scholar": 1.0,
+}
+
+THROTTLED_RESPONSES = REGISTRY.counter(
+    "rr_http_throttled_total", "HTTP 429 responses received, by service.", ("service",))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, min_rate=0.1, max_rate=None):
+        """
+        Token bucket whose rate backs off on throttling and slowly recovers (AIMD).
+
+        Parameters:
+        - rate (float): Initial tokens per second.
+        - capacity (float): Burst size; defaults to one second of tokens.
+        - min_rate (float): Lower bound when backing off.
+        - max_rate (float): Upper bound when recovering; defaults to the initial rate.
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = max(self.blocked_until - now, (1.0 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def on_throttle(self, retry_after=None):
+        """Halve the rate and pause the bucket for Retry-After seconds (if given)."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def on_success(self):
+        """Recover the rate additively, by a tenth of the maximum per successful request."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class HttpClient:
+    def __init__(self, pool_connections=32, pool_maxsize=32, connect_timeout=5.0, read_timeout=30.0,
+                 max_retries=2, max_throttle_retries=3, rate_limits=None, throttled_rate=2.0):
+        """
+        Shared outbound HTTP client with pooled keep-alive connections.
+
+        Parameters:
+        - pool_connections (int): Number of per-host connection pools kept.
+        - pool_maxsize (int): Connections kept alive per host.
+        - connect_timeout (float): Default connect timeout in seconds.
+        - read_timeout (float): Default read timeout in seconds.
+        - max_retries (int): Retries on connection errors, and on 502/503/504 responses to
+          idempotent methods (urllib3's default set, so POSTs are not resent and do not spend
+          rate budget twice). 429 is left to the throttling loop in request().
+        - max_throttle_retries (int): Retries of a request answered with 429.
+        - rate_limits (dict): Requests per second by service name, over DEFAULT_RATE_LIMITS.
+        - throttled_rate (float): Starting rate for a service without a limit that returns 429.
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_throttle_retries = max_throttle_retries
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS)
+        self.rate_limits.update(rate_limits or {})
+        self.throttled_rate = throttled_rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+        retry = Retry(total=max_retries, connect=max_retries, read=0, backoff_factor=0.5,
+                      status_forcelist=(502, 503, 504), allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+    def _bucket(self, service, create=False):
+        with self._lock:
+            bucket = self._buckets.get(service)
+            if bucket is None:
+                rate = self.rate_limits.get(service)
+                if rate is None and create:
+                    rate = self.throttled_rate
+                if rate is not None:
+                    bucket = self._buckets[service] = TokenBucket(rate)
+            return bucket
+
+    def request(self, method, url, service=None, **kwargs):
+        """
+        Send a request through the shared session.
+
+        Parameters:
+        - method (str): HTTP method.
+        - url (str): Request URL.
+        - service (str): Rate limit key; defaults to the URL's host.
+        - **kwargs: Passed to requests (params, json, headers, timeout, ...). The trace id of
+          the current request is added as an X-Request-ID header unless one is given.
+
+        Returns:
+        - requests.Response: The final response, which may still be a 429 after all retries.
+        """
+        service = service or urlparse(url).netloc
+        kwargs.setdefault("timeout", self.timeout)
+        headers = trace_headers()
+        if headers:
+            headers.update(kwargs.get("headers") or {})
+            kwargs["headers"] = headers
+        attempt = 0
+        while True:
+            bucket = self._bucket(service)
+            if bucket is not None:
+                bucket.acquire()
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code != 429:
+                if bucket is not None:
+                    bucket.on_success()
+                return response
+
+            THROTTLED_RESPONSES.inc(service=service)
+            self._bucket(service, create=True).on_throttle(_retry_after_seconds(response))
+            attempt += 1
+            if attempt > self.max_throttle_retries:
+                return response
+            response.close()
+
+    def get(self, url, service=None, **kwargs):
+        return self.request("GET", url, service=service, **kwargs)
+
+    def post(self, url, service=None, **kwargs):
+        return self.request("POST", url, service=service, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Return the process-wide HttpClient, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+_openai_clients = {}
+
+
+def get_openai_client(api_key, base_url=None):
+    """
+    Return the process-wide OpenAI client for an API key and base URL, creating it on first use.
+
+    The client is thread safe and keeps its own pool of HTTP connections, so sharing it lets
+    parallel completions reuse connections instead of opening a new pool per call.
+    """
+    from openai import OpenAI
+
+    with _client_lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            client = _openai_clients[(api_key, base_url)] = OpenAI(api_key=api_key, base_url=base_url)
+        return client
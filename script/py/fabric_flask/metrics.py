@@ -0,0 +1,206 @@
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+
+# Latency buckets in seconds, from cache-speed calls up to slow LLM requests
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# External calls slower than this (or failing) are logged with the trace id of their request
+SLOW_CALL_SECONDS = float(os.getenv('SLOW_CALL_SECONDS', '5.0'))
+
+# Header carrying the trace id, read from incoming requests and sent with outbound ones
+TRACE_HEADER = "X-Request-ID"
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def start_trace(trace_id=None):
+    """Set the trace id of the current request (or task) and return it."""
+    trace_id = trace_id or uuid.uuid4().hex
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def get_trace_id():
+    """Return the trace id of the current request, or None outside of one."""
+    return _trace_id.get()
+
+
+def trace_headers():
+    """Return the headers that pass the current trace id on to a called service."""
+    trace_id = _trace_id.get()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            # Only the matching bucket is touched; cumulative counts are built at render time
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names, key, ("le", bound))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+EXTERNAL_CALL_SECONDS = REGISTRY.histogram(
+    "rr_external_call_seconds", "Latency of calls to external services.", ("service", "operation"))
+EXTERNAL_CALL_ERRORS = REGISTRY.counter(
+    "rr_external_call_errors_total", "External calls that failed.", ("service", "operation"))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "rr_http_request_seconds", "Latency of Flask requests.", ("route", "method", "status"))
+COSMOS_REQUEST_UNITS = REGISTRY.counter(
+    "rr_cosmos_request_units_total", "Request units charged by Cosmos DB.", ("container", "operation"))
+LLM_TOKENS = REGISTRY.counter(
+    "rr_llm_tokens_total", "Tokens used by OpenAI chat completions.", ("operation", "kind"))
+
+
+class timed:
+    """
+    Time a call to an external service, as a context manager or decorator.
+
+        with timed("bing", "search"):
+            ...
+
+        @timed("arxiv", "search")
+        def search_papers(...):
+            ...
+
+    Exceptions are counted in rr_external_call_errors_total and re-raised; a call that ends in
+    an error the caller handles without raising (e.g. an error status) is counted by calling
+    fail() on the context manager. Failed calls and calls slower than SLOW_CALL_SECONDS are
+    logged with the current trace id.
+    """
+
+    def __init__(self, service, operation):
+        self.service = service
+        self.operation = operation
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._failure = None
+        return self
+
+    def fail(self, reason):
+        """Count the call as failed although it did not raise."""
+        self._failure = reason
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self._start
+        EXTERNAL_CALL_SECONDS.observe(elapsed, service=self.service, operation=self.operation)
+        failure = exc_type.__name__ if exc_type is not None else self._failure
+        if failure is not None:
+            EXTERNAL_CALL_ERRORS.inc(service=self.service, operation=self.operation)
+        if failure is not None or elapsed >= SLOW_CALL_SECONDS:
+            outcome = f"failed with {failure}" if failure is not None else "slow"
+            print(f"[trace {get_trace_id() or '-'}] {self.service} {self.operation} {outcome} after {elapsed:.3f}s")
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(self.service, self.operation):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+def record_llm_usage(response, operation):
+    """Count prompt and completion tokens of an OpenAI chat completion response."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, operation=operation, kind="prompt")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, operation=operation, kind="completion")
@@ -0,0 +1,258 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from metrics import REGISTRY
+
+# Query parameters of known analytics and ad trackers, which never change the page content.
+# Generic names such as 'ref' or 'source' are kept: some sites route pages by them.
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "igshid", "twclid", "ttclid",
+    "mc_cid", "mc_eid", "ref_src", "_ga", "_gl", "_hsenc", "_hsmi", "mkt_tok",
+}
+TRACKING_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Cached page topics are refreshed after this long, since pages change
+DEFAULT_TTL_SECONDS = 24 * 3600
+INDEX_PAGES = ("index.html", "index.htm", "index.php", "default.aspx")
+
+_WORD_RE = re.compile(r"\w+")
+
+DUPLICATE_PAGES = REGISTRY.counter(
+    "rr_duplicate_pages_total", "Pages whose topics were reused from a duplicate, by match kind.", ("kind",))
+
+
+def canonicalize_url(url):
+    """
+    Reduce a URL to a key shared by its trivial variants.
+
+    The scheme (http/https), 'www.' prefix, default port, fragment, tracking parameters,
+    parameter order, index page and trailing slash are all ignored. The key is only used
+    for de-duplication; pages are still fetched from the original URL.
+
+    Parameters:
+    - url (str): Absolute URL.
+
+    Returns:
+    - str: The canonical form of the URL.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path or "/")
+    for index_page in INDEX_PAGES:
+        if path.lower().endswith("/" + index_page):
+            path = path[:-len(index_page)]
+            break
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    params = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+              if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)]
+    query = urlencode(sorted(params))
+    return urlunsplit(("https" if scheme in DEFAULT_PORTS else scheme, host, path, query, ""))
+
+
+def simhash(text, shingle_size=3):
+    """
+    64-bit SimHash of a text over word shingles.
+
+    Texts that share most of their shingles get fingerprints that differ in only a few
+    bits, so near-duplicates are found by Hamming distance.
+
+    Parameters:
+    - text (str): The text to fingerprint.
+    - shingle_size (int): Number of consecutive words per shingle.
+
+    Returns:
+    - int: The fingerprint, or None when the text has no words.
+    """
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+
+    counts = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        # Walk only the set bits; every shingle votes -1 on the others, added in bulk below
+        while value:
+            low = value & -value
+            counts[low.bit_length() - 1] += 2
+            value ^= low
+    threshold = len(shingles)
+    fingerprint = 0
+    for bit, count in enumerate(counts):
+        if count > threshold:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    def __init__(self, max_distance=3, max_entries=10000, min_words=50, ttl_seconds=None):
+        """
+        Thread-safe LSH index from SimHash fingerprints (and canonical URLs) to cached values.
+
+        Fingerprints are split into max_distance + 1 bands; two fingerprints within
+        max_distance bits agree on at least one whole band, so only entries sharing a band
+        are compared.
+
+        Parameters:
+        - max_distance (int): Largest Hamming distance treated as a near-duplicate.
+        - max_entries (int): Number of fingerprints kept; the least recently used are evicted.
+        - min_words (int): Texts shorter than this are not indexed (error and stub pages look alike).
+        - ttl_seconds (float): Age after which an entry is dropped instead of reused; None keeps
+          entries until they are evicted.
+        """
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.min_words = min_words
+        self.ttl_seconds = ttl_seconds
+        num_bands = max_distance + 1
+        bounds = [round(i * 64 / num_bands) for i in range(num_bands + 1)]
+        self._bands = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._tables = [{} for _ in self._bands]  # band value -> set of fingerprints
+        self._entries = OrderedDict()  # fingerprint -> (url, value, time added)
+        self._urls = {}  # canonical url -> fingerprint
+        self._aliases = {}  # fingerprint -> canonical urls mapped to it
+        self._lock = threading.Lock()
+
+    def _band_keys(self, fingerprint):
+        return [(fingerprint >> start) & mask for start, mask in self._bands]
+
+    def _live(self, fingerprint):
+        """Return the (url, value) of an entry, dropping it if it outlived the TTL."""
+        url, value, added = self._entries[fingerprint]
+        if self.ttl_seconds is not None and time.monotonic() - added > self.ttl_seconds:
+            self._evict(fingerprint)
+            return None
+        self._entries.move_to_end(fingerprint)
+        return url, value
+
+    def fingerprint(self, text):
+        """Return the SimHash of a text, or None when it is too short to compare."""
+        if not text or len(_WORD_RE.findall(text)) < self.min_words:
+            return None
+        return simhash(text)
+
+    def get_url(self, url):
+        """
+        Look up a page by URL.
+
+        Returns:
+        - tuple: (fingerprint, twin url, value) of the cached page at the same canonical URL, or None.
+        """
+        with self._lock:
+            fingerprint = self._urls.get(canonicalize_url(url))
+            if fingerprint is None:
+                return None
+            entry = self._live(fingerprint)
+            return None if entry is None else (fingerprint,) + entry
+
+    def find(self, fingerprint):
+        """
+        Look up the closest indexed near-duplicate of a fingerprint.
+
+        Returns:
+        - tuple: (fingerprint, twin url, value) of the nearest entry within max_distance bits, or None.
+        """
+        if fingerprint is None:
+            return None
+        with self._lock:
+            candidates = set()
+            for table, key in zip(self._tables, self._band_keys(fingerprint)):
+                candidates.update(table.get(key, ()))
+            for distance, candidate in sorted((hamming_distance(fingerprint, c), c) for c in candidates):
+                if distance > self.max_distance:
+                    break
+                entry = self._live(candidate)
+                if entry is not None:
+                    return (candidate,) + entry
+            return None
+
+    def add(self, url, fingerprint, value):
+        """
+        Cache the value computed for a page.
+
+        Parameters:
+        - url (str): The page URL.
+        - fingerprint (int): SimHash of the page text, from fingerprint(); None is not cached.
+        - value: The value to reuse for the page and its near-duplicates.
+        """
+        if fingerprint is None:
+            return
+        with self._lock:
+            if fingerprint not in self._entries:
+                for table, key in zip(self._tables, self._band_keys(fingerprint)):
+                    table.setdefault(key, set()).add(fingerprint)
+                self._aliases[fingerprint] = set()
+            self._entries[fingerprint] = (url, value, time.monotonic())
+            self._entries.move_to_end(fingerprint)
+            self._add_alias(url, fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._evict()
+
+    def add_alias(self, url, fingerprint):
+        """Map another URL (e.g. a near-duplicate of an indexed page) to an existing entry."""
+        with self._lock:
+            if fingerprint in self._entries:
+                self._add_alias(url, fingerprint)
+
+    def _add_alias(self, url, fingerprint):
+        canonical_url = canonicalize_url(url)
+        previous = self._urls.get(canonical_url)
+        if previous is not None and previous != fingerprint:
+            self._aliases[previous].discard(canonical_url)
+        self._urls[canonical_url] = fingerprint
+        self._aliases[fingerprint].add(canonical_url)
+
+    def _evict(self, fingerprint=None):
+        if fingerprint is None:
+            fingerprint, _ = self._entries.popitem(last=False)  # least recently used
+        else:
+            del self._entries[fingerprint]
+        for table, key in zip(self._tables, self._band_keys(fingerprint)):
+            bucket = table[key]
+            bucket.discard(fingerprint)
+            if not bucket:
+                del table[key]
+        for canonical_url in self._aliases.pop(fingerprint):
+            del self._urls[canonical_url]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_page_indexes = {}
+_page_index_lock = threading.Lock()
+
+
+def get_page_index(key=None):
+    """
+    Return the process-wide SimHashIndex of extracted page topics, creating it on first use.
+
+    Parameters:
+    - key: The settings the cached values depend on (e.g. the number of topics extracted);
+      values computed with different settings are kept in separate indexes.
+    """
+    with _page_index_lock:
+        index = _page_indexes.get(key)
+        if index is None:
+            index = _page_indexes[key] = SimHashIndex(ttl_seconds=DEFAULT_TTL_SECONDS)
+        return index
@@ -0,0 +1,505 @@
+import threading
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Fields stored as nullable 64-bit integers
+INT_FIELDS = {"hash_id", "recommended", "referenceCount", "citationCount"}
+# Fields stored as UTC microsecond timestamps
+TIMESTAMP_FIELDS = {"published"}
+# Multi-valued text fields: separator, and whether every value is followed by it ("a|b|")
+LIST_FIELDS = {"authors": (", ", False), "s2FieldsOfStudy": ("|", True)}
+
+# Null timestamp; numpy reads this int64 as NaT, so the pandas view needs no mask
+_NAT = -2 ** 63
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _is_dictionary_field(name: str) -> bool:
+    # Tags and fields repeat across many papers, so they are stored once each
+    return name == "field" or name.startswith("Tag_")
+
+
+def _set_bit(bitmap: bytearray, i: int, valid: bool) -> None:
+    while len(bitmap) <= i >> 3:
+        bitmap.append(0)
+    if valid:
+        bitmap[i >> 3] |= 1 << (i & 7)
+    else:
+        bitmap[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+
+def _get_bit(bitmap: bytearray, i: int) -> bool:
+    return i >> 3 < len(bitmap) and bool(bitmap[i >> 3] & (1 << (i & 7)))
+
+
+class _ObjectColumn:
+    """Plain Python values; None is null."""
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else []
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        self.values.append(value)
+
+    def get(self, i):
+        return self.values[i]
+
+    def set(self, i, value):
+        self.values[i] = value
+
+    def to_arrow(self):
+        return pa.array(self.values)
+
+    def to_pandas(self):
+        return self.values
+
+
+class _IntColumn:
+    """int64 values with an Arrow-layout validity bitmap."""
+
+    typecode = 'q'
+
+    def __init__(self):
+        self.data = array(self.typecode)
+        self.validity = bytearray()
+
+    def __len__(self):
+        return len(self.data)
+
+    def _encode(self, value):
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"not an integer: {value!r}")  # int() would truncate it
+        return int(value)
+
+    def _decode(self, raw):
+        return raw
+
+    def append(self, value):
+        raw = 0 if value is None else self._encode(value)
+        _set_bit(self.validity, len(self.data), value is not None)
+        self.data.append(raw)
+
+    def get(self, i):
+        return self._decode(self.data[i]) if _get_bit(self.validity, i) else None
+
+    def set(self, i, value):
+        self.data[i] = 0 if value is None else self._encode(value)
+        _set_bit(self.validity, i, value is not None)
+
+    def _arrow_type(self):
+        return pa.int64()
+
+    def to_arrow(self):
+        return pa.Array.from_buffers(self._arrow_type(), len(self.data),
+                                     [pa.py_buffer(self.validity), pa.py_buffer(self.data)])
+
+    def to_pandas(self):
+        import numpy as np
+        import pandas as pd
+        values = np.frombuffer(self.data, dtype=np.int64)
+        valid = np.unpackbits(np.frombuffer(self.validity, dtype=np.uint8), bitorder='little')[:len(values)]
+        if valid.all():
+            return values
+        return pd.arrays.IntegerArray(values, valid == 0)
+
+
+class _TimestampColumn(_IntColumn):
+    """UTC timestamps as int64 microseconds since the epoch."""
+
+    def _encode(self, value):
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        if not isinstance(value, datetime):
+            raise TypeError(f"not a timestamp: {value!r}")
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        delta = value - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+    def _decode(self, raw):
+        return _EPOCH + timedelta(microseconds=raw)
+
+    def append(self, value):
+        super().append(value)
+        if value is None:
+            self.data[-1] = _NAT
+
+    def set(self, i, value):
+        super().set(i, value)
+        if value is None:
+            self.data[i] = _NAT
+
+    def _arrow_type(self):
+        return pa.timestamp('us', tz='UTC')
+
+    def to_pandas(self):
+        import numpy as np
+        import pandas as pd
+        return pd.DatetimeIndex(np.frombuffer(self.data, dtype='datetime64[us]')).tz_localize('UTC')
+
+
+class _DictionaryColumn:
+    """int32 codes into a list of distinct strings; -1 is null (as in pandas Categorical)."""
+
+    def __init__(self):
+        self.codes = array('i')
+        self.validity = bytearray()
+        self.dictionary = []
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getstate__(self):
+        # The lookup is rebuilt on unpickling, so it does not cross process boundaries
+        state = dict(self.__dict__)
+        del state["_lookup"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lookup = {value: code for code, value in enumerate(self.dictionary)}
+
+    def _code(self, value):
+        if not isinstance(value, str):
+            raise TypeError(f"not a string: {value!r}")
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return code
+
+    def append(self, value):
+        code = -1 if value is None else self._code(value)
+        _set_bit(self.validity, len(self.codes), value is not None)
+        self.codes.append(code)
+
+    def get(self, i):
+        code = self.codes[i]
+        return None if code < 0 else self.dictionary[code]
+
+    def set(self, i, value):
+        self.codes[i] = -1 if value is None else self._code(value)
+        _set_bit(self.validity, i, value is not None)
+
+    def to_arrow(self):
+        indices = pa.Array.from_buffers(pa.int32(), len(self.codes),
+                                        [pa.py_buffer(self.validity), pa.py_buffer(self.codes)])
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self.dictionary, pa.string()))
+
+    def to_pandas(self):
+        import numpy as np
+        import pandas as pd
+        return pd.Categorical.from_codes(np.frombuffer(self.codes, dtype=np.int32),
+                                         categories=self.dictionary)
+
+
+class _ListDictionaryColumn(_DictionaryColumn):
+    """
+    Separator-joined text (e.g. authors) kept as a list of dictionary codes per row, so each
+    distinct author or field of study is stored once.
+    """
+
+    def __init__(self, separator, terminated):
+        super().__init__()
+        self.separator = separator
+        self.terminated = terminated
+        # Row i holds codes[starts[i]:ends[i]]; a row that grows is rewritten at the end
+        self.starts = array('i')
+        self.ends = array('i')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _items(self, value):
+        if not isinstance(value, str):
+            raise TypeError(f"not a string: {value!r}")
+        items = value.split(self.separator) if value else []
+        if self.terminated and items:
+            if items[-1]:
+                raise ValueError(f"missing trailing {self.separator!r}: {value!r}")
+            items.pop()
+        return [self._code(item) for item in items]
+
+    def append(self, value):
+        codes = [] if value is None else self._items(value)
+        _set_bit(self.validity, len(self.starts), value is not None)
+        self.starts.append(len(self.codes))
+        self.codes.extend(codes)
+        self.ends.append(len(self.codes))
+
+    def get(self, i):
+        if not _get_bit(self.validity, i):
+            return None
+        items = [self.dictionary[code] for code in self.codes[self.starts[i]:self.ends[i]]]
+        if self.terminated:
+            return "".join(item + self.separator for item in items)
+        return self.separator.join(items)
+
+    def set(self, i, value):
+        codes = [] if value is None else self._items(value)
+        start = self.starts[i]
+        if len(codes) <= self.ends[i] - start:
+            self.codes[start:start + len(codes)] = array('i', codes)
+        else:
+            start = self.starts[i] = len(self.codes)
+            self.codes.extend(codes)
+        self.ends[i] = start + len(codes)
+        _set_bit(self.validity, i, value is not None)
+
+    def _offsets(self):
+        # Arrow needs rows back to back; rewrite the codes only if some row moved or shrank
+        if any(self.starts[i] != (self.ends[i - 1] if i else 0) for i in range(len(self.starts))):
+            codes = array('i')
+            for i in range(len(self.starts)):
+                start = len(codes)
+                codes.extend(self.codes[self.starts[i]:self.ends[i]])
+                self.starts[i], self.ends[i] = start, len(codes)
+            self.codes = codes
+        offsets = array('i', self.starts)
+        offsets.append(self.ends[-1] if self.ends else 0)
+        return offsets
+
+    def to_arrow(self):
+        offsets = self._offsets()
+        items = pa.DictionaryArray.from_arrays(
+            pa.Array.from_buffers(pa.int32(), offsets[-1], [None, pa.py_buffer(self.codes)]),
+            pa.array(self.dictionary, pa.string())
+        )
+        return pa.Array.from_buffers(pa.list_(items.type), len(self.starts),
+                                     [pa.py_buffer(self.validity), pa.py_buffer(offsets)], children=[items])
+
+    def to_pandas(self):
+        # Lists of items, as pyarrow converts list columns
+        return [[self.dictionary[code] for code in self.codes[self.starts[i]:self.ends[i]]]
+                if _get_bit(self.validity, i) else None for i in range(len(self.starts))]
+
+
+def _new_column(name: str):
+    if name in INT_FIELDS:
+        return _IntColumn()
+    if name in TIMESTAMP_FIELDS:
+        return _TimestampColumn()
+    if name in LIST_FIELDS:
+        return _ListDictionaryColumn(*LIST_FIELDS[name])
+    if _is_dictionary_field(name):
+        return _DictionaryColumn()
+    return _ObjectColumn()
+
+
+class PaperRecord(MutableMapping):
+    """
+    Dict-like view of one row of a PaperBatch.
+
+    Reads and writes go straight to the batch columns, so stage code written for paper
+    dictionaries (paper['citationCount'] = ..., paper.get('summary'), paper.update(tags))
+    works unchanged. As with a dict, a field set to None is present; a field never set (or
+    deleted) is absent, although both are null in the columns.
+    """
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch: "PaperBatch", index: int):
+        self.batch = batch
+        self.index = index
+
+    def __getitem__(self, name):
+        if not self.batch.has(self.index, name):
+            raise KeyError(name)
+        return self.batch.columns[name].get(self.index)
+
+    def __contains__(self, name):
+        return self.batch.has(self.index, name)
+
+    def __setitem__(self, name, value):
+        self.batch.set(self.index, name, value)
+
+    def __delitem__(self, name):
+        if not self.batch.delete(self.index, name):
+            raise KeyError(name)
+
+    def __iter__(self) -> Iterator[str]:
+        names = list(self.batch.columns)  # other threads may add columns
+        return (name for name in names if self.batch.has(self.index, name))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"PaperRecord({dict(self)!r})"
+
+
+class PaperBatch:
+    def __init__(self):
+        """
+        Columnar store of paper records.
+
+        Counts and ids are int64 arrays, 'published' is an int64 microsecond timestamp,
+        authors and s2FieldsOfStudy are lists of dictionary codes and tags and fields are
+        dictionary codes, so repeated strings are stored once per batch. Rows are read and
+        updated through PaperRecord views. Next to each column's null bitmap, a presence bitmap
+        records which rows have the field at all, so a field set to None and a field never set
+        read back as they would from a dict.
+
+        Writes are serialized by a lock, so stage threads may update different rows of the
+        same batch. to_arrow() and to_pandas() seal the batch (see seal()) and hand out its
+        column buffers without copying them.
+        """
+        self.columns = {}
+        self.present = {}  # field -> bitmap of the rows that have the field
+        self.length = 0
+        self.sealed = False
+        self._table = None  # to_arrow() result, kept once the batch is sealed
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_lock"]
+        state["_table"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_papers(cls, papers: Iterable[Dict[str, Any]]) -> "PaperBatch":
+        """Build a batch from paper dictionaries (or records of other batches)."""
+        batch = cls()
+        for paper in papers:
+            batch.append(paper)
+        return batch
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [PaperRecord(self, i) for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("paper index out of range")
+        return PaperRecord(self, index)
+
+    def __iter__(self) -> Iterator[PaperRecord]:
+        return (PaperRecord(self, i) for i in range(self.length))
+
+    def _column(self, name: str):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = _new_column(name)
+            for _ in range(self.length):
+                column.append(None)
+            self.present[name] = bytearray()
+        return column
+
+    def _demote(self, name: str) -> _ObjectColumn:
+        # A value the typed encoding cannot hold (e.g. a malformed date) keeps the column as objects
+        column = self.columns[name]
+        self.columns[name] = _ObjectColumn([column.get(i) for i in range(len(column))])
+        return self.columns[name]
+
+    def _check_writable(self) -> None:
+        if self.sealed:
+            raise RuntimeError("PaperBatch is sealed; copy it with PaperBatch.from_papers() to change it")
+
+    def seal(self) -> "PaperBatch":
+        """
+        Make the batch read-only, so exports can share its buffers. Appending, setting or
+        deleting a field afterwards raises RuntimeError.
+
+        Returns:
+            PaperBatch: The batch itself.
+        """
+        with self._lock:
+            self.sealed = True
+        return self
+
+    def append(self, paper: Dict[str, Any]) -> PaperRecord:
+        """Add a paper and return its record view."""
+        with self._lock:
+            self._check_writable()
+            for name in paper:
+                self._column(name)
+            for name, column in list(self.columns.items()):
+                value = paper.get(name)
+                try:
+                    column.append(value)
+                except (TypeError, ValueError):
+                    self._demote(name).append(value)
+                _set_bit(self.present[name], self.length, name in paper)
+            self.length += 1
+            return PaperRecord(self, self.length - 1)
+
+    def set(self, index: int, name: str, value: Any) -> None:
+        """Set one field of one paper."""
+        with self._lock:
+            self._check_writable()
+            column = self._column(name)
+            try:
+                column.set(index, value)
+            except (TypeError, ValueError):
+                self._demote(name).set(index, value)
+            _set_bit(self.present[name], index, True)
+
+    def has(self, index: int, name: str) -> bool:
+        """Whether a paper has a field, even if its value is None."""
+        present = self.present.get(name)
+        return present is not None and _get_bit(present, index)
+
+    def delete(self, index: int, name: str) -> bool:
+        """Remove one field of one paper; returns False if the paper did not have it."""
+        with self._lock:
+            self._check_writable()
+            if not self.has(index, name):
+                return False
+            self.columns[name].set(index, None)
+            _set_bit(self.present[name], index, False)
+            return True
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [dict(record) for record in self]
+
+    def to_arrow(self):
+        """
+        Seal the batch and return it as a pyarrow Table; absent fields and None are both null.
+
+        Numeric, timestamp and code columns wrap the batch buffers without copying them; only
+        the distinct strings and plain object columns are converted. The table is built once
+        and returned again by later calls.
+
+        Raises:
+            ImportError: If pyarrow is not installed.
+        """
+        if pa is None:
+            raise ImportError("pyarrow is required for PaperBatch.to_arrow")
+        with self._lock:
+            self.sealed = True
+            if self._table is None:
+                self._table = pa.table({name: column.to_arrow() for name, column in self.columns.items()})
+            return self._table
+
+    def to_pandas(self):
+        """
+        Seal the batch and return it as a pandas DataFrame.
+
+        With pyarrow this goes through to_arrow(); dictionary columns become Categoricals.
+        Without pyarrow the same columns are built from numpy arrays over the batch buffers.
+        """
+        if pa is not None:
+            return self.to_arrow().to_pandas()
+        import pandas as pd
+        with self._lock:
+            self.sealed = True
+            return pd.DataFrame({name: column.to_pandas() for name, column in self.columns.items()})
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List
+
+from arxiv_search import paper_key, paper_hash_id
+
+# Stage flags stored per paper; "search" only registers the paper
+STAGE_COLUMNS = {"enrich": "enriched", "tag": "tagged"}
+
+# Fields that belong to a single query run and are never shared through the index
+_PER_QUERY_FIELDS = ("query_id",)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        Fixed-size Bloom filter over string keys.
+
+        Parameters:
+            capacity (int): Number of keys the filter is sized for.
+            error_rate (float): Target false positive rate at capacity.
+        """
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Double hashing: k positions from two independent 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class PaperIndex:
+    def __init__(self, path: str = "paper_index.sqlite", expected_papers: int = 1000000, error_rate: float = 0.001):
+        """
+        Persistent paper identity index shared by all queries and runs.
+
+        Papers are keyed by their version-less arXiv id (see arxiv_search.paper_key). A Bloom
+        filter answers most "never seen" lookups without touching the SQLite store, which
+        keeps the latest enriched/tagged record of each paper.
+
+        Parameters:
+            path (str): SQLite database file.
+            expected_papers (int): Initial Bloom filter capacity; it is rebuilt larger when exceeded.
+            error_rate (float): Bloom filter false positive rate.
+        """
+        self.path = path
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._readers = []
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS papers (
+                key TEXT PRIMARY KEY,
+                hash_id INTEGER NOT NULL,
+                enriched INTEGER NOT NULL DEFAULT 0,
+                tagged INTEGER NOT NULL DEFAULT 0,
+                record TEXT NOT NULL
+            )"""
+        )
+        # Papers found by each query, in the order they were written; seq is the digest watermark
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS query_papers (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                query_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                UNIQUE (query_id, key)
+            )"""
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS query_papers_seq ON query_papers (query_id, seq)")
+        self.connection.commit()
+        count = self.connection.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+        self._rebuild_filter(max(expected_papers, count * 2))
+
+    def _rebuild_filter(self, capacity: int) -> None:
+        self.bloom = BloomFilter(capacity, self.error_rate)
+        for (key,) in self.connection.execute("SELECT key FROM papers"):
+            self.bloom.add(key)
+
+    def _reader(self) -> sqlite3.Connection:
+        # Each thread reads through its own connection; in WAL mode readers do not wait on the writer
+        reader = getattr(self._local, "connection", None)
+        if reader is None:
+            reader = self._local.connection = sqlite3.connect(self.path, check_same_thread=False)
+            with self._lock:
+                self._readers.append(reader)
+        return reader
+
+    def _select(self, keys: List[str], columns: str) -> List[tuple]:
+        # Only keys the Bloom filter may contain reach SQLite
+        keys = [key for key in keys if key in self.bloom]
+        rows = []
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(self.connection.execute(
+                f"SELECT key, {columns} FROM papers WHERE key IN ({placeholders})", chunk
+            ).fetchall())
+        return rows
+
+    def contains(self, entry_id: str) -> bool:
+        """
+        Check whether a paper has been seen before.
+
+        Parameters:
+            entry_id (str): arXiv entry id or URL of the paper.
+
+        Returns:
+            bool: True if the paper is in the index.
+        """
+        key = paper_key(entry_id)
+        if key not in self.bloom:
+            return False
+        with self._lock:
+            return bool(self._select([key], "hash_id"))
+
+    __contains__ = contains
+
+    def get_records(self, entry_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch the stored records of several papers.
+
+        Parameters:
+            entry_ids (Iterable[str]): arXiv entry ids or URLs.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Stored records keyed by paper key; unknown papers are omitted.
+        """
+        keys = list(dict.fromkeys(paper_key(entry_id) for entry_id in entry_ids))
+        with self._lock:
+            rows = self._select(keys, "record")
+        return {key: json.loads(record) for key, record in rows}
+
+    def restore(self, papers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Fill papers in place with the enrichment and tag fields stored for them.
+
+        Fields already present on a paper (e.g. fresh search metadata) are kept.
+
+        Parameters:
+            papers (List[Dict[str, Any]]): Paper dictionaries with an 'entry_id'.
+
+        Returns:
+            List[Dict[str, Any]]: The same paper dictionaries.
+        """
+        records = self.get_records(paper["entry_id"] for paper in papers)
+        for paper in papers:
+            record = records.get(paper_key(paper["entry_id"]))
+            if record:
+                for field, value in record.items():
+                    if field not in paper:
+                        paper[field] = value
+        return papers
+
+    def pending(self, papers: List[Dict[str, Any]], stage: str) -> List[Dict[str, Any]]:
+        """
+        Return the papers that have not completed a stage yet.
+
+        Parameters:
+            papers (List[Dict[str, Any]]): Paper dictionaries with an 'entry_id'.
+            stage (str): "enrich" or "tag".
+
+        Returns:
+            List[Dict[str, Any]]: Papers still needing the stage.
+        """
+        column = STAGE_COLUMNS[stage]
+        with self._lock:
+            rows = self._select([paper_key(paper["entry_id"]) for paper in papers], column)
+        done = {key for key, flag in rows if flag}
+        return [paper for paper in papers if paper_key(paper["entry_id"]) not in done]
+
+    def add_papers(self, papers: List[Dict[str, Any]], stage: str = "search", tag_columns: List[str] = None) -> None:
+        """
+        Register papers and store their records after a pipeline stage.
+
+        A search only registers unknown papers. After "enrich" a paper is flagged once it
+        carries Semantic Scholar data; after "tag" once every tag column is filled, so
+        papers that failed a stage are retried by the next run.
+
+        Parameters:
+            papers (List[Dict[str, Any]]): Paper dictionaries with an 'entry_id'.
+            stage (str): "search", "enrich" or "tag".
+            tag_columns (List[str]): Tag columns checked for the "tag" stage.
+        """
+        tag_columns = tag_columns or [f"Tag_{i}" for i in range(1, 6)]
+        rows = []
+        for paper in papers:
+            key = paper_key(paper["entry_id"])
+            enriched = int(stage == "enrich" and "citationCount" in paper)
+            tagged = int(stage == "tag" and all(paper.get(column) for column in tag_columns))
+            record = {field: value for field, value in paper.items() if field not in _PER_QUERY_FIELDS}
+            rows.append((key, paper_hash_id(paper["entry_id"]), enriched, tagged, json.dumps(record, default=str)))
+
+        if stage == "search":
+            statement = "INSERT OR IGNORE INTO papers (key, hash_id, enriched, tagged, record) VALUES (?, ?, ?, ?, ?)"
+        else:
+            statement = """INSERT INTO papers (key, hash_id, enriched, tagged, record) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    enriched = MAX(enriched, excluded.enriched),
+                    tagged = MAX(tagged, excluded.tagged),
+                    record = excluded.record"""
+
+        with self._lock:
+            self.connection.executemany(statement, rows)
+            self.connection.commit()
+            for row in rows:
+                if row[0] not in self.bloom:
+                    self.bloom.add(row[0])
+            if self.bloom.count > self.bloom.capacity:
+                self._rebuild_filter(self.bloom.capacity * 2)
+
+    def link_query(self, query_id: str, papers: List[Dict[str, Any]]) -> None:
+        """
+        Record that a query found these papers. Papers already linked to the query keep their
+        original sequence number, so re-running a query only adds its new papers.
+
+        Parameters:
+            query_id (str): Id of the query document.
+            papers (List[Dict[str, Any]]): Paper dictionaries with an 'entry_id'.
+        """
+        rows = [(query_id, paper_key(paper["entry_id"])) for paper in papers]
+        with self._lock:
+            self.connection.executemany("INSERT OR IGNORE INTO query_papers (query_id, key) VALUES (?, ?)", rows)
+            self.connection.commit()
+
+    def papers_since(self, query_id: str, after_seq: int = 0, limit: int = 1000) -> List[tuple]:
+        """
+        Return the papers linked to a query after a sequence number, oldest first. Safe to call
+        from several threads at once; each reads through its own connection.
+
+        Parameters:
+            query_id (str): Id of the query document.
+            after_seq (int): Watermark; only papers linked after it are returned.
+            limit (int): Maximum number of papers.
+
+        Returns:
+            List[tuple]: (sequence number, stored record) pairs.
+        """
+        rows = self._reader().execute(
+            """SELECT q.seq, p.record FROM query_papers q JOIN papers p ON p.key = q.key
+               WHERE q.query_id = ? AND q.seq > ? ORDER BY q.seq LIMIT ?""",
+            (query_id, after_seq, limit)
+        ).fetchall()
+        return [(seq, json.loads(record)) for seq, record in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            for reader in self._readers:
+                reader.close()
+            self.connection.close()
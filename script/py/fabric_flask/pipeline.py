@@ -0,0 +1,316 @@
+import argparse
+import ast
+import csv
+import heapq
+import itertools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from arxiv_search import ArxivResearchHelper, PAPER_FIELDS, paper_key
+from arxiv_tag import ArxivPaperTagger
+from paper_batch import PaperBatch
+from paper_index import PaperIndex
+
+STAGES = ("search", "enrich", "tag")
+
+# Per-process stage objects, created by _init_worker in each worker (or once for threads)
+_WORKER = {}
+
+
+def _init_worker(config):
+    """Create the helper and tagger used by the stage functions of this process."""
+    _WORKER["helper"] = ArxivResearchHelper(
+        download_dir=config["download_dir"],
+        delay_seconds=config["delay_seconds"]
+    )
+    _WORKER["tagger"] = ArxivPaperTagger(api_key=config["openai_api_key"], num_tags=config["num_tags"])
+
+
+def _search_task(queries, paper_num, date_from, date_to):
+    helper = _WORKER["helper"]
+    if len(queries) == 1:
+        return helper.search_papers(queries[0], max_results=paper_num, date_from=date_from, date_to=date_to,
+                                    as_batch=True)
+    results = helper.search_papers_batch(queries, max_results=paper_num, date_from=date_from, date_to=date_to,
+                                         batch_size=len(queries))
+    return PaperBatch.from_papers(paper for papers in results.values() for paper in papers)
+
+
+def _enrich_task(papers):
+    return _WORKER["helper"].get_citation_data(papers)
+
+
+def _tag_task(papers):
+    return _WORKER["tagger"].tag_papers(papers)
+
+
+def split_query_text(query_text):
+    """
+    Split the query_text of a query document into its individual queries.
+
+    /query_submit stores either a single query string or a list of topics; Spark
+    round-trips the list as its string representation.
+    """
+    if isinstance(query_text, (list, tuple)):
+        queries = query_text
+    elif isinstance(query_text, str) and query_text.strip().startswith("["):
+        queries = ast.literal_eval(query_text)
+    elif query_text:
+        queries = [query_text]
+    else:
+        queries = []
+    # Drop blanks and repeated topics while keeping their order
+    return list(dict.fromkeys(q.strip() for q in queries if q and q.strip()))
+
+
+class ArxivPipelineRunner:
+    def __init__(self, output_dir="pipeline_output", max_workers=8, use_processes=False,
+                 stage_limits=None, paper_num=1, query_batch_size=8, enrich=True, tag=True, tag_batch_size=10,
+                 openai_api_key=None, num_tags=5, download_dir="downloads", delay_seconds=3.0,
+                 paper_index=None, search_index=None):
+        """
+        Run the search, enrich and tag stages for many query documents in one pool.
+
+        Parameters:
+        - output_dir (str): Directory receiving one '_<query_id>.csv' per query document.
+        - max_workers (int): Maximum number of stage tasks running at once.
+        - use_processes (bool): Use a process pool instead of a thread pool.
+        - stage_limits (dict): Maximum concurrent tasks per stage ('search', 'enrich', 'tag'),
+          as positive integers. arXiv asks for one request at a time, so searches default to 1.
+        - paper_num (int): Number of papers fetched per individual query.
+        - query_batch_size (int): Number of a document's queries combined into one OR-ed
+          arXiv search (see ArxivResearchHelper.search_papers_batch); 1 disables batching.
+        - enrich (bool): Run the Semantic Scholar enrichment stage.
+        - tag (bool): Run the OpenAI tagging stage.
+        - tag_batch_size (int): Number of papers per tagging task.
+        - openai_api_key (str): API key for tagging; defaults to OPENAI_API_KEY.
+        - num_tags (int): Number of hierarchical tags per paper.
+        - download_dir (str): Download directory of the ArxivResearchHelper.
+        - delay_seconds (float): Delay between arXiv API requests.
+        - paper_index (PaperIndex): Index shared across runs; defaults to
+          '<output_dir>/paper_index.sqlite'.
+        - search_index (PaperSearchIndex): Full-text index updated with each query's output as
+          it is written. Processes that only read the output directory can use
+          PaperSearchIndex.refresh instead.
+        """
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.stage_limits = {"search": 1, "enrich": 1, "tag": max_workers}
+        for stage, limit in (stage_limits or {}).items():
+            # A stage without a slot would never be dispatched and the run would never finish
+            if stage not in STAGES:
+                raise ValueError(f"Unknown stage in stage_limits: {stage!r}")
+            if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+                raise ValueError(f"stage_limits[{stage!r}] must be a positive integer, got {limit!r}")
+            self.stage_limits[stage] = limit
+        self.paper_num = paper_num
+        self.query_batch_size = max(1, query_batch_size)
+        self.enrich = enrich
+        self.tag = tag
+        self.tag_batch_size = tag_batch_size
+        self.num_tags = num_tags
+        self.config = {
+            "download_dir": download_dir,
+            "delay_seconds": delay_seconds,
+            "openai_api_key": openai_api_key or os.getenv('OPENAI_API_KEY', ''),
+            "num_tags": num_tags,
+        }
+        self.tagger = ArxivPaperTagger(api_key=self.config["openai_api_key"], num_tags=num_tags)
+        self.output_fields = PAPER_FIELDS + ["query_id"] + self.tagger.tag_columns + ["field"]
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.paper_index = paper_index or PaperIndex(os.path.join(self.output_dir, "paper_index.sqlite"))
+        self.search_index = search_index
+
+    def _create_executor(self):
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                       initargs=(self.config,))
+        _init_worker(self.config)
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def run(self, query_documents):
+        """
+        Process query documents and write one merged, deduplicated output per query id.
+
+        Higher 'priority' values are dispatched first (0 LOW, 1 MEDIUM, 2 HIGH as in
+        auto_email); later stages of a query go ahead of new searches of the same priority
+        so that finished queries are written as early as possible.
+
+        A paper found by several queries is enriched and tagged once: papers completed by
+        an earlier run are restored from the paper index, and a query whose paper is being
+        processed for another query in this run waits for that result.
+
+        Parameters:
+        - query_documents (list of dict): Documents as written by /query_submit.
+
+        Returns:
+        - dict: Mapping of query id to the output file path.
+        """
+        jobs = {}
+        papers = {}  # paper key -> shared record for this run
+        ready = []  # heap of (-priority, stage rank, sequence, query_id, stage, args)
+        counter = itertools.count()
+        outputs = {}
+        claimed = {stage: set() for stage in STAGES}
+        in_progress = {stage: set() for stage in STAGES}  # claimed keys whose task has not finished
+        waiters = {}  # (stage, paper key) -> query ids waiting on another query's task
+        next_stage = {"search": "enrich" if self.enrich else "tag" if self.tag else None,
+                      "enrich": "tag" if self.tag else None, "tag": None}
+
+        def push(query_id, stage, args):
+            job = jobs[query_id]
+            job["pending"] += 1
+            rank = len(STAGES) - STAGES.index(stage)
+            heapq.heappush(ready, (-job["priority"], rank, next(counter), query_id, stage, args))
+
+        def advance(query_id):
+            """Queue the next stage of a query once every paper finished its current stage."""
+            job = jobs[query_id]
+            while not job["pending"] and not job["waiting"]:
+                stage = next_stage[job["stage"]]
+                if stage is None:
+                    records = [dict(papers[key]) for key in job["keys"]]
+                    outputs[query_id] = self._write_output(query_id, records)
+                    return
+                job["stage"] = stage
+                own = []
+                for paper in self.paper_index.pending([papers[key] for key in job["keys"]], stage):
+                    key = paper_key(paper["entry_id"])
+                    if key in in_progress[stage]:
+                        # Claimed by another query; its task may still be queued behind others
+                        waiters.setdefault((stage, key), []).append(query_id)
+                        job["waiting"] += 1
+                    elif key not in claimed[stage]:
+                        claimed[stage].add(key)
+                        in_progress[stage].add(key)
+                        own.append(paper)
+                batch_size = self.tag_batch_size if stage == "tag" else 100
+                for i in range(0, len(own), batch_size):
+                    chunk = own[i:i + batch_size]
+                    if self.use_processes:
+                        # Records are views of whole search batches; send workers just these rows
+                        chunk = PaperBatch.from_papers(chunk)
+                    push(query_id, stage, (chunk,))
+
+        for document in query_documents:
+            query_id = document["id"]
+            jobs[query_id] = {
+                "priority": int(document.get("priority") or 0),
+                "pending": 0,
+                "waiting": 0,
+                "keys": {},  # ordered set of paper keys
+                "stage": "search",
+            }
+            queries = split_query_text(document.get("query_text"))
+            for i in range(0, len(queries), self.query_batch_size):
+                push(query_id, "search",
+                     (queries[i:i + self.query_batch_size], self.paper_num,
+                      document.get("date_from") or None, document.get("date_to") or None))
+            if not queries:
+                print(f"No queries to run for {query_id}")
+                advance(query_id)
+
+        running = {}  # future -> (query_id, stage, paper keys)
+        in_flight = dict.fromkeys(STAGES, 0)
+        stage_functions = {"search": _search_task, "enrich": _enrich_task, "tag": _tag_task}
+
+        with self._create_executor() as executor:
+            while ready or running:
+                # Dispatch the highest priority tasks whose stage still has capacity
+                deferred = []
+                while ready and len(running) < self.max_workers:
+                    task = heapq.heappop(ready)
+                    stage = task[4]
+                    if in_flight[stage] >= self.stage_limits[stage]:
+                        deferred.append(task)
+                        continue
+                    keys = [] if stage == "search" else [paper_key(paper["entry_id"]) for paper in task[5][0]]
+                    future = executor.submit(stage_functions[stage], *task[5])
+                    running[future] = (task[3], stage, keys)
+                    in_flight[stage] += 1
+                    if all(in_flight[s] >= self.stage_limits[s] for s in STAGES):
+                        break
+                for task in deferred:
+                    heapq.heappush(ready, task)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    query_id, stage, keys = running.pop(future)
+                    in_flight[stage] -= 1
+                    job = jobs[query_id]
+                    job["pending"] -= 1
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        print(f"Error in {stage} stage for {query_id}: {e}")
+                        results = []
+
+                    if stage == "search":
+                        # Merge as results arrive; earlier runs' enrichment and tags are reused
+                        new_papers = []
+                        for paper in results:
+                            key = paper_key(paper["entry_id"])
+                            job["keys"][key] = None
+                            if key not in papers:
+                                papers[key] = paper
+                                new_papers.append(paper)
+                        self.paper_index.restore(new_papers)
+                        self.paper_index.add_papers(new_papers, "search")
+                    else:
+                        for paper in results:
+                            papers[paper_key(paper["entry_id"])] = paper
+                        self.paper_index.add_papers(results, stage, self.tagger.tag_columns)
+
+                    to_advance = [query_id]
+                    for key in keys:
+                        in_progress[stage].discard(key)
+                        for waiting_id in waiters.pop((stage, key), []):
+                            jobs[waiting_id]["waiting"] -= 1
+                            to_advance.append(waiting_id)
+                    for advance_id in dict.fromkeys(to_advance):
+                        advance(advance_id)
+
+        return outputs
+
+    def _write_output(self, query_id, papers):
+        """Write the merged papers of one query id in a single pass."""
+        if self.tag:
+            self.tagger.assign_fields(papers)
+        filename = os.path.join(self.output_dir, f"_{query_id}.csv")
+        with open(filename, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=self.output_fields, restval="", extrasaction='ignore')
+            writer.writeheader()
+            for paper in papers:
+                paper['query_id'] = query_id
+                writer.writerow(paper)
+        print(f"Saved {len(papers)} papers to {filename}")
+        # Linked only once complete, so digests never pick up half-processed papers
+        self.paper_index.link_query(query_id, papers)
+        if self.search_index is not None:
+            self.search_index.add_papers(papers)
+        return filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the arXiv search, enrich and tag pipeline locally.")
+    parser.add_argument("queries", help="JSON file with a list of query documents")
+    parser.add_argument("--output-dir", default="pipeline_output")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--processes", action="store_true", help="Use a process pool instead of threads")
+    parser.add_argument("--paper-num", type=int, default=1)
+    parser.add_argument("--query-batch-size", type=int, default=8)
+    parser.add_argument("--no-enrich", action="store_true")
+    parser.add_argument("--no-tag", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.queries, encoding='utf-8') as f:
+        documents = json.load(f)
+
+    runner = ArxivPipelineRunner(output_dir=args.output_dir, max_workers=args.workers,
+                                 use_processes=args.processes, paper_num=args.paper_num,
+                                 query_batch_size=args.query_batch_size,
+                                 enrich=not args.no_enrich, tag=not args.no_tag)
+    print(runner.run(documents))
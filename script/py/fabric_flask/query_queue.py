@@ -0,0 +1,352 @@
+import copy
+import heapq
+import itertools
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Query document status values, as used by /query_submit and the query_flag notebook
+STATUS_PENDING = 0
+STATUS_PROCESSING = 1
+STATUS_COMPLETED = 2
+STATUS_FAILED = 3
+
+
+class LocalQueryStore:
+    def __init__(self, partition_key: str = "partitionKey"):
+        """
+        In-memory stand-in for the query container, for running the work queue without Cosmos DB.
+
+        It implements the subset of CosmosDBClient used by QueryWorkQueue, including '_etag'
+        checks on replace and a change feed with integer continuation tokens.
+
+        Parameters:
+            partition_key (str): Name of the partition key property.
+        """
+        self.partition_key = partition_key
+        self._documents = {}
+        self._changes = []  # document ids in change order; continuation tokens are positions in this list
+        self._lock = threading.Lock()
+
+    def _write(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        data.setdefault(self.partition_key, "default_partition")
+        document = copy.deepcopy(data)
+        document["_etag"] = uuid.uuid4().hex
+        document["_ts"] = int(time.time())
+        self._documents[document["id"]] = document
+        self._changes.append(document["id"])
+        return copy.deepcopy(document)
+
+    def create_document(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if data["id"] in self._documents:
+                print("Error creating document: id already exists")
+                return None
+            return self._write(data)
+
+    def upsert_document(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._write(data)
+
+    def replace_document(self, data: Dict[str, Any], etag: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            current = self._documents.get(data["id"])
+            if current is None or current["_etag"] != etag:
+                return None
+            return self._write(data)
+
+    def batch_replace_documents(self, documents: List[Tuple[Dict[str, Any], str]]) -> int:
+        with self._lock:
+            written = 0
+            for data, etag in documents:
+                current = self._documents.get(data["id"])
+                if current is not None and current["_etag"] == etag:
+                    self._write(data)
+                    written += 1
+            return written
+
+    def read_change_feed(self, continuation: Optional[str] = None, start_from_beginning: bool = False,
+                         max_item_count: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        with self._lock:
+            if continuation is None:
+                position = 0 if start_from_beginning else len(self._changes)
+            else:
+                position = int(continuation)
+            # Like the Cosmos DB feed, only the latest version of each changed document is returned
+            changed_ids = list(dict.fromkeys(self._changes[position:]))
+            items = [copy.deepcopy(self._documents[document_id]) for document_id in changed_ids]
+            return items, str(len(self._changes))
+
+
+class QueryWorkQueue:
+    def __init__(self, store, worker_id: Optional[str] = None, lease_seconds: float = 60.0,
+                 completion_batch_size: int = 50, start_from_beginning: bool = True, max_attempts: int = 3):
+        """
+        Priority work queue over the query container, fed by its change feed.
+
+        Workers claim a query document by setting status 1 with a lease (owner and expiry)
+        through an etag-conditional replace, so two workers can never claim the same version
+        of a document. Leases are renewed with heartbeat() while the work runs; a lease that
+        expires (crashed worker) makes the document claimable again. Every claim counts as an
+        attempt; a document that is released or abandoned max_attempts times is marked failed
+        (status 3) instead of being retried forever. Completions are buffered and written with
+        transactional batches, conditional on the etag of the lease they complete, so a worker
+        that lost its lease cannot overwrite the new owner's state. A completed document's lease
+        is no longer renewed, so its buffer is flushed by a timer within a third of the lease
+        even if the worker stalls between polls.
+
+        Parameters:
+            store (CosmosDBClient | LocalQueryStore): The query container.
+            worker_id (Optional[str]): Lease owner name; defaults to host name plus a random suffix.
+            lease_seconds (float): Lease duration; heartbeats must come faster than this.
+            completion_batch_size (int): Number of buffered completions that triggers a flush.
+            start_from_beginning (bool): Read the whole change feed on the first poll so
+                documents created before the worker started are picked up.
+            max_attempts (int): Number of claims after which a document that was not completed is
+                marked failed.
+        """
+        self.store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.completion_batch_size = completion_batch_size
+        self.start_from_beginning = start_from_beginning
+        self.max_attempts = max_attempts
+        self._continuation = None
+        self._heap = []  # (-priority, created_at, sequence, document id)
+        self._counter = itertools.count()
+        self._documents = {}  # document id -> latest known version
+        self._leased = {}  # document id -> lease expiry of documents held by other workers
+        self._completions = []  # (completed document, etag of the lease it completes)
+        self._oldest_completion = None
+        self._flush_timer = None
+        self._lock = threading.RLock()
+
+    def _is_claimable(self, document: Dict[str, Any], now: float) -> bool:
+        status = document.get("status")
+        if status == STATUS_PENDING:
+            return True
+        # A processing document whose lease expired belongs to a worker that stopped heart-beating
+        return status == STATUS_PROCESSING and document.get("lease_expires_at", 0) < now
+
+    def _enqueue(self, document: Dict[str, Any]) -> None:
+        created_at = document.get("metadata", {}).get("created_at", "")
+        priority = int(document.get("priority") or 0)
+        heapq.heappush(self._heap, (-priority, created_at, next(self._counter), document["id"]))
+
+    def poll(self) -> int:
+        """
+        Read new changes from the feed and requeue documents whose lease expired.
+
+        Returns:
+            int: Number of claimable documents known to this worker.
+        """
+        self.flush_due()
+        items, token = self.store.read_change_feed(
+            continuation=self._continuation,
+            start_from_beginning=self.start_from_beginning and self._continuation is None
+        )
+        now = time.time()
+        with self._lock:
+            self._continuation = token
+            for document in items:
+                self._documents[document["id"]] = document
+                self._leased.pop(document["id"], None)
+                if self._is_claimable(document, now):
+                    self._enqueue(document)
+                elif document.get("status") == STATUS_PROCESSING:
+                    self._leased[document["id"]] = document.get("lease_expires_at", 0)
+                else:
+                    self._documents.pop(document["id"])
+
+            for document_id, expires_at in list(self._leased.items()):
+                if expires_at < now:
+                    del self._leased[document_id]
+                    document = self._documents.get(document_id)
+                    if document is not None:
+                        self._enqueue(document)
+            return len(self._heap)
+
+    def _lease(self, document: Dict[str, Any], status: int) -> Optional[Dict[str, Any]]:
+        updated = {key: value for key, value in document.items() if not key.startswith("_")}
+        updated["status"] = status
+        updated["lease_owner"] = self.worker_id
+        updated["lease_expires_at"] = time.time() + self.lease_seconds
+        updated["updated_at"] = datetime.now(timezone.utc).isoformat()
+        return self.store.replace_document(updated, document["_etag"])
+
+    def _fail(self, document: Dict[str, Any], error: Optional[str]) -> Optional[Dict[str, Any]]:
+        failed = {key: value for key, value in document.items() if not key.startswith("_")}
+        failed["status"] = STATUS_FAILED
+        failed.pop("lease_expires_at", None)
+        if error:
+            failed["last_error"] = error
+        failed["updated_at"] = datetime.now(timezone.utc).isoformat()
+        return self.store.replace_document(failed, document["_etag"])
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Claim the highest priority claimable document.
+
+        Returns:
+            Optional[Dict[str, Any]]: The leased document, or None if nothing is claimable.
+        """
+        while True:
+            with self._lock:
+                if not self._heap:
+                    return None
+                document_id = heapq.heappop(self._heap)[3]
+                document = self._documents.get(document_id)
+            if document is None or not self._is_claimable(document, time.time()):
+                continue  # completed since, or a stale entry of a document already handed out
+            if document.get("attempts", 0) >= self.max_attempts:
+                # Its last worker crashed or gave up without releasing it
+                print(f"Query {document_id} failed after {document['attempts']} attempts")
+                self._fail(document, document.get("last_error"))
+                continue
+            document = dict(document, attempts=document.get("attempts", 0) + 1)
+            claimed = self._lease(document, STATUS_PROCESSING)
+            if claimed is not None:
+                with self._lock:
+                    # Until the feed returns this version, later heap entries must see it as taken
+                    self._documents[document_id] = claimed
+                return claimed
+            # Another worker changed the document first; its change feed entry will tell us more
+
+    def heartbeat(self, document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Renew the lease of a claimed document.
+
+        Parameters:
+            document (Dict[str, Any]): The document returned by claim() or the last heartbeat().
+
+        Returns:
+            Optional[Dict[str, Any]]: The renewed document, or None if the lease was lost.
+        """
+        return self._lease(document, STATUS_PROCESSING)
+
+    def release(self, document: Dict[str, Any], error: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Give a claimed document back to the queue without completing it, or mark it failed
+        once it used up max_attempts.
+
+        Parameters:
+            document (Dict[str, Any]): The claimed document.
+            error (Optional[str]): Why processing failed, kept as 'last_error'.
+
+        Returns:
+            Optional[Dict[str, Any]]: The written document, or None if the lease was lost.
+        """
+        if document.get("attempts", 0) >= self.max_attempts:
+            print(f"Query {document['id']} failed after {document['attempts']} attempts")
+            return self._fail(document, error)
+        released = {key: value for key, value in document.items() if not key.startswith("_")}
+        released["status"] = STATUS_PENDING
+        released.pop("lease_owner", None)
+        released.pop("lease_expires_at", None)
+        if error:
+            released["last_error"] = error
+        released["updated_at"] = datetime.now(timezone.utc).isoformat()
+        return self.store.replace_document(released, document["_etag"])
+
+    def complete(self, document: Dict[str, Any]) -> None:
+        """
+        Mark a claimed document as completed. The write is buffered until flush(), and dropped
+        if the document changed since (its lease expired and another worker claimed it).
+
+        Parameters:
+            document (Dict[str, Any]): The claimed document, as returned by the last heartbeat().
+        """
+        completed = {key: value for key, value in document.items() if not key.startswith("_")}
+        completed["status"] = STATUS_COMPLETED
+        completed.pop("lease_expires_at", None)
+        completed["updated_at"] = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            if not self._completions:
+                self._oldest_completion = time.time()
+                self._flush_timer = threading.Timer(self.lease_seconds / 3, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+            self._completions.append((completed, document["_etag"]))
+            should_flush = len(self._completions) >= self.completion_batch_size
+        if should_flush:
+            self.flush()
+
+    def flush_due(self) -> int:
+        """Flush buffered completions before their leases run out and other workers re-claim them."""
+        with self._lock:
+            due = self._completions and time.time() - self._oldest_completion >= self.lease_seconds / 3
+        return self.flush() if due else 0
+
+    def flush(self) -> int:
+        """
+        Write buffered completions in batches.
+
+        Returns:
+            int: Number of documents written; completions of lost leases are not counted.
+        """
+        with self._lock:
+            completions, self._completions = self._completions, []
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        if not completions:
+            return 0
+        return self.store.batch_replace_documents(completions)
+
+    def run(self, handler: Callable[[Dict[str, Any]], Any], stop_event: Optional[threading.Event] = None,
+            poll_interval: float = 1.0, heartbeat_interval: Optional[float] = None) -> None:
+        """
+        Claim and process documents until stop_event is set.
+
+        The handler runs in the calling thread while a background thread renews the lease.
+        Several workers (threads, processes or hosts) may run this against the same container.
+
+        Parameters:
+            handler (Callable): Called with each claimed document, e.g.
+                ``lambda document: runner.run([document])`` for an ArxivPipelineRunner.
+            stop_event (Optional[threading.Event]): Stops the loop when set.
+            poll_interval (float): Seconds to wait for changes when nothing is claimable.
+            heartbeat_interval (Optional[float]): Seconds between lease renewals; defaults to a
+                third of the lease.
+        """
+        stop_event = stop_event or threading.Event()
+        heartbeat_interval = heartbeat_interval or self.lease_seconds / 3
+        try:
+            while not stop_event.is_set():
+                self.poll()
+                document = self.claim()
+                if document is None:
+                    self.flush()
+                    stop_event.wait(poll_interval)
+                    continue
+
+                current = {"document": document}
+                done = threading.Event()
+
+                def renew():
+                    while not done.wait(heartbeat_interval):
+                        self.flush_due()
+                        renewed = self.heartbeat(current["document"])
+                        if renewed is None:
+                            print(f"Lost lease on query {document['id']}")
+                            return
+                        current["document"] = renewed
+
+                heartbeat_thread = threading.Thread(target=renew, daemon=True)
+                heartbeat_thread.start()
+                try:
+                    handler(document)
+                except Exception as e:
+                    print(f"Error processing query {document['id']}: {e}")
+                    done.set()
+                    heartbeat_thread.join()
+                    self.release(current["document"], str(e))
+                    continue
+                done.set()
+                heartbeat_thread.join()
+                self.complete(current["document"])
+        finally:
+            self.flush()
@@ -0,0 +1,355 @@
+import bisect
+import csv
+import glob
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from arxiv_search import QUERY_STOPWORDS, _normalize_term, paper_key
+
+# Text fields of a paper record and their weight in the term frequency (title matches count most)
+FIELD_WEIGHTS = {"title": 3, "tldr": 2, "summary": 1, "authors": 1, "s2FieldsOfStudy": 1, "field": 1}
+TAG_WEIGHT = 2
+TEXT_WEIGHT = 1
+
+# Fields returned with each search hit; references and citations are left out to keep responses small
+RESULT_FIELDS = ["entry_id", "title", "authors", "published", "summary", "pdf_url", "citationCount",
+                 "s2FieldsOfStudy", "tldr", "field"]
+
+NO_DATE = 0
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lower-case, plural-folded terms, using the same rules as arxiv_search.query_terms."""
+    return [_normalize_term(t) for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in QUERY_STOPWORDS]
+
+
+def date_number(value: Any, end: bool = False) -> int:
+    """
+    Convert a date to a sortable YYYYMMDD integer.
+
+    Parameters:
+        value (Any): A date/datetime, or a string starting with YYYY-MM-DD, YYYYMMDD, YYYY-MM or YYYYMM.
+        end (bool): Round a month-only value up to the end of the month (for upper bounds).
+
+    Returns:
+        int: The date number, or 0 when the value is empty or not a date.
+    """
+    if isinstance(value, (datetime, date)):
+        return value.year * 10000 + value.month * 100 + value.day
+    digits = re.sub(r"\D", "", str(value or ""))[:8]
+    if len(digits) == 8:
+        return int(digits)
+    if len(digits) == 6:
+        return int(digits) * 100 + (31 if end else 1)
+    return NO_DATE
+
+
+def _encode_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_postings(data: bytearray):
+    """Yield (doc id, weighted term frequency) pairs of a delta + varint encoded posting list."""
+    doc_id = 0
+    value = shift = 0
+    delta = None
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        if delta is None:
+            delta = value
+        else:
+            doc_id += delta
+            yield doc_id, value
+            delta = None
+        value = shift = 0
+
+
+class PaperSearchIndex:
+    def __init__(self, k1: float = 1.2, b: float = 0.75, compact_ratio: float = 0.25):
+        """
+        In-memory BM25 search engine over harvested paper records.
+
+        Each term's posting list is a bytearray of (doc id delta, term frequency) varints.
+        Documents only ever get larger ids, so new papers are appended to the lists in place;
+        a paper that is indexed again gets a new id and its old one is dropped from results
+        until the next compaction. A list of (published, doc id) kept sorted with bisect
+        answers date range filters.
+
+        Parameters:
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+            compact_ratio (float): Fraction of superseded documents that triggers a rebuild.
+        """
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self._postings = {}  # term -> [encoded postings, last doc id, document frequency]
+        self._records = []  # doc id -> result fields, or None once superseded
+        self._texts = []  # doc id -> term counts of extra (PDF) text, or None
+        self._lengths = array('I')
+        self._dates = array('I')  # doc id -> published date number
+        self._date_index = []  # sorted (published date number, doc id)
+        self._doc_ids = {}  # paper key -> current doc id
+        self._total_length = 0
+        self._deleted = 0
+        self._file_mtimes = {}
+        self._last_refresh = 0.0
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def _term_counts(self, paper: Dict[str, Any], text_counts: Optional[Counter]) -> Counter:
+        counts = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            value = paper.get(field)
+            if value:
+                for term in tokenize(str(value)):
+                    counts[term] += weight
+        for field, value in paper.items():
+            if field.startswith("Tag_") and value:
+                for term in tokenize(str(value)):
+                    counts[term] += TAG_WEIGHT
+        if text_counts:
+            for term, count in text_counts.items():
+                counts[term] += count * TEXT_WEIGHT
+        return counts
+
+    def _add(self, key: str, paper: Dict[str, Any], text_counts: Optional[Counter]):
+        previous = self._doc_ids.get(key)
+        if previous is not None:
+            if text_counts is None:
+                text_counts = self._texts[previous]  # keep the PDF text of the earlier version
+            self._records[previous] = None
+            self._texts[previous] = None
+            self._total_length -= self._lengths[previous]
+            self._deleted += 1
+
+        doc_id = len(self._records)
+        counts = self._term_counts(paper, text_counts)
+        for term, count in counts.items():
+            entry = self._postings.get(term)
+            if entry is None:
+                entry = self._postings[term] = [bytearray(), 0, 0]
+            _encode_varint(doc_id - entry[1], entry[0])
+            _encode_varint(count, entry[0])
+            entry[1] = doc_id
+            entry[2] += 1
+
+        record = {field: paper.get(field, "") for field in RESULT_FIELDS}
+        record["published"] = str(record["published"] or "")
+        record["tags"] = [value for field, value in paper.items() if field.startswith("Tag_") and value]
+        self._records.append(record)
+        self._texts.append(text_counts)
+        length = sum(counts.values())
+        self._lengths.append(length)
+        self._total_length += length
+        published = date_number(paper.get("published"))
+        self._dates.append(published)
+        self._doc_ids[key] = doc_id
+        return published, doc_id
+
+    def add_papers(self, papers: Iterable[Dict[str, Any]], texts: Optional[Dict[str, str]] = None) -> int:
+        """
+        Index paper records, replacing earlier versions of the same papers.
+
+        Parameters:
+            papers (Iterable[Dict[str, Any]]): Records as produced by the pipeline stages or read
+                back from its CSV output (entry_id is required).
+            texts (Optional[Dict[str, str]]): Extracted PDF text by paper key, indexed with the record.
+
+        Returns:
+            int: Number of papers indexed.
+        """
+        texts = texts or {}
+        dated = []
+        with self._lock:
+            for paper in papers:
+                if not paper.get("entry_id"):
+                    continue
+                key = paper_key(paper["entry_id"])
+                text = texts.get(key)
+                dated.append(self._add(key, paper, Counter(tokenize(text)) if text else None))
+            if len(dated) > 32:
+                # Sorting merges the appended run in one pass, cheaper than many inserts
+                self._date_index.extend(dated)
+                self._date_index.sort()
+            else:
+                for item in dated:
+                    bisect.insort(self._date_index, item)
+            if self._deleted > self.compact_ratio * max(1, len(self._records)):
+                self._compact()
+        return len(dated)
+
+    def _compact(self) -> None:
+        live = [(key, self._records[doc_id], self._texts[doc_id], self._dates[doc_id], self._lengths[doc_id])
+                for key, doc_id in sorted(self._doc_ids.items(), key=lambda item: item[1])]
+        new_ids = {self._doc_ids[key]: new_id for new_id, (key, _, _, _, _) in enumerate(live)}
+        rebuilt = {}
+        for term, (data, _, _) in self._postings.items():
+            entry = None
+            for doc_id, count in _decode_postings(data):
+                new_id = new_ids.get(doc_id)
+                if new_id is None:
+                    continue
+                if entry is None:
+                    entry = rebuilt[term] = [bytearray(), 0, 0]
+                _encode_varint(new_id - entry[1], entry[0])
+                _encode_varint(count, entry[0])
+                entry[1] = new_id
+                entry[2] += 1
+        self._postings = rebuilt
+        self._records = [record for _, record, _, _, _ in live]
+        self._texts = [text for _, _, text, _, _ in live]
+        self._dates = array('I', (published for _, _, _, published, _ in live))
+        self._lengths = array('I', (length for _, _, _, _, length in live))
+        self._date_index = sorted((published, doc_id) for doc_id, published in enumerate(self._dates))
+        self._doc_ids = {key: doc_id for doc_id, (key, _, _, _, _) in enumerate(live)}
+        self._deleted = 0
+
+    def _date_slice(self, date_from: Optional[str], date_to: Optional[str]):
+        if not date_from and not date_to:
+            return 0, len(self._date_index)
+        # Papers without a published date never match a date filter
+        low = max(1, date_number(date_from))
+        # A bound that is not a date is ignored rather than matching nothing
+        high = date_number(date_to, end=True) or 99991231
+        start = bisect.bisect_left(self._date_index, (low, -1))
+        end = bisect.bisect_right(self._date_index, (high, len(self._records)))
+        return start, end
+
+    def search(self, query: str, k: int = 10, date_from: Optional[str] = None,
+               date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Return the top k papers for a query by BM25, optionally limited to a published date range.
+
+        Parameters:
+            query (str): Free-text query; an empty query lists the newest papers in the range.
+            k (int): Number of results.
+            date_from (Optional[str]): Earliest published date (YYYY-MM-DD or YYYYMM), inclusive.
+            date_to (Optional[str]): Latest published date (YYYY-MM-DD or YYYYMM), inclusive.
+
+        Returns:
+            List[Dict[str, Any]]: Paper records with a 'score', best first.
+        """
+        terms = list(dict.fromkeys(tokenize(query or "")))
+        with self._lock:
+            start, end = self._date_slice(date_from, date_to)
+            records = self._records
+            if not terms:
+                hits = []
+                for i in range(end - 1, start - 1, -1):
+                    doc_id = self._date_index[i][1]
+                    if records[doc_id] is not None:
+                        hits.append((0.0, doc_id))
+                        if len(hits) == k:
+                            break
+            else:
+                entries = [self._postings[term] for term in terms if term in self._postings]
+                allowed = None
+                if date_from or date_to:
+                    # Narrow ranges are cheaper to test as a set than per posting by date
+                    if end - start < sum(entry[2] for entry in entries):
+                        allowed = {doc_id for _, doc_id in self._date_index[start:end]}
+                    else:
+                        low = self._date_index[start][0] if start < end else 1
+                        high = self._date_index[end - 1][0] if start < end else 0
+
+                num_docs = max(1, len(self._doc_ids))
+                average_length = self._total_length / num_docs or 1.0
+                lengths = self._lengths
+                dates = self._dates
+                scores = {}
+                for data, _, document_frequency in entries:
+                    idf = math.log(1 + (num_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+                    for doc_id, tf in _decode_postings(data):
+                        if records[doc_id] is None:
+                            continue
+                        if allowed is not None:
+                            if doc_id not in allowed:
+                                continue
+                        elif (date_from or date_to) and not low <= dates[doc_id] <= high:
+                            continue
+                        norm = self.k1 * (1 - self.b + self.b * lengths[doc_id] / average_length)
+                        scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                hits = heapq.nlargest(k, ((score, doc_id) for doc_id, score in scores.items()))
+            return [dict(records[doc_id], score=round(score, 4)) for score, doc_id in hits]
+
+    def load_csv(self, path: str) -> int:
+        """Index the papers of one pipeline output CSV file."""
+        with open(path, newline='', encoding='utf-8') as file:
+            return self.add_papers(csv.DictReader(file))
+
+    def refresh(self, output_dir: str, min_interval: float = 0.0) -> int:
+        """
+        Index pipeline output files ('_<query_id>.csv') that are new or changed since the last call.
+
+        Parameters:
+            output_dir (str): The ArxivPipelineRunner output directory.
+            min_interval (float): Skip the directory scan if the last one was more recent than this.
+
+        Returns:
+            int: Number of papers indexed.
+        """
+        count = 0
+        with self._refresh_lock:
+            now = time.monotonic()
+            if self._last_refresh and now - self._last_refresh < min_interval:
+                return 0
+            self._last_refresh = now
+            for path in glob.glob(os.path.join(output_dir, "_*.csv")):
+                try:
+                    mtime = os.path.getmtime(path)
+                    if self._file_mtimes.get(path) == mtime:
+                        continue
+                    count += self.load_csv(path)
+                    self._file_mtimes[path] = mtime
+                except (OSError, csv.Error) as e:
+                    print(f"Error indexing {path}: {e}")
+        return count
+
+    def start_refresh(self, output_dir: str, interval: float = 5.0,
+                      stop_event: Optional[threading.Event] = None) -> threading.Thread:
+        """
+        Refresh from the pipeline output directory every interval seconds in a daemon thread,
+        so searches never wait on a directory scan. Calling it again returns the running thread.
+
+        Parameters:
+            output_dir (str): The ArxivPipelineRunner output directory.
+            interval (float): Seconds between directory scans.
+            stop_event (Optional[threading.Event]): Set to stop the thread.
+
+        Returns:
+            threading.Thread: The refresh thread.
+        """
+        stop_event = stop_event or threading.Event()
+
+        def run():
+            while not stop_event.is_set():
+                try:
+                    self.refresh(output_dir)
+                except Exception as e:
+                    print(f"Error refreshing search index from {output_dir}: {e}")
+                stop_event.wait(interval)
+
+        with self._refresh_lock:
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(target=run, name="search-index-refresh", daemon=True)
+                self._refresh_thread.start()
+            return self._refresh_thread
@@ -0,0 +1,457 @@
+import copy
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class ServiceProfile:
+    def __init__(self, latency_ms=50.0, jitter_ms=10.0, failure_rate=0.0, failure_status=503, seed=None):
+        """
+        Latency and failure behaviour of a stand-in service.
+
+        Parameters:
+        - latency_ms (float): Mean added latency per request.
+        - jitter_ms (float): Uniform jitter added around the mean.
+        - failure_rate (float): Fraction of requests answered with failure_status.
+        - failure_status (int): HTTP status of failed requests (e.g. 429 or 503).
+        - seed (int): Seed of the random generator, for repeatable runs.
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000.0)
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def _words(text):
+    return [word for word in re.findall(r"[A-Za-z]+", text) if word.upper() not in ("AND", "OR", "ANDNOT")]
+
+
+def _stable_int(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "big")
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "RRStub/1.0"
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        parsed = urlparse(self.path)
+        body = self._body() if method == "POST" else b""
+        self.server.profile.delay()
+        self.server.request_count += 1
+        if self.server.profile.should_fail():
+            self._send(self.server.profile.failure_status, {"error": "injected failure"})
+            return
+        status, payload, content_type = self.server.respond(method, parsed.path, parse_qs(parsed.query), body)
+        self._send(status, payload, content_type)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class StubService:
+    """Base class of a local HTTP stand-in; subclasses implement respond()."""
+
+    name = "stub"
+
+    def __init__(self, profile=None, host="127.0.0.1", port=0):
+        self.profile = profile or ServiceProfile()
+        self.server = ThreadingHTTPServer((host, port), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.profile = self.profile
+        self.server.respond = self.respond
+        self.server.request_count = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self):
+        return self.server.request_count
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name=f"{self.name}-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, method, path, query, body):
+        raise NotImplementedError
+
+
+class WebStub(StubService):
+    """Pages and robots.txt of the sites returned by the Bing stand-in."""
+
+    name = "web"
+
+    def __init__(self, profile=None, words_per_page=800, **kwargs):
+        super().__init__(profile, **kwargs)
+        self.words_per_page = words_per_page
+
+    def respond(self, method, path, query, body):
+        if path == "/robots.txt":
+            return 200, "User-agent: *\nAllow: /\n", "text/plain"
+        rng = random.Random(_stable_int(path))
+        vocabulary = ["learning", "robot", "navigation", "graph", "neural", "policy", "reinforcement",
+                      "transformer", "thesis", "control", "vision", "language", "model", "benchmark"]
+        text = " ".join(rng.choice(vocabulary) for _ in range(self.words_per_page))
+        html = f"<html><head><title>{escape(path)}</title><script>var x=1;</script></head><body><p>{text}</p></body></html>"
+        return 200, html, "text/html"
+
+
+class BingStub(StubService):
+    name = "bing"
+
+    def __init__(self, profile=None, web_url="", results_per_query=5, related_per_query=2, **kwargs):
+        super().__init__(profile, **kwargs)
+        self.web_url = web_url
+        self.results_per_query = results_per_query
+        self.related_per_query = related_per_query
+
+    def respond(self, method, path, query, body):
+        q = query.get("q", [""])[0]
+        seed = _stable_int(q)
+        pages = [{
+            "name": f"{q} result {i}",
+            "url": f"{self.web_url}/page/{seed}/{i}",
+            "snippet": f"Snippet about {q}",
+            "displayUrl": f"{self.web_url}/page/{seed}/{i}",
+            "dateLastCrawled": "2024-01-01T00:00:00.0000000Z",
+        } for i in range(self.results_per_query)]
+        related = [{"text": f"{q} related {i}", "displayText": f"{q} related {i}"} for i in range(self.related_per_query)]
+        return 200, {"webPages": {"value": pages}, "relatedSearches": {"value": related}}, "application/json"
+
+
+class ArxivStub(StubService):
+    """Atom feed responses in the shape of export.arxiv.org/api/query."""
+
+    name = "arxiv"
+
+    def __init__(self, profile=None, total_results=1000, **kwargs):
+        super().__init__(profile, **kwargs)
+        self.total_results = total_results
+
+    def respond(self, method, path, query, body):
+        search_query = query.get("search_query", [""])[0]
+        start = int(query.get("start", ["0"])[0])
+        count = min(int(query.get("max_results", ["10"])[0]), max(0, self.total_results - start))
+        words = " ".join(_words(re.sub(r"submittedDate:\[[^\]]*\]", "", search_query)))
+        seed = _stable_int(search_query) % 90000
+        entries = []
+        for i in range(start, start + count):
+            arxiv_id = f"24{(seed + i) % 100:02d}.{(seed * 7 + i) % 100000:05d}"
+            entries.append(f"""  <entry>
+    <id>http://arxiv.org/abs/{arxiv_id}v1</id>
+    <updated>2024-01-02T00:00:00Z</updated>
+    <published>2024-01-01T00:00:00Z</published>
+    <title>Paper {i} on {escape(words)}</title>
+    <summary>We study {escape(words)} with a stand-in abstract for benchmarking.</summary>
+    <author><name>Author {i}</name></author>
+    <author><name>Coauthor {seed % 50}</name></author>
+    <link href="http://arxiv.org/abs/{arxiv_id}v1" rel="alternate" type="text/html"/>
+    <link title="pdf" href="http://arxiv.org/pdf/{arxiv_id}v1" rel="related" type="application/pdf"/>
+    <arxiv:primary_category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+    <category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+  </entry>""")
+        feed = f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/"
+      xmlns:arxiv="http://arxiv.org/schemas/atom">
+  <title type="html">ArXiv Query: {escape(search_query)}</title>
+  <id>http://arxiv.org/api/{seed}</id>
+  <updated>2024-01-02T00:00:00-05:00</updated>
+  <opensearch:totalResults>{self.total_results}</opensearch:totalResults>
+  <opensearch:startIndex>{start}</opensearch:startIndex>
+  <opensearch:itemsPerPage>{count}</opensearch:itemsPerPage>
+{chr(10).join(entries)}
+</feed>
+"""
+        return 200, feed, "application/atom+xml"
+
+
+class SemanticScholarStub(StubService):
+    name = "semantic_scholar"
+
+    def respond(self, method, path, query, body):
+        if path.endswith("/paper/batch"):
+            ids = json.loads(body or b"{}").get("ids", [])
+            return 200, [{
+                "paperId": paper_id,
+                "referenceCount": 12,
+                "citationCount": _stable_int(paper_id) % 100,
+                "references": [{"paperId": "r1", "title": "A referenced paper"}],
+                "citations": [{"paperId": "c1", "title": "A citing paper"}],
+                "s2FieldsOfStudy": [{"category": "Computer Science", "source": "s2-fos-model"}],
+                "tldr": {"model": "tldr@v2.0.0", "text": "A short summary."},
+            } for paper_id in ids], "application/json"
+        return 200, {"recommendedPapers": []}, "application/json"
+
+
+class OpenAIStub(StubService):
+    """Chat completions endpoint; the reply is a numbered list so every caller can parse it."""
+
+    name = "openai"
+
+    def respond(self, method, path, query, body):
+        request = json.loads(body or b"{}")
+        prompt = " ".join(str(message.get("content", "")) for message in request.get("messages", []))
+        lines = "\n".join(f"{i}. Stand-in topic {_stable_int(prompt + str(i)) % 20}" for i in range(1, 11))
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model") or "stub",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": lines},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(lines) // 4,
+                "total_tokens": (len(prompt) + len(lines)) // 4,
+            },
+        }, "application/json"
+
+
+class AzureSearchStub(StubService):
+    name = "azure_search"
+
+    def respond(self, method, path, query, body):
+        request = json.loads(body or b"{}")
+        top = int(request.get("top") or 5)
+        return 200, {"value": [{
+            "@search.score": 1.0 / (i + 1),
+            "title": f"Indexed paper {i}",
+            "authors": "Author",
+            "tldr": "A short summary.",
+            "referenceCount": 10,
+            "citationCount": 3,
+            "pdf_url": f"http://arxiv.org/pdf/2401.{i:05d}v1",
+            "summary": "An indexed abstract.",
+            "Tag_1": "Machine learning", "Tag_2": "Robotics", "Tag_3": "Navigation",
+            "Tag_4": "Reinforcement learning", "Tag_5": "Control",
+            "field": "Machine learning",
+        } for i in range(top)]}, "application/json"
+
+
+class _LocalResponseHeaders:
+    def __init__(self):
+        self.last_response_headers = {}
+
+
+class LocalCosmosContainer:
+    def __init__(self, container_id, partition_key, profile):
+        """
+        In-process stand-in of an azure.cosmos ContainerProxy.
+
+        The Cosmos DB SDK speaks a signed REST protocol that is not practical to serve
+        locally, so the container is replaced in process; it still applies the latency and
+        failure profile and reports a request charge for every operation (and every page of
+        a query) to the caller's response_hook.
+        """
+        self.id = container_id
+        self.partition_key = partition_key
+        self.profile = profile
+        self.client_connection = _LocalResponseHeaders()
+        self._items = {}
+        self._changes = []
+        self._lock = threading.Lock()
+
+    def _call(self):
+        from azure.cosmos import exceptions
+
+        self.profile.delay()
+        if self.profile.should_fail():
+            raise exceptions.CosmosHttpResponseError(status_code=self.profile.failure_status,
+                                                     message="injected failure")
+
+    def _respond(self, kwargs, request_charge, result, **headers):
+        headers["x-ms-request-charge"] = str(request_charge)
+        self.client_connection.last_response_headers = headers
+        if kwargs.get("response_hook") is not None:
+            kwargs["response_hook"](headers, result)
+        return result
+
+    def _pages(self, items, kwargs, request_charge_per_item):
+        # Queries are paged like the SDK's iterators: one charged request per page
+        page_size = kwargs.get("max_item_count") or 100
+        for start in range(0, max(1, len(items)), page_size):
+            self._call()
+            page = items[start:start + page_size]
+            self._respond(kwargs, 2.5 + request_charge_per_item * len(page), page)
+            yield from page
+
+    def _store(self, body):
+        item = copy.deepcopy(body)
+        item.setdefault("id", uuid.uuid4().hex)
+        item["_etag"] = uuid.uuid4().hex
+        item["_ts"] = int(time.time())
+        self._items[item["id"]] = item
+        self._changes.append(item["id"])
+        return copy.deepcopy(item)
+
+    def create_item(self, body, **kwargs):
+        from azure.cosmos import exceptions
+
+        self._call()
+        with self._lock:
+            if body.get("id") in self._items:
+                raise exceptions.CosmosResourceExistsError(status_code=409, message="Conflict")
+            return self._respond(kwargs, 6.0, self._store(body))
+
+    def upsert_item(self, body, **kwargs):
+        self._call()
+        with self._lock:
+            return self._respond(kwargs, 10.0, self._store(body))
+
+    def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        from azure.cosmos import exceptions
+
+        self._call()
+        with self._lock:
+            current = self._items.get(item)
+            if current is None:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="Not found")
+            if etag is not None and current["_etag"] != etag:
+                raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="Precondition failed")
+            return self._respond(kwargs, 10.0, self._store(body))
+
+    def read_item(self, item, partition_key, **kwargs):
+        from azure.cosmos import exceptions
+
+        self._call()
+        with self._lock:
+            if item not in self._items:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="Not found")
+            return self._respond(kwargs, 1.0, copy.deepcopy(self._items[item]))
+
+    def query_items(self, query, parameters=None, enable_cross_partition_query=False, **kwargs):
+        # Supports the equality filters used by app.py: SELECT * FROM c WHERE c.a = 'x' AND c.b = @b
+        values = {parameter["name"]: str(parameter["value"]) for parameter in parameters or ()}
+        filters = [(field, values[name] if name else value)
+                   for field, value, name in re.findall(r"c\.(\w+)\s*=\s*(?:'([^']*)'|(@\w+))", query)]
+        with self._lock:
+            items = [copy.deepcopy(item) for item in self._items.values()
+                     if all(str(item.get(field)) == value for field, value in filters)]
+        return self._pages(items, kwargs, 0.1)
+
+    def read_all_items(self, **kwargs):
+        with self._lock:
+            items = [copy.deepcopy(item) for item in self._items.values()]
+        return self._pages(items, kwargs, 0.1)
+
+    def delete_item(self, item, partition_key, **kwargs):
+        from azure.cosmos import exceptions
+
+        self._call()
+        with self._lock:
+            if self._items.pop(item, None) is None:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="Not found")
+        self._respond(kwargs, 6.0, None)
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        from azure.cosmos import exceptions
+
+        self._call()
+        with self._lock:
+            # Supports upsert and (optionally etag-conditional) replace; all or nothing like Cosmos DB
+            for index, (operation, args, *options) in enumerate(batch_operations):
+                if operation != "replace":
+                    continue
+                current = self._items.get(args[0])
+                etag = options[0].get("if_match_etag") if options else None
+                if current is None or (etag is not None and current["_etag"] != etag):
+                    raise exceptions.CosmosBatchOperationError(
+                        error_index=index, headers={}, status_code=404 if current is None else 412,
+                        message="Batch operation failed", operation_responses=[])
+            return self._respond(kwargs, 10.0 * len(batch_operations),
+                                 [self._store(args[-1]) for operation, args, *options in batch_operations])
+
+    def query_items_change_feed(self, is_start_from_beginning=False, continuation=None, **kwargs):
+        with self._lock:
+            if continuation is None:
+                position = 0 if is_start_from_beginning else len(self._changes)
+            else:
+                position = int(continuation)
+            changed_ids = list(dict.fromkeys(self._changes[position:]))
+            items = [copy.deepcopy(self._items[i]) for i in changed_ids if i in self._items]
+            token = str(len(self._changes))
+        self._call()
+        self._respond(kwargs, 1.0 + len(items), items, etag=token)
+        return iter(items)
+
+
+class LocalCosmosDatabase:
+    def __init__(self, database_id, profile):
+        self.id = database_id
+        self.profile = profile
+        self.containers = {}
+
+    def create_container_if_not_exists(self, id, partition_key=None, **kwargs):
+        if id not in self.containers:
+            self.containers[id] = LocalCosmosContainer(id, partition_key, self.profile)
+        return self.containers[id]
+
+
+class LocalCosmosClient:
+    """Drop-in for azure.cosmos.CosmosClient as used by CosmosDBClient."""
+
+    profile = ServiceProfile(latency_ms=8.0, jitter_ms=2.0)
+    databases = {}
+
+    def __init__(self, url, credential=None, **kwargs):
+        self.url = url
+
+    def create_database_if_not_exists(self, id, **kwargs):
+        if id not in LocalCosmosClient.databases:
+            LocalCosmosClient.databases[id] = LocalCosmosDatabase(id, LocalCosmosClient.profile)
+        return LocalCosmosClient.databases[id]
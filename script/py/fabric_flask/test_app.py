@@ -0,0 +1,113 @@
+import importlib
+
+import pytest
+
+import cosmos
+from search_index import PaperSearchIndex
+from stub_services import AzureSearchStub, LocalCosmosClient, OpenAIStub, ServiceProfile
+
+
+def _profile():
+    return ServiceProfile(latency_ms=0.0, jitter_ms=0.0)
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    services = [OpenAIStub(_profile()).start(), AzureSearchStub(_profile()).start()]
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(cosmos, "CosmosClient", LocalCosmosClient)
+        patch.setattr(LocalCosmosClient, "profile", _profile())
+        patch.setenv("PIPELINE_OUTPUT_DIR", str(tmp_path_factory.mktemp("pipeline_output")))
+        patch.setenv("OPENAI_API_KEY", "stub")
+        patch.setenv("OPENAI_BASE_URL", services[0].url + "/v1")
+        patch.setenv("AZURE_SEARCH_SERVICE", services[1].url)
+        module = importlib.import_module("app")
+    module.start_search_index()
+    module.PAPER_SEARCH_INDEX.add_papers([
+        {"entry_id": f"http://arxiv.org/abs/2401.{i:05d}v1", "title": f"Graph networks part {i}",
+         "published": "2024-01-15"} for i in range(150)])
+    yield module
+    for service in services:
+        service.stop()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def _search(client, **data):
+    return client.post("/power_search", json={"query": "graph networks", **data})
+
+
+@pytest.mark.parametrize("top", ["many", None, [5], 0, -3])
+def test_power_search_rejects_bad_top(client, top):
+    response = _search(client, top=top)
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+
+def test_power_search_clamps_top(client, app_module):
+    assert len(_search(client, top="7").get_json()["results"]) == 7
+    assert len(_search(client).get_json()["results"]) == 20
+    assert len(_search(client, top=10 ** 6).get_json()["results"]) == app_module.MAX_SEARCH_RESULTS
+
+
+@pytest.mark.parametrize("dates", [{"date_from": "soon"}, {"date_to": "last week"}])
+def test_power_search_rejects_bad_dates(client, dates):
+    response = _search(client, **dates)
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+
+def test_power_search_looks_up_sessions_by_parameter(client, app_module):
+    app_module.cosmos_client_query_metadata.create_document(
+        {"id": "session-1", "selected_topics": [["ml|Graph networks"]]})
+
+    def search(session_id):
+        return client.post("/power_search", json={"id": session_id, "top": 3})
+
+    assert len(search("session-1").get_json()["results"]) == 3
+    assert search("x' OR c.id != '").status_code == 404
+
+
+@pytest.mark.parametrize("refresh_seconds, threads", [(5.0, 1), (0.0, 0)])
+def test_search_index_loads_on_first_request(client, app_module, monkeypatch, refresh_seconds, threads):
+    calls = []
+    index = PaperSearchIndex()
+    monkeypatch.setattr(index, "refresh", lambda *args: calls.append("refresh"))
+    monkeypatch.setattr(index, "start_refresh", lambda *args, **kwargs: calls.append("start_refresh"))
+    monkeypatch.setattr(app_module, "PAPER_SEARCH_INDEX", index)
+    monkeypatch.setattr(app_module, "SEARCH_REFRESH_SECONDS", refresh_seconds)
+    monkeypatch.setattr(app_module, "_search_index_started", False)
+
+    client.get("/metrics")
+    client.get("/metrics")
+
+    assert calls == ["refresh"] + ["start_refresh"] * threads
+
+
+def test_power_search_does_not_scan_the_output_directory(client, app_module, monkeypatch):
+    def refresh(*args, **kwargs):
+        raise AssertionError("refresh called from the request handler")
+
+    monkeypatch.setattr(app_module.PAPER_SEARCH_INDEX, "refresh", refresh)
+    assert _search(client, top=3).status_code == 200
+
+
+def test_chat_uses_the_configured_openai_endpoint(client):
+    response = client.post("/chat", json={"query": "robot navigation", "showSources": False, "chatHistory": []})
+    assert response.status_code == 200
+    assert response.get_json()["response"].startswith("1. Stand-in topic")
+
+
+def test_chat_reuses_one_openai_client(app_module, client, monkeypatch):
+    clients = []
+    get_openai_client = app_module.get_openai_client
+    monkeypatch.setattr(app_module, "get_openai_client",
+                        lambda *args: clients.append(get_openai_client(*args)) or clients[-1])
+
+    for _ in range(2):
+        client.post("/chat", json={"query": "robot navigation", "showSources": False, "chatHistory": []})
+
+    assert len(clients) == 2 and clients[0] is clients[1]
@@ -0,0 +1,167 @@
+import pytest
+
+import arxiv_search
+import metrics
+from arxiv_search import ArxivResearchHelper
+from paper_batch import PaperBatch
+
+
+class _Response:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+        self.text = str(data)
+
+    def json(self):
+        return self._data
+
+
+class _SemanticScholar:
+    """Answers paper batch requests; the listed call numbers fail."""
+
+    def __init__(self, raise_on=(), error_on=()):
+        self.raise_on = raise_on
+        self.error_on = error_on
+        self.calls = 0
+
+    def post(self, url, json=None, **kwargs):
+        self.calls += 1
+        if self.calls in self.raise_on:
+            raise ConnectionError("connection reset")
+        if self.calls in self.error_on:
+            return _Response(429, {"message": "Too Many Requests"})
+        return _Response(200, [{"citationCount": 5, "referenceCount": 2, "tldr": {"text": "short"},
+                                "s2FieldsOfStudy": [{"category": "Computer Science"}]} for _ in json["ids"]])
+
+
+def _papers(count):
+    return [{"entry_id": f"http://arxiv.org/abs/2401.{i:05d}v1", "title": f"Paper {i}", "summary": ""}
+            for i in range(count)]
+
+
+@pytest.fixture
+def helper(tmp_path):
+    return ArxivResearchHelper(download_dir=str(tmp_path))
+
+
+@pytest.mark.parametrize("failure", [{"raise_on": (1,)}, {"error_on": (1,)}])
+def test_get_citation_data_keeps_papers_of_failed_chunks(helper, monkeypatch, failure):
+    client = _SemanticScholar(**failure)
+    monkeypatch.setattr(arxiv_search, "get_http_client", lambda: client)
+
+    papers = helper.get_citation_data(_papers(250))
+
+    assert client.calls == 3
+    assert [paper["title"] for paper in papers] == [f"Paper {i}" for i in range(250)]
+    assert not any("citationCount" in paper for paper in papers[:100])
+    assert all(paper["citationCount"] == 5 for paper in papers[100:])
+    assert papers[100]["s2FieldsOfStudy"] == "Computer Science|"
+
+
+def test_get_citation_data_enriches_batch_in_place(helper, monkeypatch):
+    client = _SemanticScholar(raise_on=(2,))
+    monkeypatch.setattr(arxiv_search, "get_http_client", lambda: client)
+    batch = PaperBatch.from_papers(_papers(150))
+
+    assert helper.get_citation_data(batch) is batch
+    assert len(batch) == 150
+    assert batch[0]["citationCount"] == 5
+    assert "citationCount" not in batch[149]
+
+
+def test_paper_key_drops_version():
+    assert arxiv_search.paper_key("http://arxiv.org/abs/2401.01234v2") == "2401.01234"
+    assert arxiv_search.paper_key("hep-th/9901001v1") == "hep-th/9901001"
+
+
+class _Arxiv:
+    """Answers searches from a fixed corpus, newest first, like arXiv sorted by submitted date."""
+
+    def __init__(self, titles):
+        # Later titles are newer
+        self.corpus = [{"entry_id": f"http://arxiv.org/abs/2401.{i:05d}v1", "title": title, "summary": "",
+                        "published": i} for i, title in enumerate(titles)]
+        self.queries = []
+
+    def search_papers(self, query, max_results=50, date_from=None, date_to=None, as_batch=False):
+        self.queries.append(query)
+        clauses = [clause.strip("()") for clause in query.split(" OR ")]
+        hits = [paper for paper in reversed(self.corpus)
+                if any(set(clause.lower().split()) <= set(paper["title"].lower().split()) for clause in clauses)]
+        return [dict(paper) for paper in hits[:max_results]]
+
+
+def test_search_papers_batch_tops_up_queries_crowded_out_by_a_broad_one(helper, monkeypatch):
+    arxiv = _Arxiv(["quantum error correction", "protein folding"] + [f"graph neural network {i}" for i in range(10)])
+    monkeypatch.setattr(helper, "search_papers", arxiv.search_papers)
+    queries = ["graph neural network", "quantum error correction", "protein folding"]
+
+    results = helper.search_papers_batch(queries, max_results=1, batch_size=8)
+
+    assert [len(results[query]) for query in queries] == [1, 1, 1]
+    assert results["quantum error correction"][0]["title"] == "quantum error correction"
+    assert results["protein folding"][0]["title"] == "protein folding"
+    assert arxiv.queries[1:] == ["(quantum error correction) OR (protein folding)"]
+
+
+def test_search_papers_batch_pages_deeper_before_searching_queries_alone(helper, monkeypatch):
+    topics = [f"topic{i} method" for i in range(7)]
+    arxiv = _Arxiv(topics + [f"graph neural network {i}" for i in range(50)])
+    monkeypatch.setattr(helper, "search_papers", arxiv.search_papers)
+
+    results = helper.search_papers_batch(["graph neural network"] + topics, max_results=1)
+
+    assert len(arxiv.queries) == 2
+    assert all([paper["title"] for paper in results[topic]] == [topic] for topic in topics)
+
+
+def test_search_papers_batch_caps_separate_searches(helper, monkeypatch):
+    topics = [f"topic{i} method" for i in range(7)]
+    arxiv = _Arxiv(topics + [f"graph neural network {i}" for i in range(50)])
+    monkeypatch.setattr(helper, "search_papers", arxiv.search_papers)
+
+    results = helper.search_papers_batch(["graph neural network"] + topics, max_results=1, search_rounds=1,
+                                         max_fallbacks=2)
+
+    assert arxiv.queries[1:] == topics[:2]
+    assert [len(results[topic]) for topic in topics] == [1, 1, 0, 0, 0, 0, 0]
+
+
+def test_search_papers_batch_matches_most_query_terms(helper, monkeypatch):
+    arxiv = _Arxiv(["protein folding", "message passing networks on graphs"])
+    calls = []
+
+    def search_papers(query, max_results, *args):
+        calls.append(query)
+        return [dict(paper) for paper in reversed(arxiv.corpus)]
+
+    monkeypatch.setattr(helper, "search_papers", search_papers)
+    results = helper.search_papers_batch(["graph neural network", "protein folding"], max_results=1)
+
+    # Two of the three terms of "graph neural network" are enough
+    assert len(calls) == 1
+    assert [paper["title"] for paper in results["graph neural network"]] == ["message passing networks on graphs"]
+    assert [paper["title"] for paper in results["protein folding"]] == ["protein folding"]
+
+
+def _errors(operation):
+    return metrics.EXTERNAL_CALL_ERRORS._values.get(("semantic_scholar" if operation == "paper_batch" else "arxiv",
+                                                     operation), 0.0)
+
+
+def test_error_responses_count_as_failed_calls(helper, monkeypatch):
+    client = _SemanticScholar(error_on=(1,))
+    monkeypatch.setattr(arxiv_search, "get_http_client", lambda: client)
+    before = _errors("paper_batch")
+    helper.get_citation_data(_papers(150))
+    assert _errors("paper_batch") == before + 1
+
+
+def test_download_pdf_failure_counts_as_failed_call(helper, monkeypatch):
+    def results(search):
+        raise ConnectionError("arXiv unreachable")
+
+    monkeypatch.setattr(helper.client, "results", results)
+    before = _errors("download_pdf")
+    assert helper.download_pdf("2401.00001") is None
+    assert _errors("download_pdf") == before + 1
@@ -0,0 +1,68 @@
+import threading
+import tracemalloc
+
+import pytest
+
+from benchmark import compare_results, failed_scenarios, percentile, run_scenario
+
+
+@pytest.mark.parametrize("count, fraction, rank", [
+    (50, 0.50, 25),
+    (100, 0.50, 50),
+    (100, 0.95, 95),
+    (100, 0.99, 99),
+    (20, 0.95, 19),
+    (1, 0.99, 1),
+    (3, 0.0, 1),
+    (3, 1.0, 3),
+])
+def test_percentile_uses_nearest_rank(count, fraction, rank):
+    assert percentile(list(range(1, count + 1)), fraction) == rank
+
+
+def test_percentile_of_no_values():
+    assert percentile([], 0.5) == 0.0
+
+
+def test_memory_is_measured_outside_the_timed_pass(capsys):
+    tracing = []
+    lock = threading.Lock()
+
+    def operation(i):
+        with lock:
+            tracing.append(tracemalloc.is_tracing())
+        buffer = bytearray(1024 * 1024)
+        if i == 0:
+            raise ValueError("first call fails")
+        return buffer
+
+    result = run_scenario("memory", operation, requests=10, concurrency=2)
+
+    assert tracing == [False] * 10 + [True] * 10
+    assert result["peak_memory_mb"] >= 1.0
+    assert result["errors"] == 1
+    assert result["first_error"] == "ValueError: first call fails"
+
+
+def test_memory_pass_can_be_skipped(capsys):
+    calls = []
+    result = run_scenario("no memory", calls.append, requests=5, concurrency=1, trace_memory=False)
+    assert len(calls) == 5
+    assert result["peak_memory_mb"] == 0.0
+    assert result["errors"] == 0
+
+
+def test_scenario_with_errors_is_marked_and_fails_comparison(capsys):
+    def operation(i):
+        raise RuntimeError("Missing credentials")
+
+    failing = run_scenario("failing", operation, requests=4, concurrency=2, trace_memory=False)
+    passing = run_scenario("passing", lambda i: None, requests=4, concurrency=2, trace_memory=False)
+    results = {"failing": failing, "passing": passing}
+    baseline = {"results": {"failing": dict(passing), "passing": dict(passing)}}
+
+    assert failing["status"] == "errors" and failing["errors"] == 4
+    assert passing["status"] == "ok"
+    assert "ERRORS (RuntimeError: Missing credentials)" in capsys.readouterr().out
+    assert failed_scenarios(results) == ["failing"]
+    assert compare_results(results, baseline, max_regression=10.0) == ["failing"]
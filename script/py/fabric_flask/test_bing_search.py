@@ -0,0 +1,79 @@
+import re
+import threading
+
+from bing_search import ThesisTopicGenerator
+from metrics import get_trace_id, start_trace
+from page_dedup import SimHashIndex
+
+
+class _LLM:
+    """Answers top topic prompts with the first requested topics, echoing their source counts."""
+
+    def __init__(self):
+        self.calls = []
+        self.trace_ids = []
+        self.lock = threading.Lock()
+
+    def complete(self, messages, max_tokens, operation):
+        prompt = messages[1]["content"]
+        num_topics = int(re.search(r"top (\d+) most relevant", prompt).group(1))
+        topics = prompt.split("for your reference:\n", 1)[1].strip().splitlines()
+        with self.lock:
+            self.calls.append((operation, len(topics)))
+            self.trace_ids.append(get_trace_id())
+        return "\n".join(f"{i}. {topic}" for i, topic in enumerate(topics[:num_topics], 1))
+
+
+def _generator(monkeypatch, topic_texts, num_new_tags=2):
+    generator = ThesisTopicGenerator("robots", num_new_tags=num_new_tags, page_index=SimHashIndex())
+    generator.all_results = [{"extracted_topics": text} for text in topic_texts]
+    llm = _LLM()
+    monkeypatch.setattr(generator, "_complete", llm.complete)
+    return generator, llm
+
+
+def test_map_reduce_reduces_every_chunk(monkeypatch):
+    # The most mentioned topic sorts into the first chunk, the one mentioned twice into the last
+    texts = ["1. Popular topic"] * 3 + ["1. Rare topic"] * 2 + [f"1. Filler topic number {i:03d}" for i in range(200)]
+    generator, llm = _generator(monkeypatch, texts)
+
+    top_topics = generator.generate_top_topics(max_prompt_tokens=100, reduce_workers=2)
+
+    chunk_calls = [count for operation, count in llm.calls if operation == "top_topics_chunk"]
+    assert sum(chunk_calls) >= 202
+    assert llm.calls[-1][0] == "top_topics"
+    assert llm.calls[-1][1] <= 100 // 11
+    assert top_topics == "1. Popular topic (mentioned by 3 sources)\n2. Rare topic (mentioned by 2 sources)"
+
+
+def test_map_reduce_final_prompt_stays_within_budget(monkeypatch):
+    # About 13 tokens per topic line: a 40 token chunk holds 3 topics, fewer than each chunk keeps
+    texts = ["1. Popular topic"] * 3 + [f"1. Filler topic number {i:03d}" for i in range(30)]
+    generator, llm = _generator(monkeypatch, texts, num_new_tags=5)
+
+    top_topics = generator.generate_top_topics(max_prompt_tokens=40)
+
+    assert llm.calls[-1] == ("top_topics", 3)
+    assert top_topics.startswith("1. Popular topic (mentioned by 3 sources)")
+
+
+def test_map_reduce_keeps_the_trace_id(monkeypatch):
+    texts = [f"1. Topic number {i:03d}" for i in range(100)]
+    generator, llm = _generator(monkeypatch, texts)
+    start_trace("req-topics")
+
+    generator.generate_top_topics(max_prompt_tokens=100)
+
+    assert set(llm.trace_ids) == {"req-topics"}
+
+
+def test_run_strips_echoed_counts_before_deduplicating(monkeypatch):
+    generator, _ = _generator(monkeypatch, [])
+    monkeypatch.setattr(generator, "recursive_search", lambda query, depth: None)
+    monkeypatch.setattr(generator, "generate_top_topics", lambda: (
+        "Here are the top topics:\n"
+        "1. Swarm robotics (mentioned by 3 sources)\n"
+        "2. **swarm robotics**\n"
+        "3. Robot navigation v2.0 (mentioned by 1 source)\n"))
+
+    assert generator.run() == ["Swarm robotics", "Robot navigation v2.0"]
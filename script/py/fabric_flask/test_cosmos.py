@@ -0,0 +1,58 @@
+import threading
+import uuid
+
+import pytest
+
+import cosmos
+from metrics import COSMOS_REQUEST_UNITS
+from stub_services import LocalCosmosClient, ServiceProfile
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(cosmos, "CosmosClient", LocalCosmosClient)
+    monkeypatch.setattr(LocalCosmosClient, "profile", ServiceProfile(latency_ms=0.0, jitter_ms=0.0))
+    return cosmos.CosmosDBClient(url="local", key="", database_name=f"test-{uuid.uuid4().hex}",
+                                 container_name=f"c-{uuid.uuid4().hex}", partition_key="partitionKey")
+
+
+def _units(client, operation):
+    return COSMOS_REQUEST_UNITS._values.get((client.container_name, operation), 0.0)
+
+
+def test_query_charge_adds_up_every_page(client):
+    for i in range(250):
+        client.container.upsert_item({"id": str(i), "kind": "paper", "partitionKey": "p"})
+
+    assert len(client.query_documents("SELECT * FROM c WHERE c.kind = 'paper'")) == 250
+    # Three pages of 100, 100 and 50 documents
+    assert _units(client, "query_items") == pytest.approx(3 * 2.5 + 250 * 0.1)
+
+
+def test_charges_of_concurrent_calls_are_not_mixed_up(client):
+    client.create_document({"id": "doc"})
+    barrier = threading.Barrier(8)
+
+    def call(i):
+        barrier.wait()
+        if i % 2:
+            client.read_document("doc", "default_partition")
+        else:
+            client.upsert_document({"id": f"other{i}"})
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _units(client, "read_item") == 4 * 1.0
+    assert _units(client, "upsert_item") == 4 * 10.0
+
+
+def test_change_feed_token_comes_from_its_own_response(client):
+    client.create_document({"id": "a"})
+    items, token = client.read_change_feed(start_from_beginning=True)
+    assert [item["id"] for item in items] == ["a"]
+    client.read_document("a", "default_partition")
+    assert client.read_change_feed(continuation=token) == ([], token)
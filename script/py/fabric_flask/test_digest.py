@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from digest import DigestBuilder
+from paper_index import PaperIndex
+
+
+def _papers(*numbers):
+    return [{"entry_id": f"http://arxiv.org/abs/2401.{n:05d}v1", "title": f"Paper {n}"} for n in numbers]
+
+
+@pytest.fixture
+def paper_index(tmp_path):
+    index = PaperIndex(str(tmp_path / "papers.sqlite"), expected_papers=1000)
+    index.add_papers(_papers(*range(1, 11)))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def builder(paper_index, tmp_path):
+    builder = DigestBuilder(paper_index, path=str(tmp_path / "digest.sqlite"), max_papers_per_query=2)
+    yield builder
+    builder.close()
+
+
+QUERIES = [{"id": "a", "user_id": "u", "priority": "HIGH"}, {"id": "b", "user_id": "u", "priority": "LOW"}]
+
+
+def _titles(digest):
+    return {query["id"]: [paper["title"] for paper in query["papers"]] for query in digest["queries"]}
+
+
+def _send(builder):
+    digests = builder.build(QUERIES)
+    for digest in digests.values():
+        builder.commit(digest)
+    return digests
+
+
+def test_shared_papers_are_sent_once_to_the_higher_priority_query(builder, paper_index):
+    paper_index.link_query("a", _papers(1, 2))
+    paper_index.link_query("b", _papers(2, 3))
+
+    digest = _send(builder)["u"]
+
+    assert _titles(digest) == {"a": ["Paper 1", "Paper 2"], "b": ["Paper 3"]}
+    assert _send(builder) == {}
+
+
+def test_skips_a_window_of_papers_already_sent(builder, paper_index):
+    paper_index.link_query("a", _papers(1, 2))
+    assert _titles(_send(builder)["u"]) == {"a": ["Paper 1", "Paper 2"]}
+
+    # A later run of query b finds the two papers already sent, then two new ones
+    paper_index.link_query("b", _papers(1, 2, 5, 6))
+    digest = _send(builder)["u"]
+
+    assert _titles(digest) == {"b": ["Paper 5", "Paper 6"]}
+    assert builder._watermarks(["b"])["b"] == paper_index.papers_since("b")[-1][0]
+
+
+def test_watermark_moves_past_papers_already_sent_without_a_digest(builder, paper_index):
+    paper_index.link_query("a", _papers(1, 2))
+    _send(builder)
+    paper_index.link_query("b", _papers(1, 2))
+
+    assert _send(builder) == {}
+    assert builder._watermarks(["b"])["b"] == paper_index.papers_since("b")[-1][0]
+
+    paper_index.link_query("b", _papers(7))
+    assert _titles(_send(builder)["u"]) == {"b": ["Paper 7"]}
+
+
+def test_papers_beyond_the_per_query_limit_are_sent_next_time(builder, paper_index):
+    paper_index.link_query("a", _papers(1, 2, 3))
+
+    assert _titles(_send(builder)["u"]) == {"a": ["Paper 1", "Paper 2"]}
+    assert _titles(_send(builder)["u"]) == {"a": ["Paper 3"]}
+
+
+def test_uncommitted_digest_is_built_again(builder, paper_index):
+    paper_index.link_query("a", _papers(1))
+
+    first = builder.build(QUERIES)
+    assert builder.build(QUERIES) == first
+
+
+def test_users_are_built_in_parallel(builder, paper_index, monkeypatch):
+    users = [f"user-{i}" for i in range(3)]
+    for i, user_id in enumerate(users):
+        paper_index.link_query(f"q-{user_id}", _papers(2 * i + 1, 2 * i + 2))
+
+    # Every user's first read waits for the others; a serial build would break the barrier
+    barrier = threading.Barrier(len(users), timeout=5)
+    waited = set()
+    papers_since = paper_index.papers_since
+
+    def concurrent_papers_since(query_id, *args):
+        if query_id not in waited:
+            waited.add(query_id)
+            barrier.wait()
+        return papers_since(query_id, *args)
+
+    monkeypatch.setattr(paper_index, "papers_since", concurrent_papers_since)
+    digests = builder.build([{"id": f"q-{user_id}", "user_id": user_id} for user_id in users])
+
+    assert {user_id: _titles(digest) for user_id, digest in digests.items()} == {
+        user_id: {f"q-{user_id}": [f"Paper {2 * i + 1}", f"Paper {2 * i + 2}"]} for i, user_id in enumerate(users)}
+    for digest in digests.values():
+        builder.commit(digest)
+    assert builder.build([{"id": f"q-{user_id}", "user_id": user_id} for user_id in users]) == {}
@@ -0,0 +1,117 @@
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import http_client
+from http_client import HttpClient, TokenBucket, _retry_after_seconds, get_openai_client
+
+
+class _Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _Session:
+    """Answers with the given status codes in turn and records each request."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        return self.responses.pop(0)
+
+
+def _client(session, **kwargs):
+    client = HttpClient(**kwargs)
+    client.session = session
+    return client
+
+
+def test_token_bucket_backs_off_multiplicatively_and_recovers_additively():
+    bucket = TokenBucket(8.0, min_rate=1.5)
+    bucket.on_throttle()
+    assert bucket.rate == 4.0 and bucket.tokens == 0.0
+    bucket.on_throttle()
+    bucket.on_throttle()
+    assert bucket.rate == 1.5
+
+    bucket.on_success()
+    assert bucket.rate == pytest.approx(2.3)
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rate == 8.0
+
+
+def test_token_bucket_waits_for_retry_after():
+    bucket = TokenBucket(1000.0)
+    bucket.on_throttle(retry_after=0.1)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_retry_after_header_as_seconds_or_date():
+    assert _retry_after_seconds(_Response(429, {"Retry-After": "2.5"})) == 2.5
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < _retry_after_seconds(_Response(429, {"Retry-After": format_datetime(later, usegmt=True)})) <= 30
+    assert _retry_after_seconds(_Response(429, {"Retry-After": "soon"})) is None
+    assert _retry_after_seconds(_Response(429)) is None
+
+
+def test_throttled_request_is_retried_and_slows_its_service():
+    session = _Session(_Response(429), _Response(429, {"Retry-After": "0"}), _Response(200))
+    client = _client(session, throttled_rate=1000.0)
+
+    response = client.get("http://api.example.test/items")
+
+    assert response.status_code == 200
+    assert len(session.requests) == 3
+    # The host had no limit; the first 429 gave it a bucket, backed off by both throttles
+    assert client._bucket("api.example.test").rate == pytest.approx(250.0 + 100.0)
+    assert client._bucket("other.example.test") is None
+
+
+def test_request_gives_up_after_max_throttle_retries():
+    throttled = [_Response(429) for _ in range(3)]
+    session = _Session(*throttled)
+    client = _client(session, max_throttle_retries=2, throttled_rate=1000.0)
+
+    assert client.post("http://api.example.test/batch", service="batch") is throttled[-1]
+    assert len(session.requests) == 3
+    assert throttled[0].closed and not throttled[-1].closed
+
+
+def test_services_use_their_own_buckets():
+    session = _Session(*[_Response(200) for _ in range(3)])
+    client = _client(session, rate_limits={"bing": 500.0})
+
+    client.get("http://host-a.test/", service="bing")
+    client.get("http://host-b.test/", service="bing")
+    client.get("http://host-c.test/")
+
+    assert set(client._buckets) == {"bing"}
+    assert client._bucket("semantic_scholar").rate == http_client.DEFAULT_RATE_LIMITS["semantic_scholar"]
+    assert client._bucket("host-c.test") is None
+
+
+def test_connection_retries_do_not_resend_posts():
+    retry = HttpClient().session.get_adapter("https://example.test").max_retries
+    assert retry.is_retry("GET", 503)
+    assert not retry.is_retry("POST", 503)
+    assert not retry.is_retry("GET", 429)
+
+
+def test_openai_clients_are_shared_per_key_and_endpoint():
+    client = get_openai_client("key-a")
+    assert get_openai_client("key-a") is client
+    assert get_openai_client("key-b") is not client
+    assert get_openai_client("key-a", "http://localhost:1/v1") is not client
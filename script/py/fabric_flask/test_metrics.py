@@ -0,0 +1,89 @@
+import contextvars
+
+import pytest
+
+import metrics
+from http_client import HttpClient
+from metrics import MetricsRegistry, get_trace_id, start_trace, timed, trace_headers
+
+
+def _in_new_context(function, *args):
+    return contextvars.Context().run(function, *args)
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Test.", ("service",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, service="x")
+
+    rendered = registry.render()
+    assert 'test_seconds_bucket{service="x",le="0.1"} 1' in rendered
+    assert 'test_seconds_bucket{service="x",le="1.0"} 2' in rendered
+    assert 'test_seconds_bucket{service="x",le="+Inf"} 3' in rendered
+    assert 'test_seconds_count{service="x"} 3' in rendered
+
+
+def test_trace_headers_follow_the_current_trace():
+    def traced():
+        assert trace_headers() == {}
+        trace_id = start_trace("abc123")
+        assert get_trace_id() == trace_id == "abc123"
+        return trace_headers()
+
+    assert _in_new_context(traced) == {"X-Request-ID": "abc123"}
+
+
+def test_timed_logs_slow_and_failed_calls_with_trace_id(monkeypatch, capsys):
+    def calls():
+        start_trace("req-1")
+        with timed("bing", "search"):
+            pass
+        monkeypatch.setattr(metrics, "SLOW_CALL_SECONDS", 0.0)
+        with timed("bing", "search"):
+            pass
+        monkeypatch.setattr(metrics, "SLOW_CALL_SECONDS", 60.0)
+        with pytest.raises(ValueError):
+            with timed("openai", "chat"):
+                raise ValueError("boom")
+
+    _in_new_context(calls)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("[trace req-1] bing search slow after ")
+    assert lines[1].startswith("[trace req-1] openai chat failed with ValueError after ")
+
+
+def test_http_client_sends_trace_id(monkeypatch):
+    client = HttpClient()
+    sent = []
+
+    class Response:
+        status_code = 200
+
+    def request(method, url, **kwargs):
+        sent.append(kwargs.get("headers"))
+        return Response()
+
+    monkeypatch.setattr(client.session, "request", request)
+
+    def calls():
+        client.get("http://example.test/")
+        start_trace("req-2")
+        client.get("http://example.test/")
+        client.get("http://example.test/", headers={"X-Request-ID": "caller", "Accept": "text/html"})
+
+    _in_new_context(calls)
+    assert sent == [None, {"X-Request-ID": "req-2"}, {"X-Request-ID": "caller", "Accept": "text/html"}]
+
+
+def test_timed_counts_failures_handled_without_raising(capsys):
+    errors = metrics.EXTERNAL_CALL_ERRORS._values
+    before = errors.get(("svc", "handled"), 0.0)
+    with timed("svc", "handled") as call:
+        call.fail("HTTP 429")
+    with timed("svc", "handled"):
+        pass
+
+    assert errors[("svc", "handled")] == before + 1
+    assert "svc handled failed with HTTP 429" in capsys.readouterr().out
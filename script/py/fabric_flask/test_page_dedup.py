@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+import page_dedup
+from page_dedup import SimHashIndex, canonicalize_url, get_page_index, hamming_distance, simhash
+
+
+def _text(seed, length=1000):
+    rng = random.Random(seed)
+    return " ".join(f"word{rng.randrange(5000)}" for _ in range(length))
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("http://www.Example.com:80/a/index.html?utm_source=x&b=2&a=1#top", "https://example.com/a?a=1&b=2"),
+    ("https://example.com/a/?fbclid=abc&gclid=def", "https://example.com/a"),
+    ("https://example.com//a//b/", "https://example.com/a/b"),
+    ("https://example.com:8443/", "https://example.com:8443/"),
+])
+def test_canonicalize_url(url, expected):
+    assert canonicalize_url(url) == expected
+
+
+def test_canonicalize_url_keeps_generic_parameters():
+    assert canonicalize_url("https://example.com/view?ref=1") != canonicalize_url("https://example.com/view?ref=2")
+    assert canonicalize_url("https://example.com/list?source=a") != canonicalize_url("https://example.com/list")
+
+
+def test_simhash_of_near_duplicates_is_close():
+    text = _text(1)
+    words = text.split()
+    edited = " ".join(words[:500] + ["edited"] + words[501:])
+    assert hamming_distance(simhash(text), simhash(edited)) <= 3
+    assert hamming_distance(simhash(text), simhash(_text(2))) > 3
+
+
+def test_index_finds_near_duplicate_and_url_aliases():
+    index = SimHashIndex()
+    text = _text(1)
+    fingerprint = index.fingerprint(text)
+    index.add("https://example.com/a", fingerprint, "topics")
+
+    twin = index.find(index.fingerprint(text + " extra"))
+    assert twin == (fingerprint, "https://example.com/a", "topics")
+    index.add_alias("https://mirror.example.org/a", fingerprint)
+    assert index.get_url("http://www.mirror.example.org/a/?utm_medium=feed")[2] == "topics"
+    assert index.find(index.fingerprint(_text(2))) is None
+    assert index.fingerprint("too short") is None
+
+
+def test_index_is_bounded_and_evicts_least_recently_used():
+    index = SimHashIndex(max_entries=2)
+    fingerprints = [index.fingerprint(_text(seed)) for seed in range(3)]
+    index.add("https://example.com/0", fingerprints[0], "t0")
+    index.add("https://example.com/1", fingerprints[1], "t1")
+    assert index.get_url("https://example.com/0") is not None  # 0 is now the most recently used
+    index.add("https://example.com/2", fingerprints[2], "t2")
+
+    assert len(index) == 2
+    assert index.get_url("https://example.com/1") is None
+    assert index.find(fingerprints[1]) is None
+    assert index.get_url("https://example.com/0")[2] == "t0"
+
+
+def test_index_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(page_dedup.time, "monotonic", lambda: now[0])
+    index = SimHashIndex(ttl_seconds=60)
+    fingerprint = index.fingerprint(_text(1))
+    index.add("https://example.com/a", fingerprint, "topics")
+
+    now[0] += 59
+    assert index.get_url("https://example.com/a") is not None
+    now[0] += 2
+    assert index.get_url("https://example.com/a") is None
+    assert index.find(fingerprint) is None
+    assert len(index) == 0
+
+
+def test_page_index_is_separate_per_extraction_setting():
+    assert get_page_index(("extract_topics", 5)) is get_page_index(("extract_topics", 5))
+    assert get_page_index(("extract_topics", 5)) is not get_page_index(("extract_topics", 10))
+    assert get_page_index(("extract_topics", 5)).ttl_seconds == page_dedup.DEFAULT_TTL_SECONDS
@@ -0,0 +1,99 @@
+import pickle
+from datetime import datetime, timezone
+
+import pytest
+
+import paper_batch
+from paper_batch import PaperBatch, _ObjectColumn
+
+PAPERS = [
+    {"entry_id": "http://arxiv.org/abs/2401.00001v1", "title": "A", "citationCount": 5,
+     "published": "2024-01-02T03:04:05Z", "authors": "Ada, Bob", "s2FieldsOfStudy": "CS|Math|",
+     "Tag_1": "graphs"},
+    {"entry_id": "http://arxiv.org/abs/2401.00002v1", "title": "B", "citationCount": None,
+     "authors": "Bob", "Tag_1": "graphs"},
+    {"entry_id": "http://arxiv.org/abs/2401.00003v1", "title": "C"},
+]
+
+
+def test_records_read_back_as_the_dicts_they_were_built_from():
+    batch = PaperBatch.from_papers(PAPERS)
+    dicts = batch.to_dicts()
+    assert dicts[0] == dict(PAPERS[0], published=datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc))
+    assert dicts[1:] == PAPERS[1:]
+
+
+def test_stored_none_is_present_and_never_set_is_absent():
+    batch = PaperBatch.from_papers(PAPERS)
+    stored_none, never_set = batch[1], batch[2]
+
+    assert "citationCount" in stored_none and stored_none["citationCount"] is None
+    assert "citationCount" not in never_set
+    with pytest.raises(KeyError):
+        never_set["citationCount"]
+    assert never_set.get("citationCount", "missing") == "missing"
+
+    never_set["citationCount"] = None
+    assert "citationCount" in never_set
+    del stored_none["citationCount"]
+    assert "citationCount" not in stored_none
+    with pytest.raises(KeyError):
+        del stored_none["citationCount"]
+
+
+def test_non_integral_float_demotes_the_int_column():
+    batch = PaperBatch.from_papers(PAPERS)
+    batch[0]["citationCount"] = 3.7
+    batch.append({"title": "D", "referenceCount": 2.0})
+
+    assert isinstance(batch.columns["citationCount"], _ObjectColumn)
+    assert [record.get("citationCount") for record in batch] == [3.7, None, None, None]
+    assert batch[3]["referenceCount"] == 2
+
+
+def test_export_seals_the_batch_and_shares_its_buffers():
+    pytest.importorskip("pyarrow")
+    batch = PaperBatch.from_papers(PAPERS)
+    table = batch.to_arrow()
+
+    assert batch.sealed
+    with pytest.raises(RuntimeError):
+        batch.append({"title": "D"})
+    with pytest.raises(RuntimeError):
+        batch[0]["authors"] = "Ada, Bob, Cy"
+    with pytest.raises(RuntimeError):
+        del batch[0]["title"]
+
+    citations = table.column("citationCount").chunk(0)
+    assert citations.buffers()[1].address == batch.columns["citationCount"].data.buffer_info()[0]
+    assert citations.to_pylist() == [5, None, None]
+    assert table.column("authors").to_pylist() == [["Ada", "Bob"], ["Bob"], None]
+    assert batch.to_arrow() is table
+    assert len(batch.to_pandas()) == 3
+
+    # A copy of a sealed batch can keep changing
+    copy = PaperBatch.from_papers(batch)
+    copy.append({"title": "D", "citationCount": 1})
+    assert copy.to_arrow().num_rows == 4 and table.num_rows == 3
+
+
+def test_to_pandas_without_pyarrow(monkeypatch):
+    pytest.importorskip("pandas")
+    monkeypatch.setattr(paper_batch, "pa", None)
+    batch = PaperBatch.from_papers(PAPERS)
+    frame = batch.to_pandas()
+
+    assert batch.sealed
+    assert list(frame["title"]) == ["A", "B", "C"]
+    assert frame["citationCount"].isna().tolist() == [False, True, True]
+    assert list(frame["Tag_1"].cat.categories) == ["graphs"]
+
+
+def test_pickle_round_trip_keeps_presence():
+    batch = PaperBatch.from_papers(PAPERS)
+    copy = pickle.loads(pickle.dumps(batch))
+
+    assert copy.to_dicts() == batch.to_dicts()
+    assert "citationCount" in copy[1] and "citationCount" not in copy[2]
+    copy.append({"title": "D", "Tag_1": "graphs"})
+    assert copy.columns["Tag_1"].dictionary == ["graphs"]
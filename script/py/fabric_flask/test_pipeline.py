@@ -0,0 +1,110 @@
+import csv
+import os
+import time
+
+import pytest
+
+import pipeline
+from paper_index import PaperIndex
+
+
+def _paper(number):
+    return {"entry_id": f"http://arxiv.org/abs/2401.{number:05d}v1", "title": f"Paper {number}",
+            "summary": f"Summary {number}"}
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    """Replace the arXiv, Semantic Scholar and OpenAI stage functions with local ones."""
+    calls = {"enrich": [], "tag": []}
+    results = {}  # query text -> (delay, papers)
+    enrich_delays = {}  # paper number -> delay
+
+    def search_task(queries, paper_num, date_from, date_to):
+        delay, papers = results[queries[0]]
+        time.sleep(delay)
+        return [dict(paper) for paper in papers]
+
+    def enrich_task(papers):
+        for paper in papers:
+            calls["enrich"].append(paper["entry_id"])
+            time.sleep(enrich_delays.get(paper["title"], 0))
+            paper["citationCount"] = 7
+        return papers
+
+    def tag_task(papers):
+        for paper in papers:
+            calls["tag"].append(paper["entry_id"])
+            paper.update({f"Tag_{i}": f"tag {i}" for i in range(1, 6)})
+        return papers
+
+    monkeypatch.setattr(pipeline, "_init_worker", lambda config: None)
+    monkeypatch.setattr(pipeline, "_search_task", search_task)
+    monkeypatch.setattr(pipeline, "_enrich_task", enrich_task)
+    monkeypatch.setattr(pipeline, "_tag_task", tag_task)
+    return calls, results, enrich_delays
+
+
+def _read(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        return {row["entry_id"]: row for row in csv.DictReader(file)}
+
+
+def test_shared_paper_waits_for_queued_task_of_lower_priority_query(tmp_path, stages):
+    calls, results, enrich_delays = stages
+    shared = _paper(1)
+    # C holds the only enrich slot while A (found the shared paper first) and B queue behind it
+    results["c"] = (0.0, [_paper(3)])
+    results["a"] = (0.02, [shared])
+    results["b"] = (0.1, [shared])
+    enrich_delays["Paper 3"] = 0.3
+
+    runner = pipeline.ArxivPipelineRunner(
+        output_dir=str(tmp_path), max_workers=4, stage_limits={"search": 3, "enrich": 1},
+        openai_api_key="test", paper_index=PaperIndex(str(tmp_path / "index.sqlite")))
+    outputs = runner.run([
+        {"id": "C", "query_text": "c", "priority": 2},
+        {"id": "A", "query_text": "a", "priority": 0},
+        {"id": "B", "query_text": "b", "priority": 2},
+    ])
+
+    for query_id in ("A", "B", "C"):
+        for row in _read(outputs[query_id]).values():
+            assert row["citationCount"] == "7", (query_id, row["entry_id"])
+            assert row["Tag_1"] == "tag 1", (query_id, row["entry_id"])
+    assert sorted(calls["enrich"]) == sorted(set(calls["enrich"]))
+    assert sorted(calls["tag"]) == sorted(set(calls["tag"]))
+    assert calls["enrich"].count(shared["entry_id"]) == 1
+
+
+def test_papers_completed_by_earlier_run_are_restored(tmp_path, stages):
+    calls, results, _ = stages
+    results["a"] = (0.0, [_paper(1), _paper(2)])
+    index = PaperIndex(str(tmp_path / "index.sqlite"))
+    runner = pipeline.ArxivPipelineRunner(output_dir=str(tmp_path), openai_api_key="test", paper_index=index)
+    runner.run([{"id": "A", "query_text": "a"}])
+    calls["enrich"].clear()
+    calls["tag"].clear()
+
+    results["b"] = (0.0, [_paper(2), _paper(3)])
+    outputs = runner.run([{"id": "B", "query_text": "b"}])
+
+    assert calls["enrich"] == [_paper(3)["entry_id"]]
+    assert calls["tag"] == [_paper(3)["entry_id"]]
+    rows = _read(outputs["B"])
+    assert rows[_paper(2)["entry_id"]]["Tag_5"] == "tag 5"
+    assert os.path.basename(outputs["B"]) == "_B.csv"
+
+
+def test_split_query_text():
+    assert pipeline.split_query_text("['a', ' b ', 'a', '']") == ["a", "b"]
+    assert pipeline.split_query_text(["x", "y"]) == ["x", "y"]
+    assert pipeline.split_query_text("single") == ["single"]
+    assert pipeline.split_query_text(None) == []
+
+
+@pytest.mark.parametrize("stage_limits", [{"enrich": 0}, {"tag": -1}, {"search": 1.5}, {"search": True},
+                                          {"download": 2}])
+def test_invalid_stage_limits_are_rejected(tmp_path, stage_limits):
+    with pytest.raises(ValueError):
+        pipeline.ArxivPipelineRunner(output_dir=str(tmp_path), openai_api_key="test", stage_limits=stage_limits)
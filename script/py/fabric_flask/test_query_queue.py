@@ -0,0 +1,178 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+import cosmos
+from query_queue import (LocalQueryStore, QueryWorkQueue, STATUS_COMPLETED, STATUS_FAILED, STATUS_PENDING,
+                         STATUS_PROCESSING)
+from stub_services import LocalCosmosClient, ServiceProfile
+
+
+def _document(document_id, priority=0):
+    return {"id": document_id, "query_text": document_id, "priority": priority, "status": STATUS_PENDING,
+            "metadata": {"created_at": "2024-01-01T00:00:00+00:00"}}
+
+
+def _stored(store, document_id):
+    items, _ = store.read_change_feed(start_from_beginning=True)
+    return next(item for item in items if item["id"] == document_id)
+
+
+@pytest.fixture
+def store():
+    return LocalQueryStore()
+
+
+@pytest.fixture
+def cosmos_store(monkeypatch):
+    monkeypatch.setattr(cosmos, "CosmosClient", LocalCosmosClient)
+    monkeypatch.setattr(LocalCosmosClient, "profile", ServiceProfile(latency_ms=0.0, jitter_ms=0.0))
+    return cosmos.CosmosDBClient(url="local", key="", database_name=f"test-{uuid.uuid4().hex}",
+                                 container_name="query", partition_key="partitionKey")
+
+
+def test_claims_highest_priority_first(store):
+    store.create_document(_document("low", priority=0))
+    store.create_document(_document("high", priority=2))
+    queue = QueryWorkQueue(store, worker_id="a")
+    assert queue.poll() == 2
+
+    claimed = queue.claim()
+    assert claimed["id"] == "high"
+    assert claimed["status"] == STATUS_PROCESSING
+    assert claimed["lease_owner"] == "a"
+    assert claimed["attempts"] == 1
+    assert queue.claim()["id"] == "low"
+    assert queue.claim() is None
+
+
+def test_stale_heap_entry_does_not_lose_document_before_lease_expires(store):
+    store.create_document(_document("q"))
+    a = QueryWorkQueue(store, worker_id="a", lease_seconds=0.2)
+    b = QueryWorkQueue(store, worker_id="b", lease_seconds=0.2)
+    a.poll()
+    b.poll()
+    assert a.claim()["id"] == "q"
+
+    # b still holds a heap entry of the pending version; the claim by a turns it stale
+    b.poll()
+    assert b.claim() is None
+
+    time.sleep(0.3)  # a crashed without heart-beating
+    assert b.poll() == 1
+    reclaimed = b.claim()
+    assert reclaimed["id"] == "q"
+    assert reclaimed["lease_owner"] == "b"
+    assert reclaimed["attempts"] == 2
+
+
+def test_completion_after_lost_lease_is_dropped(store):
+    store.create_document(_document("q"))
+    a = QueryWorkQueue(store, worker_id="a", lease_seconds=0.1)
+    b = QueryWorkQueue(store, worker_id="b", lease_seconds=60)
+    a.poll()
+    claimed_by_a = a.claim()
+    time.sleep(0.2)
+    b.poll()
+    claimed_by_b = b.claim()
+    assert claimed_by_b["lease_owner"] == "b"
+
+    a.complete(claimed_by_a)
+    assert a.flush() == 0
+    current = _stored(store, "q")
+    assert current["status"] == STATUS_PROCESSING
+    assert current["lease_owner"] == "b"
+
+    b.complete(claimed_by_b)
+    assert b.flush() == 1
+    assert _stored(store, "q")["status"] == STATUS_COMPLETED
+
+
+def test_cosmos_completions_are_conditional_on_the_lease(cosmos_store):
+    for i in range(3):
+        cosmos_store.create_document(_document(f"q{i}"))
+    a = QueryWorkQueue(cosmos_store, worker_id="a", lease_seconds=60)
+    a.poll()
+    claimed = [a.claim() for _ in range(3)]
+
+    # Another worker takes over q1 (e.g. after a missed heartbeat); the batch must not clobber it
+    taken = dict(claimed[1], lease_owner="b")
+    assert cosmos_store.replace_document(taken, claimed[1]["_etag"]) is not None
+
+    for document in claimed:
+        a.complete(document)
+    assert a.flush() == 2
+    statuses = {item["id"]: (item["status"], item.get("lease_owner"))
+                for item in cosmos_store.list_all_documents()}
+    assert statuses == {"q0": (STATUS_COMPLETED, "a"), "q1": (STATUS_PROCESSING, "b"),
+                        "q2": (STATUS_COMPLETED, "a")}
+
+
+def test_release_marks_document_failed_after_max_attempts(store):
+    store.create_document(_document("q"))
+    queue = QueryWorkQueue(store, worker_id="a", max_attempts=2)
+    queue.poll()
+    released = queue.release(queue.claim(), "boom")
+    assert released["status"] == STATUS_PENDING
+
+    queue.poll()
+    failed = queue.release(queue.claim(), "boom again")
+    assert failed["status"] == STATUS_FAILED
+    assert failed["attempts"] == 2
+    assert failed["last_error"] == "boom again"
+    assert queue.poll() == 0
+    assert queue.claim() is None
+
+
+def test_abandoned_document_is_marked_failed_after_max_attempts(store):
+    store.create_document(_document("q"))
+    queue = QueryWorkQueue(store, worker_id="a", lease_seconds=0.05, max_attempts=1)
+    queue.poll()
+    assert queue.claim()["attempts"] == 1
+
+    time.sleep(0.1)  # the worker never completes nor releases it
+    queue.poll()
+    assert queue.claim() is None
+    assert _stored(store, "q")["status"] == STATUS_FAILED
+
+
+def test_run_stops_retrying_a_failing_handler(store):
+    store.create_document(_document("bad"))
+    store.create_document(_document("good"))
+    queue = QueryWorkQueue(store, worker_id="a", max_attempts=3)
+    stop_event = threading.Event()
+    calls = []
+
+    def handler(document):
+        calls.append(document["id"])
+        if document["id"] == "bad":
+            raise ValueError("always fails")
+
+    worker = threading.Thread(target=queue.run, args=(handler, stop_event), kwargs={"poll_interval": 0.01})
+    worker.start()
+    deadline = time.time() + 5
+    while time.time() < deadline and _stored(store, "bad")["status"] != STATUS_FAILED:
+        time.sleep(0.01)
+    stop_event.set()
+    worker.join()
+
+    assert calls.count("bad") == 3
+    assert _stored(store, "bad")["status"] == STATUS_FAILED
+    assert _stored(store, "bad")["last_error"] == "always fails"
+    assert _stored(store, "good")["status"] == STATUS_COMPLETED
+
+
+def test_completion_is_written_before_the_lease_runs_out_without_polling(store):
+    store.create_document(_document("q"))
+    a = QueryWorkQueue(store, worker_id="a", lease_seconds=0.3)
+    b = QueryWorkQueue(store, worker_id="b", lease_seconds=0.3)
+    a.poll()
+    a.complete(a.claim())
+
+    time.sleep(0.4)  # a stalls: no poll, heartbeat or flush until after its lease expired
+    assert _stored(store, "q")["status"] == STATUS_COMPLETED
+    b.poll()
+    assert b.claim() is None
+    assert a.flush() == 0
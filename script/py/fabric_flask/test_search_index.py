@@ -0,0 +1,69 @@
+import csv
+import threading
+import time
+
+from search_index import PaperSearchIndex, date_number
+
+
+def _paper(number, title, published="2024-01-15"):
+    return {"entry_id": f"http://arxiv.org/abs/2401.{number:05d}v1", "title": title, "summary": "",
+            "published": published, "Tag_1": ""}
+
+
+def _write_csv(path, papers):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=list(papers[0]))
+        writer.writeheader()
+        writer.writerows(papers)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_search_ranks_by_bm25_and_filters_dates():
+    index = PaperSearchIndex()
+    index.add_papers([_paper(1, "Graph neural networks", "2023-05-01"),
+                      _paper(2, "Graph neural networks for molecules"),
+                      _paper(3, "Protein folding")])
+
+    assert [hit["title"] for hit in index.search("molecule graphs")][0] == "Graph neural networks for molecules"
+    assert [hit["title"] for hit in index.search("graph", date_from="2024-01")] == [
+        "Graph neural networks for molecules"]
+    assert len(index.search("", k=2)) == 2
+    # A bound that is not a date does not filter
+    assert len(index.search("graph", date_to="someday")) == 2
+
+
+def test_reindexed_paper_replaces_its_earlier_version():
+    index = PaperSearchIndex()
+    index.add_papers([_paper(1, "Graph neural networks")])
+    index.add_papers([_paper(1, "Protein folding")])
+
+    assert len(index) == 1
+    assert index.search("graph") == []
+    assert index.search("protein")[0]["title"] == "Protein folding"
+
+
+def test_date_number():
+    assert date_number("2024-03-05T10:00:00") == 20240305
+    assert date_number("202403", end=True) == 20240331
+    assert date_number("") == 0
+
+
+def test_background_refresh_picks_up_new_output(tmp_path):
+    index = PaperSearchIndex()
+    stop = threading.Event()
+    thread = index.start_refresh(str(tmp_path), interval=0.01, stop_event=stop)
+    try:
+        assert index.start_refresh(str(tmp_path), interval=0.01) is thread
+        _write_csv(tmp_path / "_query1.csv", [_paper(1, "Graph neural networks")])
+        _wait_for(lambda: len(index) == 1)
+        assert index.search("graph")[0]["title"] == "Graph neural networks"
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+    assert not thread.is_alive()